@@ -0,0 +1,163 @@
+// Attitude maintenance cadence benchmark
+//
+// Runs the same synthetic 400 Hz IMU stream through the filter with different
+// orthonormalization / gravity correction intervals and attitude modes, and
+// reports throughput against attitude drift relative to the every-sample run.
+//
+// Build (from the repository root):
+//   gcc -O2 -I. -o bench/bench_maintenance bench/bench_maintenance.c matrix.c eskf.c -lm
+// Run:
+//   ./bench/bench_maintenance [seconds]
+
+#include "eskf.h"
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#define IMU_RATE_HZ 400.0
+
+typedef struct {
+    int attitude_mode;
+    int orthonormalize_interval;
+    int gravity_correction_interval;
+} bench_case_t;
+
+typedef struct {
+    double ns_per_sample;
+    eskf_state_t final_state;
+} bench_result_t;
+
+static double now_seconds(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec + (double)ts.tv_nsec * 1e-9;
+}
+
+// Deterministic noise so every case sees the identical stream
+static float noise(unsigned int* seed, float sigma) {
+    *seed = *seed * 1664525u + 1013904223u;
+    return sigma * ((float)(*seed >> 8) / (float)(1u << 24) - 0.5f) * 3.4641f;
+}
+
+static void synth_imu(imu_data_t* imu, int i, unsigned int* seed) {
+    double t = 1.0 + i / IMU_RATE_HZ;
+
+    imu->timestamp = t;
+    imu->acc.data[0] = 0.3f * (float)sin(0.05 * t) + noise(seed, 0.05f);
+    imu->acc.data[1] = 0.1f * (float)sin(0.2 * t) + noise(seed, 0.05f);
+    imu->acc.data[2] = 9.81f + noise(seed, 0.05f);
+    imu->gyro.data[0] = noise(seed, 0.002f);
+    imu->gyro.data[1] = noise(seed, 0.002f);
+    imu->gyro.data[2] = 0.02f * (float)sin(0.1 * t) + noise(seed, 0.002f);
+}
+
+static int run_case(const bench_case_t* c, int samples, bench_result_t* result) {
+    eskf_t* eskf = eskf_create();
+    if (!eskf) return 0;
+
+    eskf_set_attitude_mode(eskf, c->attitude_mode);
+    eskf_set_maintenance(eskf, c->orthonormalize_interval, c->gravity_correction_interval);
+
+    unsigned int seed = 12345u;
+    imu_data_t imu;
+
+    // Fill the initialization buffer, then initialize with one GPS fix
+    for (int i = 0; i < 20; i++) {
+        synth_imu(&imu, i, &seed);
+        eskf_process_imu(eskf, &imu);
+    }
+    gps_data_t gps;
+    memset(&gps, 0, sizeof(gps));
+    gps.timestamp = imu.timestamp;
+    gps.lat = 37.5;
+    gps.lon = 126.9;
+    gps.satellites = 10;
+    eskf_process_gps(eskf, &gps);
+
+    double start = now_seconds();
+    for (int i = 20; i < samples + 20; i++) {
+        synth_imu(&imu, i, &seed);
+        eskf_process_imu(eskf, &imu);
+    }
+    double elapsed = now_seconds() - start;
+
+    result->ns_per_sample = elapsed / samples * 1e9;
+    eskf_get_state(eskf, &result->final_state);
+
+    eskf_destroy(eskf);
+    return 1;
+}
+
+// Angle of R_a^T * R_b in degrees
+static double attitude_difference_deg(const mat3_t* a, const mat3_t* b) {
+    double trace = 0.0;
+    for (int i = 0; i < 3; i++) {
+        for (int k = 0; k < 3; k++) {
+            trace += (double)a->data[k][i] * b->data[k][i];
+        }
+    }
+    double c = fmax(-1.0, fmin(1.0, (trace - 1.0) * 0.5));
+    return acos(c) * 180.0 / M_PI;
+}
+
+// Frobenius norm of R^T R - I
+static double orthonormality_error(const mat3_t* R) {
+    double err = 0.0;
+    for (int i = 0; i < 3; i++) {
+        for (int j = 0; j < 3; j++) {
+            double dot = 0.0;
+            for (int k = 0; k < 3; k++) {
+                dot += (double)R->data[k][i] * R->data[k][j];
+            }
+            double d = dot - (i == j ? 1.0 : 0.0);
+            err += d * d;
+        }
+    }
+    return sqrt(err);
+}
+
+int main(int argc, char** argv) {
+    double seconds = argc > 1 ? atof(argv[1]) : 600.0;
+    int samples = (int)(seconds * IMU_RATE_HZ);
+
+    static const bench_case_t cases[] = {
+        {ESKF_ATTITUDE_MATRIX, 1, 1},
+        {ESKF_ATTITUDE_MATRIX, 10, 1},
+        {ESKF_ATTITUDE_MATRIX, 100, 1},
+        {ESKF_ATTITUDE_MATRIX, 1, 10},
+        {ESKF_ATTITUDE_MATRIX, 10, 10},
+        {ESKF_ATTITUDE_MATRIX, 100, 100},
+        {ESKF_ATTITUDE_QUATERNION, 1, 1},
+        {ESKF_ATTITUDE_QUATERNION, 1, 10},
+        {ESKF_ATTITUDE_QUATERNION, 1, 100},
+    };
+    int case_count = (int)(sizeof(cases) / sizeof(cases[0]));
+
+    printf("ESKF maintenance cadence benchmark (%.0f s at %.0f Hz, %d samples)\n",
+           seconds, IMU_RATE_HZ, samples);
+    printf("%-10s %6s %6s %12s %14s %12s %14s\n",
+           "mode", "ortho", "grav", "ns/sample", "samples/s", "drift_deg", "ortho_error");
+
+    bench_result_t reference;
+    for (int i = 0; i < case_count; i++) {
+        bench_result_t result;
+        if (!run_case(&cases[i], samples, &result)) {
+            fprintf(stderr, "Failed to create ESKF instance\n");
+            return 1;
+        }
+        if (i == 0) {
+            reference = result;
+        }
+
+        printf("%-10s %6d %6d %12.1f %14.0f %12.6f %14.3e\n",
+               cases[i].attitude_mode == ESKF_ATTITUDE_QUATERNION ? "quaternion" : "matrix",
+               cases[i].orthonormalize_interval,
+               cases[i].gravity_correction_interval,
+               result.ns_per_sample,
+               1e9 / result.ns_per_sample,
+               attitude_difference_deg(&reference.final_state.G_R_I, &result.final_state.G_R_I),
+               orthonormality_error(&result.final_state.G_R_I));
+    }
+
+    return 0;
+}
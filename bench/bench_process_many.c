@@ -0,0 +1,131 @@
+// Multi-instance throughput benchmark for eskf_process_many
+//
+// Advances a set of independent filters, each on its own synthetic 400 Hz
+// IMU stream with 1 Hz GPS and one shared railway map, and reports the
+// wall time for increasing OpenMP thread counts.
+//
+// Build (from the repository root):
+//   gcc -O2 -fopenmp -I. -o bench/bench_process_many bench/bench_process_many.c matrix.c eskf.c -lm
+// Run:
+//   ./bench/bench_process_many [instances] [seconds]
+
+#include "eskf.h"
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+#define IMU_RATE_HZ 400.0
+#define RAIL_NODES 1000
+#define START_LAT 37.5
+#define START_LON 126.9
+
+static double now_seconds(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec + (double)ts.tv_nsec * 1e-9;
+}
+
+// Deterministic noise, one seed per instance
+static float noise(unsigned int* seed, float sigma) {
+    *seed = *seed * 1664525u + 1013904223u;
+    return sigma * ((float)(*seed >> 8) / (float)(1u << 24) - 0.5f) * 3.4641f;
+}
+
+// Straight track heading north-east, 10 m between nodes
+static void build_rail_map(rail_node_t* nodes) {
+    for (int i = 0; i < RAIL_NODES; i++) {
+        nodes[i].lat = START_LAT + i * 10.0 * 0.7071 / 111195.0;
+        nodes[i].lon = START_LON + i * 10.0 * 0.7071 / (111195.0 * 0.7934);
+    }
+}
+
+static void build_stream(eskf_stream_t* stream, int samples, unsigned int seed) {
+    imu_data_t* imu = (imu_data_t*)malloc(samples * sizeof(imu_data_t));
+    int gps_count = (int)(samples / IMU_RATE_HZ) + 1;
+    gps_data_t* gps = (gps_data_t*)calloc(gps_count, sizeof(gps_data_t));
+
+    for (int i = 0; i < samples; i++) {
+        double t = 1.0 + i / IMU_RATE_HZ;
+        imu[i].timestamp = t;
+        imu[i].acc.data[0] = 0.3f * (float)sin(0.05 * t) + noise(&seed, 0.05f);
+        imu[i].acc.data[1] = 0.1f * (float)sin(0.2 * t) + noise(&seed, 0.05f);
+        imu[i].acc.data[2] = 9.81f + noise(&seed, 0.05f);
+        imu[i].gyro.data[0] = noise(&seed, 0.002f);
+        imu[i].gyro.data[1] = noise(&seed, 0.002f);
+        imu[i].gyro.data[2] = noise(&seed, 0.002f);
+    }
+    for (int k = 0; k < gps_count; k++) {
+        gps[k].timestamp = 1.0 + 0.05 + k;
+        gps[k].lat = START_LAT + noise(&seed, 2e-5f);
+        gps[k].lon = START_LON + noise(&seed, 2e-5f);
+        gps[k].satellites = (k / 30) % 2 ? 6 : 10;  // Alternate good/poor GPS every 30 s
+    }
+
+    stream->imu = imu;
+    stream->imu_count = samples;
+    stream->gps = gps;
+    stream->gps_count = gps_count;
+    stream->states = NULL;
+}
+
+int main(int argc, char** argv) {
+    int instances = argc > 1 ? atoi(argv[1]) : 64;
+    double seconds = argc > 2 ? atof(argv[2]) : 60.0;
+    int samples = (int)(seconds * IMU_RATE_HZ);
+
+    int max_threads = 1;
+#ifdef _OPENMP
+    max_threads = omp_get_max_threads();
+#endif
+
+    rail_node_t* rail = (rail_node_t*)malloc(RAIL_NODES * sizeof(rail_node_t));
+    eskf_stream_t* streams = (eskf_stream_t*)calloc(instances, sizeof(eskf_stream_t));
+    if (!rail || !streams) {
+        fprintf(stderr, "Out of memory\n");
+        return 1;
+    }
+    build_rail_map(rail);
+    for (int i = 0; i < instances; i++) {
+        build_stream(&streams[i], samples, 1000u + (unsigned int)i);
+    }
+
+    printf("eskf_process_many benchmark (%d instances, %.0f s at %.0f Hz each)\n",
+           instances, seconds, IMU_RATE_HZ);
+    printf("%8s %12s %16s %10s\n", "threads", "wall_s", "samples/s", "speedup");
+
+    double single_thread_time = 0.0;
+    for (int threads = 1; ; threads = threads * 2 < max_threads ? threads * 2 : max_threads) {
+        for (int i = 0; i < instances; i++) {
+            streams[i].eskf = eskf_create();
+            eskf_share_rail_nodes(streams[i].eskf, rail, RAIL_NODES);
+        }
+
+        double start = now_seconds();
+        int processed = eskf_process_many(streams, instances, threads);
+        double elapsed = now_seconds() - start;
+
+        if (threads == 1) {
+            single_thread_time = elapsed;
+        }
+        printf("%8d %12.3f %16.0f %10.2f\n", threads, elapsed,
+               processed / elapsed, single_thread_time / elapsed);
+
+        for (int i = 0; i < instances; i++) {
+            eskf_destroy(streams[i].eskf);
+        }
+        if (threads == max_threads) {
+            break;  // Doubling up to, and always finishing with, all threads
+        }
+    }
+
+    for (int i = 0; i < instances; i++) {
+        free((void*)streams[i].imu);
+        free((void*)streams[i].gps);
+    }
+    free(streams);
+    free(rail);
+    return 0;
+}
@@ -0,0 +1,273 @@
+// Per-call latency benchmark for the filter steps
+//
+// Times imu_predict, gps_update, find_closest_rail_point (per railway map
+// size), eskf_get_state and the public process calls one call at a time,
+// and prints throughput and latency percentiles as JSON. eskf.c is
+// included directly so the internal (static) steps can be timed in
+// isolation; bench/bench_suite.py runs this and compares with a baseline.
+//
+// Build (from the repository root):
+//   gcc -O2 -I. -o bench/bench_suite bench/bench_suite.c matrix.c -lm
+// Run:
+//   ./bench/bench_suite [iterations]
+
+#include "../eskf.c"
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#define IMU_RATE_HZ 400.0
+#define START_LAT 37.5
+#define START_LON 126.9
+
+typedef void (*bench_fn)(void* ctx, int i);
+
+static double now_seconds(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec + (double)ts.tv_nsec * 1e-9;
+}
+
+static double now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec * 1e9 + (double)ts.tv_nsec;
+}
+
+// Deterministic noise so every run sees the identical inputs
+static float noise(unsigned int* seed, float sigma) {
+    *seed = *seed * 1664525u + 1013904223u;
+    return sigma * ((float)(*seed >> 8) / (float)(1u << 24) - 0.5f) * 3.4641f;
+}
+
+static void synth_imu(imu_data_t* imu, int i, unsigned int* seed) {
+    double t = 1.0 + i / IMU_RATE_HZ;
+
+    imu->timestamp = t;
+    imu->acc.data[0] = 0.3f * (float)sin(0.05 * t) + noise(seed, 0.05f);
+    imu->acc.data[1] = 0.1f * (float)sin(0.2 * t) + noise(seed, 0.05f);
+    imu->acc.data[2] = 9.81f + noise(seed, 0.05f);
+    imu->gyro.data[0] = noise(seed, 0.002f);
+    imu->gyro.data[1] = noise(seed, 0.002f);
+    imu->gyro.data[2] = 0.02f * (float)sin(0.1 * t) + noise(seed, 0.002f);
+}
+
+static void synth_gps(gps_data_t* gps, double timestamp, unsigned int* seed) {
+    memset(gps, 0, sizeof(*gps));
+    gps->timestamp = timestamp;
+    gps->lat = START_LAT + noise(seed, 2e-5f);
+    gps->lon = START_LON + noise(seed, 2e-5f);
+    gps->satellites = 10;
+}
+
+// Straight track heading north-east through the start point, 10 m between nodes
+static rail_node_t* build_rail_map(int count) {
+    rail_node_t* nodes = (rail_node_t*)malloc(count * sizeof(rail_node_t));
+    if (!nodes) return NULL;
+    for (int i = 0; i < count; i++) {
+        double s = (i - count / 2) * 10.0;
+        nodes[i].lat = START_LAT + s * 0.7071 / 111195.0;
+        nodes[i].lon = START_LON + s * 0.7071 / (111195.0 * 0.7934);
+    }
+    return nodes;
+}
+
+// Filter with room for rail_nodes nodes, initialized with one GPS fix
+static eskf_t* create_initialized(int rail_nodes, void** memory) {
+    eskf_capacity_t capacity = {
+        .max_rail_nodes = rail_nodes > MAX_RAIL_NODES ? rail_nodes : MAX_RAIL_NODES,
+        .imu_buffer_size = IMU_BUFFER_SIZE,
+        .copy_rail_nodes = 1,
+        .history_size = ESKF_HISTORY_SIZE,        // Same capacities as eskf_create
+        .delay_buffer_size = ESKF_DELAY_BUFFER_SIZE,
+    };
+    size_t size = eskf_required_size(&capacity);
+    *memory = malloc(size);
+    eskf_t* eskf = *memory ? eskf_init(*memory, size, &capacity) : NULL;
+    if (!eskf) return NULL;
+
+    if (rail_nodes > 0) {
+        rail_node_t* nodes = build_rail_map(rail_nodes);
+        eskf_load_rail_nodes(eskf, nodes, rail_nodes);
+        free(nodes);
+    }
+
+    unsigned int seed = 12345u;
+    imu_data_t imu;
+    for (int i = 0; i < 20; i++) {
+        synth_imu(&imu, i, &seed);
+        eskf_process_imu(eskf, &imu);
+    }
+    gps_data_t gps;
+    synth_gps(&gps, imu.timestamp, &seed);
+    eskf_process_gps(eskf, &gps);
+    return eskf;
+}
+
+// Benchmark inputs, generated before timing
+typedef struct {
+    eskf_t* eskf;
+    imu_data_t* imu;
+    gps_data_t* gps;
+    vec3_t* positions;
+    eskf_state_t state;
+    float sink;
+} bench_ctx_t;
+
+static void bench_imu_predict(void* p, int i) {
+    bench_ctx_t* ctx = (bench_ctx_t*)p;
+    imu_predict(ctx->eskf, &ctx->imu[i]);
+    ctx->eskf->last_imu = ctx->imu[i];
+}
+
+static void bench_gps_update(void* p, int i) {
+    bench_ctx_t* ctx = (bench_ctx_t*)p;
+    gps_update(ctx->eskf, &ctx->gps[i]);
+}
+
+static void bench_find_closest_rail_point(void* p, int i) {
+    bench_ctx_t* ctx = (bench_ctx_t*)p;
+    float east, north;
+    int segment;
+    ctx->sink += find_closest_rail_point(ctx->eskf, &ctx->positions[i], 0, ctx->eskf->rail_node_count - 2,
+                                         &east, &north, &segment);
+}
+
+static void bench_get_state(void* p, int i) {
+    bench_ctx_t* ctx = (bench_ctx_t*)p;
+    (void)i;
+    eskf_get_state(ctx->eskf, &ctx->state);
+}
+
+static void bench_process_imu(void* p, int i) {
+    bench_ctx_t* ctx = (bench_ctx_t*)p;
+    eskf_process_imu(ctx->eskf, &ctx->imu[i]);
+}
+
+static void bench_process_gps(void* p, int i) {
+    bench_ctx_t* ctx = (bench_ctx_t*)p;
+    eskf_process_gps(ctx->eskf, &ctx->gps[i]);
+}
+
+static int compare_double(const void* a, const void* b) {
+    double x = *(const double*)a, y = *(const double*)b;
+    return (x > y) - (x < y);
+}
+
+static double percentile(const double* sorted, int count, double p) {
+    int index = (int)(p / 100.0 * (count - 1) + 0.5);
+    return sorted[index];
+}
+
+static int first_result = 1;
+
+// Time every call separately and print one JSON result object
+static void run_bench(const char* name, const char* param_name, int param,
+                      bench_fn fn, void* ctx, int iterations, double* latencies) {
+    double start = now_seconds();
+    for (int i = 0; i < iterations; i++) {
+        double t0 = now_ns();
+        fn(ctx, i);
+        latencies[i] = now_ns() - t0;
+    }
+    double elapsed = now_seconds() - start;
+
+    double sum = 0.0;
+    for (int i = 0; i < iterations; i++) sum += latencies[i];
+    qsort(latencies, iterations, sizeof(double), compare_double);
+
+    printf("%s    {\"name\": \"%s\", \"params\": {", first_result ? "" : ",\n", name);
+    if (param_name) printf("\"%s\": %d", param_name, param);
+    printf("}, \"iterations\": %d, \"ops_per_sec\": %.1f, \"mean_ns\": %.1f, "
+           "\"p50_ns\": %.1f, \"p90_ns\": %.1f, \"p99_ns\": %.1f, \"p999_ns\": %.1f, \"max_ns\": %.1f}",
+           iterations, iterations / elapsed, sum / iterations,
+           percentile(latencies, iterations, 50.0), percentile(latencies, iterations, 90.0),
+           percentile(latencies, iterations, 99.0), percentile(latencies, iterations, 99.9),
+           latencies[iterations - 1]);
+    first_result = 0;
+}
+
+int main(int argc, char** argv) {
+    int iterations = argc > 1 ? atoi(argv[1]) : 100000;
+    if (iterations < 1) iterations = 1;
+    static const int rail_sizes[] = {100, 1000, 5000, 20000};
+
+    bench_ctx_t ctx;
+    memset(&ctx, 0, sizeof(ctx));
+    ctx.imu = (imu_data_t*)malloc(iterations * sizeof(imu_data_t));
+    ctx.gps = (gps_data_t*)malloc(iterations * sizeof(gps_data_t));
+    ctx.positions = (vec3_t*)malloc(iterations * sizeof(vec3_t));
+    double* latencies = (double*)malloc(iterations * sizeof(double));
+    if (!ctx.imu || !ctx.gps || !ctx.positions || !latencies) {
+        fprintf(stderr, "Out of memory\n");
+        return 1;
+    }
+
+    unsigned int seed = 777u;
+    for (int i = 0; i < iterations; i++) {
+        synth_imu(&ctx.imu[i], 20 + i, &seed);
+        synth_gps(&ctx.gps[i], ctx.imu[i].timestamp, &seed);
+    }
+
+    // Timer overhead, reported so tiny latencies can be read correctly
+    for (int i = 0; i < iterations; i++) {
+        double t0 = now_ns();
+        latencies[i] = now_ns() - t0;
+    }
+    qsort(latencies, iterations, sizeof(double), compare_double);
+
+    printf("{\n  \"iterations\": %d,\n  \"timer_overhead_ns\": %.1f,\n  \"results\": [\n",
+           iterations, percentile(latencies, iterations, 50.0));
+
+    void* memory;
+    ctx.eskf = create_initialized(0, &memory);
+    if (!ctx.eskf) {
+        fprintf(stderr, "ESKF allocation failed\n");
+        return 1;
+    }
+    run_bench("imu_predict", NULL, 0, bench_imu_predict, &ctx, iterations, latencies);
+    run_bench("gps_update", NULL, 0, bench_gps_update, &ctx, iterations, latencies);
+    run_bench("eskf_get_state", NULL, 0, bench_get_state, &ctx, iterations, latencies);
+    eskf_destroy(ctx.eskf);
+    free(memory);
+
+    for (size_t k = 0; k < sizeof(rail_sizes) / sizeof(rail_sizes[0]); k++) {
+        ctx.eskf = create_initialized(rail_sizes[k], &memory);
+        if (!ctx.eskf) {
+            fprintf(stderr, "ESKF allocation failed\n");
+            return 1;
+        }
+        // Query points spread along the whole track, up to 20 m off it
+        double half_length = rail_sizes[k] * 10.0 * 0.5;
+        for (int i = 0; i < iterations; i++) {
+            float s = (float)(half_length * (2.0 * (i % 1000) / 1000.0 - 1.0));
+            float offset = noise(&seed, 20.0f);
+            ctx.positions[i].data[0] = s * 0.7071f + offset * 0.7071f;
+            ctx.positions[i].data[1] = s * 0.7071f - offset * 0.7071f;
+            ctx.positions[i].data[2] = 0.0f;
+        }
+        // Full scans get slower with the map size: keep the run time bounded
+        int scans = (int)((long long)iterations * 100 / rail_sizes[k]);
+        if (scans > iterations) scans = iterations;
+        if (scans < 1000) scans = iterations < 1000 ? iterations : 1000;
+        run_bench("find_closest_rail_point", "nodes", rail_sizes[k],
+                  bench_find_closest_rail_point, &ctx, scans, latencies);
+
+        // Public calls with a railway map (includes map matching)
+        if (rail_sizes[k] == 1000) {
+            run_bench("eskf_process_imu", "nodes", rail_sizes[k], bench_process_imu, &ctx, iterations, latencies);
+            run_bench("eskf_process_gps", "nodes", rail_sizes[k], bench_process_gps, &ctx, iterations, latencies);
+        }
+        eskf_destroy(ctx.eskf);
+        free(memory);
+    }
+
+    printf("\n  ],\n  \"checksum\": %.3f\n}\n", ctx.sink);
+
+    free(ctx.imu);
+    free(ctx.gps);
+    free(ctx.positions);
+    free(latencies);
+    return 0;
+}
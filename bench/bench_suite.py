@@ -0,0 +1,204 @@
+"""Benchmark suite for the C filter and the Python pipeline.
+
+Collects throughput and latency percentiles for
+  - the filter steps (bench/bench_suite.c: imu_predict, gps_update,
+    find_closest_rail_point per railway map size, eskf_get_state),
+  - end-to-end test_c_python.py runs,
+  - the /run_c request of server_simple.py (Flask test client),
+writes them as one JSON report and compares with a stored baseline.
+A benchmark regresses when its median latency grows by more than the
+threshold (throughput, which includes scheduling outliers, is shown for
+information); the exit code is then 1.
+
+Usage (from the repository root):
+    python bench/bench_suite.py --save-baseline bench/baseline.json
+    python bench/bench_suite.py --baseline bench/baseline.json --threshold 0.10 --output bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_SOURCE = os.path.join('bench', 'bench_suite.c')
+BENCH_BINARY = os.path.join('bench', 'bench_suite.exe' if platform.system() == 'Windows' else 'bench_suite')
+
+
+BENCH_SOURCES = [BENCH_SOURCE, 'matrix.c']
+
+
+def bench_dependencies():
+    """Every file the C suite is built from: its sources and the headers/.c files they include."""
+    result = subprocess.run(['gcc', '-MM', '-I.'] + BENCH_SOURCES, cwd=ROOT, capture_output=True, text=True,
+                            check=True)
+    rules = result.stdout.replace('\\\n', ' ').split()
+    return sorted({os.path.normpath(name) for name in rules if not name.endswith(':')})
+
+
+def build_c_bench():
+    """Compile bench/bench_suite.c if the binary is missing or older than any of its dependencies."""
+    binary = os.path.join(ROOT, BENCH_BINARY)
+    if os.path.exists(binary) and all(
+            os.path.getmtime(binary) >= os.path.getmtime(os.path.join(ROOT, s)) for s in bench_dependencies()):
+        return binary
+    command = ['gcc', '-O2', '-I.', '-o', BENCH_BINARY] + BENCH_SOURCES + ['-lm']
+    print(' '.join(command))
+    subprocess.run(command, cwd=ROOT, check=True)
+    return binary
+
+
+def run_c_bench(iterations):
+    binary = build_c_bench()
+    result = subprocess.run([binary, str(iterations)], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def summarize(name, params, seconds, items_per_run=1):
+    """Result entry in the C suite's format from per-run wall times."""
+    ns = np.asarray(seconds) * 1e9
+    return {
+        'name': name,
+        'params': params,
+        'iterations': len(ns),
+        'ops_per_sec': items_per_run * len(ns) / (ns.sum() * 1e-9),
+        'mean_ns': float(ns.mean()),
+        'p50_ns': float(np.percentile(ns, 50)),
+        'p90_ns': float(np.percentile(ns, 90)),
+        'p99_ns': float(np.percentile(ns, 99)),
+        'p999_ns': float(np.percentile(ns, 99.9)),
+        'max_ns': float(ns.max()),
+    }
+
+
+def bench_test_c_python(repeats, direction):
+    """Wall time of whole test_c_python.py runs; throughput in IMU samples/s."""
+    seconds, imu_count = [], 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, 'test_c_python.py', '--direction', direction],
+                                cwd=ROOT, capture_output=True, text=True, check=True)
+        seconds.append(time.perf_counter() - start)
+        for line in result.stdout.split('\n'):
+            if 'IMU updates:' in line:
+                imu_count = int(line.split(':')[1].strip())
+    return summarize('test_c_python', {'direction': direction}, seconds, imu_count)
+
+
+def bench_run_c(repeats, direction):
+    """Latency of POST /run_c through the Flask test client."""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)  # The server works with paths relative to the repository
+    from server_simple import app
+
+    client = app.test_client()
+    seconds, response_bytes = [], 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = client.post('/run_c', json={'direction': direction})
+        seconds.append(time.perf_counter() - start)
+        if not response.get_json().get('success'):
+            raise RuntimeError(f"/run_c failed: {response.get_json().get('error')}")
+        response_bytes = len(response.data)
+    result = summarize('/run_c', {'direction': direction}, seconds)
+    result['response_bytes'] = response_bytes
+    return result
+
+
+def result_key(result):
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+    """Rows of (result, baseline result, latency change, throughput change, regressed)."""
+    reference = {result_key(r): r for r in baseline['results']}
+    rows = []
+    for result in results:
+        base = reference.get(result_key(result))
+        if base is None:
+            continue
+        latency_change = result['p50_ns'] / base['p50_ns'] - 1.0
+        throughput_change = result['ops_per_sec'] / base['ops_per_sec'] - 1.0
+        regressed = latency_change > threshold
+        rows.append((result, base, latency_change, throughput_change, regressed))
+    return rows
+
+
+def format_ns(ns):
+    if ns >= 1e6:
+        return f"{ns / 1e6:.2f} ms"
+    if ns >= 1e3:
+        return f"{ns / 1e3:.2f} us"
+    return f"{ns:.0f} ns"
+
+
+def label(result):
+    params = ', '.join(f"{k}={v}" for k, v in result['params'].items())
+    return f"{result['name']}({params})" if params else result['name']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ESKF benchmark suite')
+    parser.add_argument('--iterations', type=int, default=100000, help='Calls per C benchmark')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs of the end-to-end benchmarks')
+    parser.add_argument('--direction', choices=['up', 'down'], default='up',
+                        help='Railway direction: up (상행) or down (하행)')
+    parser.add_argument('--skip-e2e', action='store_true', help='Only run the C benchmarks')
+    parser.add_argument('--output', default=None, help='Write the JSON report to this file')
+    parser.add_argument('--baseline', default=None, help='Baseline JSON report to compare with')
+    parser.add_argument('--save-baseline', default=None, help='Also store this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Allowed relative growth of the median latency')
+    args = parser.parse_args()
+
+    c_report = run_c_bench(args.iterations)
+    results = c_report['results']
+    if not args.skip_e2e:
+        results.append(bench_test_c_python(args.repeats, args.direction))
+        results.append(bench_run_c(args.repeats, args.direction))
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'python': platform.python_version(),
+        'timer_overhead_ns': c_report['timer_overhead_ns'],
+        'results': results,
+    }
+
+    print(f"\n{'benchmark':42s} {'ops/s':>12s} {'p50':>10s} {'p90':>10s} {'p99':>10s}")
+    for r in results:
+        print(f"{label(r):42s} {r['ops_per_sec']:12.0f} {format_ns(r['p50_ns']):>10s} "
+              f"{format_ns(r['p90_ns']):>10s} {format_ns(r['p99_ns']):>10s}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.threshold)
+        print(f"\nCompared with {args.baseline} ({baseline.get('created', '?')}), "
+              f"threshold {args.threshold * 100:.0f}%:")
+        for result, base, latency_change, throughput_change, regressed in rows:
+            print(f"  {label(result):40s} p50 {format_ns(base['p50_ns']):>10s} -> {format_ns(result['p50_ns']):>10s} "
+                  f"({latency_change * 100:+.1f}%), ops/s {throughput_change * 100:+.1f}%"
+                  f"{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append({'benchmark': label(result),
+                                    'p50_change': latency_change,
+                                    'throughput_change': throughput_change})
+        report['baseline'] = args.baseline
+        report['regressions'] = regressions
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"\nReport saved to {path}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold * 100:.0f}%")
+        sys.exit(1)
@@ -25,13 +25,13 @@ echo [OK] Found GCC:
 gcc --version | findstr gcc
 echo.
 
-echo [1/3] Cleaning old files...
+echo [1/4] Cleaning old files...
 del /Q eskf.dll 2>nul
 del /Q *.o 2>nul
 del /Q libeskf.a 2>nul
 
-echo [2/3] Building ESKF shared library (DLL)...
-gcc -O2 -shared -fPIC -o eskf.dll matrix.c eskf.c -lm -D_USE_MATH_DEFINES -Wall
+echo [2/4] Building ESKF shared library (DLL)...
+gcc -O2 -shared -fPIC -fopenmp -o eskf.dll matrix.c eskf.c ringbuf.c -lm -D_USE_MATH_DEFINES -Wall
 
 if %errorlevel% neq 0 (
     echo.
@@ -43,10 +43,11 @@ if %errorlevel% neq 0 (
 echo [OK] Successfully created eskf.dll
 echo.
 
-echo [3/3] Building static library (for STM32 reference)...
+echo [3/4] Building static library (for STM32 reference)...
 gcc -O2 -c matrix.c -o matrix.o -D_USE_MATH_DEFINES -Wall
 gcc -O2 -c eskf.c -o eskf.o -D_USE_MATH_DEFINES -Wall
-ar rcs libeskf.a matrix.o eskf.o
+gcc -O2 -c ringbuf.c -o ringbuf.o -D_USE_MATH_DEFINES -Wall
+ar rcs libeskf.a matrix.o eskf.o ringbuf.o
 
 if %errorlevel% == 0 (
     echo [OK] Successfully created libeskf.a
@@ -55,6 +56,15 @@ if %errorlevel% == 0 (
     echo [WARNING] Static library build failed (DLL is still OK)
 )
 
+echo [4/4] Building Python extension module...
+python eskf_cffi_build.py >nul
+
+if %errorlevel% == 0 (
+    echo [OK] Successfully created _eskf_cffi extension
+) else (
+    echo [WARNING] Python extension build failed (pip install cffi)
+)
+
 echo.
 echo =============================================
 echo Build Complete!
@@ -63,6 +73,7 @@ echo.
 echo Generated files:
 echo   - eskf.dll    : Dynamic library for Windows
 echo   - libeskf.a   : Static library for embedded
+echo   - _eskf_cffi  : Python extension module
 echo.
 echo Next steps:
 echo   1. Test with Python:
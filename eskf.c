@@ -3,40 +3,111 @@
 #include <string.h>
 #include <math.h>
 #include <stdio.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+// Full memory barrier for the state seqlock
+#if defined(__GNUC__) || defined(__clang__)
+#define ESKF_MEMORY_BARRIER() __atomic_thread_fence(__ATOMIC_SEQ_CST)
+#elif defined(_MSC_VER)
+#include <windows.h>
+#define ESKF_MEMORY_BARRIER() MemoryBarrier()
+#else
+#define ESKF_MEMORY_BARRIER()
+#endif
+
+// Per-stage timing (ESKF_ENABLE_STATS). ESKF_STATS_CLOCK_NS() may be
+// predefined to use another monotonic nanosecond clock (e.g. a cycle counter).
+#ifdef ESKF_ENABLE_STATS
+#ifndef ESKF_STATS_CLOCK_NS
+#ifdef _WIN32
+#include <windows.h>
+static double stats_clock_ns(void) {
+    static double ns_per_tick = 0.0;
+    LARGE_INTEGER counter;
+    if (ns_per_tick == 0.0) {
+        LARGE_INTEGER frequency;
+        QueryPerformanceFrequency(&frequency);
+        ns_per_tick = 1e9 / (double)frequency.QuadPart;
+    }
+    QueryPerformanceCounter(&counter);
+    return (double)counter.QuadPart * ns_per_tick;
+}
+#else
+#include <time.h>
+static double stats_clock_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec * 1e9 + (double)ts.tv_nsec;
+}
+#endif
+#define ESKF_STATS_CLOCK_NS() stats_clock_ns()
+#endif
+
+static void stats_record(eskf_stage_stats_t* stage, double ns) {
+    if (stage->calls == 0 || ns < stage->min_ns) stage->min_ns = ns;
+    if (ns > stage->max_ns) stage->max_ns = ns;
+    stage->calls++;
+    stage->total_ns += ns;
+
+    int bucket = 0;
+    double edge = ESKF_STATS_BUCKET0_NS;
+    while (ns >= edge && bucket < ESKF_STATS_BUCKETS - 1) {
+        edge *= 2.0;
+        bucket++;
+    }
+    stage->histogram[bucket]++;
+}
+
+#define STATS_BEGIN(t) double t = ESKF_STATS_CLOCK_NS()
+#define STATS_END(eskf, stage_id, t) stats_record(&(eskf)->stats.stage[stage_id], ESKF_STATS_CLOCK_NS() - (t))
+#else
+#define STATS_BEGIN(t)
+#define STATS_END(eskf, stage_id, t)
+#endif
 
 #define DEG_TO_RAD (M_PI / 180.0)
 #define RAD_TO_DEG (180.0 / M_PI)
 #define EARTH_RADIUS_M 6371000.0
 
 // Simple coordinate transformation (without pyproj)
-void lla_to_enu(const double* init_lla, const double* target_lla, vec3_t* enu) {
-    double lat_ref = init_lla[0] * DEG_TO_RAD;
-    double lon_ref = init_lla[1] * DEG_TO_RAD;
-    double lat = target_lla[0] * DEG_TO_RAD;
-    double lon = target_lla[1] * DEG_TO_RAD;
+// Equirectangular approximation around the reference position
+void ltp_init(ltp_t* ltp, const double* ref_lla) {
+    ltp->lla[0] = ref_lla[0];
+    ltp->lla[1] = ref_lla[1];
+    ltp->lla[2] = ref_lla[2];
+
+    double cos_lat_ref = cos(ref_lla[0] * DEG_TO_RAD);
+
+    ltp->m_per_deg_lat = EARTH_RADIUS_M * DEG_TO_RAD;
+    ltp->m_per_deg_lon = EARTH_RADIUS_M * DEG_TO_RAD * cos_lat_ref;
+    ltp->deg_per_m_lat = 1.0 / ltp->m_per_deg_lat;
+    ltp->deg_per_m_lon = 1.0 / ltp->m_per_deg_lon;
+}
 
-    double cos_lat_ref = cos(lat_ref);
+void ltp_lla_to_enu(const ltp_t* ltp, const double* target_lla, vec3_t* enu) {
+    enu->data[0] = (target_lla[1] - ltp->lla[1]) * ltp->m_per_deg_lon;  // East
+    enu->data[1] = (target_lla[0] - ltp->lla[0]) * ltp->m_per_deg_lat;  // North
+    enu->data[2] = target_lla[2] - ltp->lla[2];                         // Up
+}
 
-    double dlon = lon - lon_ref;
-    double dlat = lat - lat_ref;
+void ltp_enu_to_lla(const ltp_t* ltp, const vec3_t* enu, double* lla) {
+    lla[0] = ltp->lla[0] + enu->data[1] * ltp->deg_per_m_lat;
+    lla[1] = ltp->lla[1] + enu->data[0] * ltp->deg_per_m_lon;
+    lla[2] = ltp->lla[2] + enu->data[2];
+}
 
-    // Approximate ENU conversion
-    enu->data[0] = EARTH_RADIUS_M * dlon * cos_lat_ref;  // East
-    enu->data[1] = EARTH_RADIUS_M * dlat;                 // North
-    enu->data[2] = target_lla[2] - init_lla[2];          // Up
+void lla_to_enu(const double* init_lla, const double* target_lla, vec3_t* enu) {
+    ltp_t ltp;
+    ltp_init(&ltp, init_lla);
+    ltp_lla_to_enu(&ltp, target_lla, enu);
 }
 
 void enu_to_lla(const double* init_lla, const vec3_t* enu, double* lla) {
-    double lat_ref = init_lla[0] * DEG_TO_RAD;
-    double lon_ref = init_lla[1] * DEG_TO_RAD;
-    double cos_lat_ref = cos(lat_ref);
-
-    double dlat = enu->data[1] / EARTH_RADIUS_M;
-    double dlon = enu->data[0] / (EARTH_RADIUS_M * cos_lat_ref);
-
-    lla[0] = (lat_ref + dlat) * RAD_TO_DEG;
-    lla[1] = (lon_ref + dlon) * RAD_TO_DEG;
-    lla[2] = init_lla[2] + enu->data[2];
+    ltp_t ltp;
+    ltp_init(&ltp, init_lla);
+    ltp_enu_to_lla(&ltp, enu, lla);
 }
 
 // Helper functions
@@ -44,8 +115,8 @@ static void compute_gravity_from_acceleration(const eskf_t* eskf, vec3_t* gravit
     vec3_t acc_sum;
     vec3_zero(&acc_sum);
 
-    int count = eskf->imu_buffer_count < IMU_BUFFER_SIZE ?
-                eskf->imu_buffer_count : IMU_BUFFER_SIZE;
+    int count = eskf->imu_buffer_count < eskf->imu_buffer_size ?
+                eskf->imu_buffer_count : eskf->imu_buffer_size;
 
     for (int i = 0; i < count; i++) {
         vec3_add(&acc_sum, &acc_sum, &eskf->imu_buffer[i].acc);
@@ -90,9 +161,41 @@ static void compute_initial_rotation(const vec3_t* gravity_direction, mat3_t* ro
     }
 }
 
-// Update euler angles from rotation matrix for debugging
-static void update_euler_angles(eskf_state_t* state) {
-    mat3_to_euler(&state->G_R_I, &state->roll, &state->pitch, &state->yaw);
+// Extract euler angles from the attitude (debug output and tunnel heading)
+static void compute_euler_angles(const eskf_t* eskf, float* roll, float* pitch, float* yaw) {
+    if (eskf->attitude_mode == ESKF_ATTITUDE_QUATERNION) {
+        quat_to_euler(&eskf->G_q_I, roll, pitch, yaw);
+    } else {
+        mat3_to_euler(&eskf->state.G_R_I, roll, pitch, yaw);
+    }
+}
+
+// Refresh the cached euler angles only when the attitude changed since last use
+static void update_euler_angles(eskf_t* eskf) {
+    if (eskf->euler_dirty) {
+        compute_euler_angles(eskf, &eskf->state.roll, &eskf->state.pitch, &eskf->state.yaw);
+        eskf->euler_dirty = 0;
+    }
+}
+
+// Rotate a vector from the IMU frame to the global frame
+static void attitude_rotate(const eskf_t* eskf, vec3_t* result, const vec3_t* v) {
+    if (eskf->attitude_mode == ESKF_ATTITUDE_QUATERNION) {
+        quat_rotate_vec3(result, &eskf->G_q_I, v);
+    } else {
+        mat3_multiply_vec3(result, &eskf->state.G_R_I, v);
+    }
+}
+
+// Rotate a vector from the global frame to the IMU frame
+static void attitude_rotate_inverse(const eskf_t* eskf, vec3_t* result, const vec3_t* v) {
+    if (eskf->attitude_mode == ESKF_ATTITUDE_QUATERNION) {
+        quat_rotate_vec3_inverse(result, &eskf->G_q_I, v);
+    } else {
+        mat3_t G_R_I_T;
+        mat3_transpose(&G_R_I_T, &eskf->state.G_R_I);
+        mat3_multiply_vec3(result, &G_R_I_T, v);
+    }
 }
 
 // Verify gravity vector consistency (for debugging/validation)
@@ -100,7 +203,7 @@ static void update_euler_angles(eskf_state_t* state) {
 static float verify_gravity_alignment(const eskf_t* eskf, const vec3_t* acc_unbias) {
     // Transform measured acceleration to global frame
     vec3_t global_acc;
-    mat3_multiply_vec3(&global_acc, &eskf->state.G_R_I, acc_unbias);
+    attitude_rotate(eskf, &global_acc, acc_unbias);
 
     // Expected: global_acc + gravity ≈ 0 (in static condition)
     vec3_t expected_zero;
@@ -158,6 +261,195 @@ static void orthonormalize_rotation(mat3_t* R) {
     R->data[2][2] = z.data[2];
 }
 
+// Materialize G_R_I (quaternion mode keeps it stale until needed)
+static const mat3_t* attitude_matrix(eskf_t* eskf) {
+    if (eskf->attitude_mode == ESKF_ATTITUDE_QUATERNION && eskf->rotation_dirty) {
+        quat_to_mat3(&eskf->state.G_R_I, &eskf->G_q_I);
+        eskf->rotation_dirty = 0;
+    }
+    return &eskf->state.G_R_I;
+}
+
+// Seqlock around every public call that modifies the state
+static void state_write_begin(eskf_t* eskf) {
+    eskf->state_version++;
+    ESKF_MEMORY_BARRIER();
+}
+
+static void state_write_end(eskf_t* eskf) {
+    if (eskf->state_view_enabled) {
+        // Live viewers read the state directly, so nothing may stay lazy
+        attitude_matrix(eskf);
+        update_euler_angles(eskf);
+    }
+    ESKF_MEMORY_BARRIER();
+    eskf->state_version++;
+}
+
+// Append the current output to the pose history
+// An output at the same time as the newest entry (GPS update after the
+// prediction) replaces it; an older one (rewind for a delayed fix, time
+// going backwards) first drops the entries newer than it.
+static void history_record(eskf_t* eskf) {
+    if (eskf->history_size == 0 || !eskf->initialized) {
+        return;
+    }
+
+    eskf_history_entry_t* entry = NULL;
+    while (eskf->history_count > 0) {
+        int newest = (eskf->history_head + eskf->history_size - 1) % eskf->history_size;
+        if (eskf->state.timestamp > eskf->history[newest].timestamp) {
+            break;
+        }
+        if (eskf->state.timestamp == eskf->history[newest].timestamp) {
+            entry = &eskf->history[newest];
+            break;
+        }
+        eskf->history_head = newest;
+        eskf->history_count--;
+    }
+    if (!entry) {
+        entry = &eskf->history[eskf->history_head];
+        eskf->history_head = (eskf->history_head + 1) % eskf->history_size;
+        if (eskf->history_count < eskf->history_size) {
+            eskf->history_count++;
+        }
+    }
+
+    entry->timestamp = eskf->state.timestamp;
+    entry->G_p_I = eskf->state.G_p_I;
+    entry->G_v_I = eskf->state.G_v_I;
+    if (eskf->attitude_mode == ESKF_ATTITUDE_QUATERNION) {
+        entry->G_q_I = eskf->G_q_I;
+    } else {
+        quat_from_mat3(&entry->G_q_I, &eskf->state.G_R_I);
+    }
+}
+
+// Delayed GPS fusion checkpoints
+static void checkpoint_save(const eskf_t* eskf, eskf_checkpoint_t* cp) {
+    cp->state = eskf->state;
+    cp->G_q_I = eskf->G_q_I;
+    cp->rotation_dirty = eskf->rotation_dirty;
+    cp->euler_dirty = eskf->euler_dirty;
+    cp->orthonormalize_counter = eskf->orthonormalize_counter;
+    cp->gravity_correction_counter = eskf->gravity_correction_counter;
+    cp->last_gps_time = eskf->last_gps_time;
+    cp->in_tunnel = eskf->in_tunnel;
+    cp->current_satellites = eskf->current_satellites;
+    cp->last_imu = eskf->last_imu;
+    cp->preint = eskf->preint;
+    cp->last_map_match_time = eskf->last_map_match_time;
+    cp->last_map_match_pos = eskf->last_map_match_pos;
+    cp->rail_segment = eskf->rail_segment;
+    cp->map_match_in_tunnel = eskf->map_match_in_tunnel;
+    cp->along_track = eskf->along_track;
+}
+
+static void checkpoint_load(eskf_t* eskf, const eskf_checkpoint_t* cp) {
+    eskf->state = cp->state;
+    eskf->G_q_I = cp->G_q_I;
+    eskf->rotation_dirty = cp->rotation_dirty;
+    eskf->euler_dirty = cp->euler_dirty;
+    eskf->orthonormalize_counter = cp->orthonormalize_counter;
+    eskf->gravity_correction_counter = cp->gravity_correction_counter;
+    eskf->last_gps_time = cp->last_gps_time;
+    eskf->in_tunnel = cp->in_tunnel;
+    eskf->current_satellites = cp->current_satellites;
+    eskf->last_imu = cp->last_imu;
+    eskf->preint = cp->preint;
+    eskf->last_map_match_time = cp->last_map_match_time;
+    eskf->last_map_match_pos = cp->last_map_match_pos;
+    eskf->rail_segment = cp->rail_segment;
+    eskf->map_match_in_tunnel = cp->map_match_in_tunnel;
+    eskf->along_track = cp->along_track;
+    eskf->along_track_stats.active = cp->along_track.active;
+}
+
+// i = 0 is the oldest retained IMU sample
+static eskf_delay_entry_t* delay_entry(eskf_t* eskf, int i) {
+    int index = eskf->delay_head - eskf->delay_count + i;
+    if (index < 0) {
+        index += eskf->delay_buffer_size;
+    }
+    return &eskf->delay_buffer[index];
+}
+
+static int delay_enabled(const eskf_t* eskf) {
+    return eskf->gps_delay_window > 0.0f && eskf->delay_buffer_size > 0;
+}
+
+// Retain an IMU sample the filter consumed and the state right after it
+static void delay_record(eskf_t* eskf, const imu_data_t* imu) {
+    if (!delay_enabled(eskf) || !eskf->initialized) {
+        return;
+    }
+    if (eskf->delay_count > 0 && imu->timestamp < delay_entry(eskf, eskf->delay_count - 1)->imu.timestamp) {
+        eskf->delay_count = 0;  // Time went backwards: nothing to rewind to
+    }
+
+    eskf_delay_entry_t* entry = &eskf->delay_buffer[eskf->delay_head];
+    eskf->delay_head = (eskf->delay_head + 1) % eskf->delay_buffer_size;
+    if (eskf->delay_count < eskf->delay_buffer_size) {
+        eskf->delay_count++;
+    }
+    entry->imu = *imu;
+    entry->still = eskf->zupt.still;
+    checkpoint_save(eskf, &entry->checkpoint);
+}
+
+// The newest retained state changed outside an IMU sample (GPS fix, flush)
+static void delay_update_newest(eskf_t* eskf) {
+    if (delay_enabled(eskf) && eskf->delay_count > 0) {
+        checkpoint_save(eskf, &delay_entry(eskf, eskf->delay_count - 1)->checkpoint);
+    }
+}
+
+// Overwrite the attitude from a rotation matrix
+static void attitude_set_matrix(eskf_t* eskf, const mat3_t* R) {
+    eskf->state.G_R_I = *R;
+    eskf->euler_dirty = 1;
+    if (eskf->attitude_mode == ESKF_ATTITUDE_QUATERNION) {
+        quat_from_mat3(&eskf->G_q_I, R);
+        eskf->rotation_dirty = 0;
+    }
+}
+
+// Apply a body-frame rotation increment: G_R_I = G_R_I * Exp(delta_angle)
+// small_angle selects the first-order update (I + [delta]x) in matrix mode
+static void attitude_apply_delta(eskf_t* eskf, const vec3_t* delta_angle, int small_angle) {
+    eskf->euler_dirty = 1;
+
+    if (eskf->attitude_mode == ESKF_ATTITUDE_QUATERNION) {
+        quat_t delta_q;
+        quat_from_axis_angle(&delta_q, delta_angle);
+        quat_multiply(&eskf->G_q_I, &eskf->G_q_I, &delta_q);
+        quat_normalize(&eskf->G_q_I, &eskf->G_q_I);
+        eskf->rotation_dirty = 1;
+        return;
+    }
+
+    mat3_t delta_R;
+    if (small_angle) {
+        mat3_t delta_skew;
+        mat3_skew(&delta_skew, delta_angle);
+        mat3_identity(&delta_R);
+        mat3_add(&delta_R, &delta_R, &delta_skew);
+    } else {
+        mat3_from_axis_angle(&delta_R, delta_angle);
+    }
+    mat3_multiply(&eskf->state.G_R_I, &eskf->state.G_R_I, &delta_R);
+
+    // Prevents numerical drift from repeated matrix multiplications
+    // Drift per update is tiny, so this may run only every N updates
+    if (++eskf->orthonormalize_counter >= eskf->orthonormalize_interval) {
+        eskf->orthonormalize_counter = 0;
+        STATS_BEGIN(stats_t0);
+        orthonormalize_rotation(&eskf->state.G_R_I);
+        STATS_END(eskf, ESKF_STAGE_ORTHONORMALIZE, stats_t0);
+    }
+}
+
 // Correct rotation using gravity vector alignment
 // This prevents gyroscope drift accumulation over time
 static void correct_rotation_with_gravity(eskf_t* eskf, const vec3_t* acc_unbias, float gain) {
@@ -179,14 +471,14 @@ static void correct_rotation_with_gravity(eskf_t* eskf, const vec3_t* acc_unbias
         // Compute mean
         int count = eskf->imu_buffer_count < 20 ? eskf->imu_buffer_count : 20;
         for (int i = 0; i < count; i++) {
-            int idx = (eskf->imu_buffer_index - count + i + IMU_BUFFER_SIZE) % IMU_BUFFER_SIZE;
+            int idx = (eskf->imu_buffer_index - count + i + eskf->imu_buffer_size) % eskf->imu_buffer_size;
             vec3_add(&acc_mean, &acc_mean, &eskf->imu_buffer[idx].acc);
         }
         vec3_scale(&acc_mean, &acc_mean, 1.0f / (float)count);
 
         // Compute variance
         for (int i = 0; i < count; i++) {
-            int idx = (eskf->imu_buffer_index - count + i + IMU_BUFFER_SIZE) % IMU_BUFFER_SIZE;
+            int idx = (eskf->imu_buffer_index - count + i + eskf->imu_buffer_size) % eskf->imu_buffer_size;
             vec3_t diff;
             vec3_subtract(&diff, &eskf->imu_buffer[idx].acc, &acc_mean);
             acc_variance += vec3_norm(&diff);
@@ -230,9 +522,7 @@ static void correct_rotation_with_gravity(eskf_t* eskf, const vec3_t* acc_unbias
     // Expected gravity direction in IMU frame
     // Transform global gravity to IMU frame: I_gravity = G_R_I^T * G_gravity
     vec3_t expected_gravity;
-    mat3_t G_R_I_T;
-    mat3_transpose(&G_R_I_T, &eskf->state.G_R_I);
-    mat3_multiply_vec3(&expected_gravity, &G_R_I_T, &eskf->config.gravity);
+    attitude_rotate_inverse(eskf, &expected_gravity, &eskf->config.gravity);
     vec3_normalize(&expected_gravity, &expected_gravity);
 
     // Compute rotation error (small angle approximation)
@@ -243,73 +533,146 @@ static void correct_rotation_with_gravity(eskf_t* eskf, const vec3_t* acc_unbias
     // Apply gain to control correction strength
     vec3_scale(&rotation_error, &rotation_error, gain);
 
-    // Convert error to rotation matrix (small angle: R ≈ I + [error]×)
-    mat3_t error_rotation;
-    mat3_t error_skew;
-    mat3_skew(&error_skew, &rotation_error);
-    mat3_identity(&error_rotation);
-    mat3_add(&error_rotation, &error_rotation, &error_skew);
-
     // Apply correction: G_R_I = G_R_I * error_rotation
-    mat3_t corrected_rotation;
-    mat3_multiply(&corrected_rotation, &eskf->state.G_R_I, &error_rotation);
-    eskf->state.G_R_I = corrected_rotation;
+    // (small angle: R ≈ I + [error]×, orthonormalized afterwards)
+    attitude_apply_delta(eskf, &rotation_error, 1);
+}
 
-    // ===== NEW: Orthonormalize to maintain rotation matrix validity =====
-    orthonormalize_rotation(&eskf->state.G_R_I);
+// Convert the loaded railway map into the local ENU frame (once per reference)
+static void project_rail_nodes(eskf_t* eskf) {
+    for (int i = 0; i < eskf->rail_node_count; i++) {
+        double node_lla[3] = {eskf->rail_map[i].lat, eskf->rail_map[i].lon, eskf->ltp.lla[2]};
+        vec3_t node_enu;
+        ltp_lla_to_enu(&eskf->ltp, node_lla, &node_enu);
+        eskf->rail_enu[i].east = node_enu.data[0];
+        eskf->rail_enu[i].north = node_enu.data[1];
+    }
+    eskf->rail_enu_valid = 1;
 }
 
-static float find_closest_rail_point(const eskf_t* eskf, double lat, double lon,
-                                    double* best_lat, double* best_lon) {
-    if (eskf->rail_node_count < 2) {
-        *best_lat = lat;
-        *best_lon = lon;
+// Find the closest point on segments [first, last] of the railway polyline (ENU, meters)
+// Returns the distance to the track and the index of the closest segment
+static float find_closest_rail_point(const eskf_t* eskf, const vec3_t* pos, int first, int last,
+                                    float* best_east, float* best_north, int* best_segment) {
+    float east = pos->data[0];
+    float north = pos->data[1];
+
+    *best_east = east;
+    *best_north = north;
+    *best_segment = -1;
+
+    if (eskf->rail_node_count < 2 || !eskf->rail_enu_valid) {
         return 1e6f;  // Large distance
     }
 
-    float min_dist = 1e6f;
-    *best_lat = lat;
-    *best_lon = lon;
+    float min_dist2 = 1e12f;
 
-    for (int i = 0; i < eskf->rail_node_count - 1; i++) {
-        float lat1 = eskf->rail_nodes[i].lat;
-        float lon1 = eskf->rail_nodes[i].lon;
-        float lat2 = eskf->rail_nodes[i + 1].lat;
-        float lon2 = eskf->rail_nodes[i + 1].lon;
+    if (first < 0) first = 0;
+    if (last > eskf->rail_node_count - 2) last = eskf->rail_node_count - 2;
 
-        float dx = lon2 - lon1;
-        float dy = lat2 - lat1;
+    for (int i = first; i <= last; i++) {
+        const rail_point_t* p1 = &eskf->rail_enu[i];
+        const rail_point_t* p2 = &eskf->rail_enu[i + 1];
 
-        if (fabs(dx) < 1e-10f && fabs(dy) < 1e-10f) {
+        float dx = p2->east - p1->east;
+        float dy = p2->north - p1->north;
+        float len2 = dx * dx + dy * dy;
+
+        if (len2 < 1e-6f) {
             continue;
         }
 
         // Project point onto line segment
-        float t = ((lon - lon1) * dx + (lat - lat1) * dy) / (dx * dx + dy * dy);
+        float t = ((east - p1->east) * dx + (north - p1->north) * dy) / len2;
         t = fmaxf(0.0f, fminf(1.0f, t));
 
-        float closest_lon = lon1 + t * dx;
-        float closest_lat = lat1 + t * dy;
+        float closest_east = p1->east + t * dx;
+        float closest_north = p1->north + t * dy;
 
-        // Approximate distance in meters
-        float dist_lat = (lat - closest_lat) * 111000.0f;
-        float dist_lon = (lon - closest_lon) * 111000.0f * cosf(lat * DEG_TO_RAD);
-        float dist = sqrtf(dist_lat * dist_lat + dist_lon * dist_lon);
+        float de = east - closest_east;
+        float dn = north - closest_north;
+        float dist2 = de * de + dn * dn;
 
-        if (dist < min_dist) {
-            min_dist = dist;
-            *best_lat = closest_lat;
-            *best_lon = closest_lon;
+        if (dist2 < min_dist2) {
+            min_dist2 = dist2;
+            *best_east = closest_east;
+            *best_north = closest_north;
+            *best_segment = i;
         }
     }
 
-    return min_dist;
+    return sqrtf(min_dist2);
 }
 
 // ESKF API implementation
-eskf_t* eskf_create(void) {
-    eskf_t* eskf = (eskf_t*)calloc(1, sizeof(eskf_t));
-    if (!eskf) return NULL;
+
+// Memory layout: eskf_t, IMU buffer, rail node copy, projected rail map, pose history,
+// delayed GPS buffer
+static size_t align_up(size_t size) {
+    return (size + ESKF_MEMORY_ALIGNMENT - 1) & ~(size_t)(ESKF_MEMORY_ALIGNMENT - 1);
+}
+
+static const eskf_capacity_t default_capacity = {MAX_RAIL_NODES, IMU_BUFFER_SIZE, 1, ESKF_HISTORY_SIZE,
+                                                  ESKF_DELAY_BUFFER_SIZE};
+
+size_t eskf_required_size(const eskf_capacity_t* capacity) {
+    if (!capacity) {
+        capacity = &default_capacity;
+    }
+    if (capacity->imu_buffer_size < ESKF_MIN_IMU_BUFFER || capacity->max_rail_nodes < 0 ||
+        capacity->history_size < 0 || capacity->delay_buffer_size < 0) {
+        return 0;
+    }
+
+    size_t size = align_up(sizeof(eskf_t));
+    size += align_up((size_t)capacity->imu_buffer_size * sizeof(imu_data_t));
+    if (capacity->copy_rail_nodes) {
+        size += align_up((size_t)capacity->max_rail_nodes * sizeof(rail_node_t));
+    }
+    size += align_up((size_t)capacity->max_rail_nodes * sizeof(rail_point_t));
+    size += align_up((size_t)capacity->history_size * sizeof(eskf_history_entry_t));
+    size += align_up((size_t)capacity->delay_buffer_size * sizeof(eskf_delay_entry_t));
+    return size;
+}
+
+eskf_t* eskf_init(void* memory, size_t size, const eskf_capacity_t* capacity) {
+    if (!capacity) {
+        capacity = &default_capacity;
+    }
+    size_t required = eskf_required_size(capacity);
+    if (!memory || required == 0 || size < required ||
+        ((size_t)memory & (ESKF_MEMORY_ALIGNMENT - 1)) != 0) {
+        return NULL;
+    }
+    memset(memory, 0, required);
+
+    char* cursor = (char*)memory;
+    eskf_t* eskf = (eskf_t*)cursor;
+    cursor += align_up(sizeof(eskf_t));
+
+    eskf->imu_buffer = (imu_data_t*)cursor;
+    eskf->imu_buffer_size = capacity->imu_buffer_size;
+    cursor += align_up((size_t)capacity->imu_buffer_size * sizeof(imu_data_t));
+
+    if (capacity->copy_rail_nodes) {
+        eskf->rail_nodes = (rail_node_t*)cursor;
+        cursor += align_up((size_t)capacity->max_rail_nodes * sizeof(rail_node_t));
+    }
+    eskf->rail_enu = (rail_point_t*)cursor;
+    eskf->max_rail_nodes = capacity->max_rail_nodes;
+    eskf->rail_map = eskf->rail_nodes;
+    cursor += align_up((size_t)capacity->max_rail_nodes * sizeof(rail_point_t));
+
+    if (capacity->history_size > 0) {
+        eskf->history = (eskf_history_entry_t*)cursor;
+        eskf->history_size = capacity->history_size;
+    }
+    cursor += align_up((size_t)capacity->history_size * sizeof(eskf_history_entry_t));
+
+    if (capacity->delay_buffer_size > 0) {
+        eskf->delay_buffer = (eskf_delay_entry_t*)cursor;
+        eskf->delay_buffer_size = capacity->delay_buffer_size;
+    }
 
     // Default configuration
     eskf->config.acc_noise = 0.5f;
@@ -321,55 +684,240 @@ eskf_t* eskf_create(void) {
     eskf->config.gravity.data[2] = -9.81007f;
     vec3_zero(&eskf->config.I_p_Gps);
 
+    eskf->attitude_mode = ESKF_DEFAULT_ATTITUDE_MODE;
+    eskf->orthonormalize_interval = 1;
+    eskf->gravity_correction_interval = 1;
+
     eskf->tunnel_threshold = 5.0;
     eskf->heading_smoothing_factor = 0.5f;
 
+#ifdef ESKF_ENABLE_STATS
+    eskf->stats.enabled = 1;
+#endif
+
     eskf_reset(eskf);
     return eskf;
 }
 
+eskf_t* eskf_create(void) {
+    size_t size = eskf_required_size(NULL);
+    void* memory = malloc(size);
+    if (!memory) return NULL;
+
+    eskf_t* eskf = eskf_init(memory, size, NULL);
+    if (!eskf) {
+        free(memory);
+        return NULL;
+    }
+    eskf->owns_memory = 1;
+    return eskf;
+}
+
 void eskf_destroy(eskf_t* eskf) {
-    if (eskf) {
+    if (eskf && eskf->owns_memory) {
         free(eskf);
     }
 }
 
 void eskf_reset(eskf_t* eskf) {
+    state_write_begin(eskf);
     eskf->initialized = 0;
     eskf->imu_buffer_count = 0;
     eskf->imu_buffer_index = 0;
     eskf->last_gps_time = 0;
     eskf->in_tunnel = 0;
     eskf->current_satellites = 0;  // Initialize satellite count
+    eskf->rail_enu_valid = 0;
+    eskf->rail_segment = -1;
+    eskf->last_map_match_time = 0;
+    eskf->map_match_in_tunnel = 0;
+    eskf->history_count = 0;
+    eskf->history_head = 0;
+    eskf->delay_count = 0;
+    eskf->delay_head = 0;
+    eskf->last_fused_gps_time = 0;
+    memset(&eskf->zupt, 0, sizeof(zupt_detector_t));
+    eskf->zupt_stats.stationary = 0;
+    memset(&eskf->along_track, 0, sizeof(along_track_t));
+    eskf->along_track_stats.active = 0;
+    memset(&eskf->preint, 0, sizeof(imu_preint_t));
 
     // Reset state
     memset(&eskf->state, 0, sizeof(eskf_state_t));
     mat3_identity(&eskf->state.G_R_I);
+    quat_identity(&eskf->G_q_I);
+    eskf->rotation_dirty = 0;
+    eskf->euler_dirty = 0;
+    eskf->orthonormalize_counter = 0;
+    eskf->gravity_correction_counter = 0;
     mat15_identity(&eskf->state.cov);
     mat15_scale(&eskf->state.cov, &eskf->state.cov, 0.01f);
+    state_write_end(eskf);
 }
 
 void eskf_set_config(eskf_t* eskf, const eskf_config_t* config) {
     eskf->config = *config;
 }
 
+void eskf_set_map_match_schedule(eskf_t* eskf, float rate_hz, float distance_m) {
+    eskf->map_match_period = rate_hz > 0.0f ? 1.0f / rate_hz : 0.0f;
+    eskf->map_match_distance = distance_m > 0.0f ? distance_m : 0.0f;
+}
+
+void eskf_set_zupt(eskf_t* eskf, int window, float acc_var, float gyro_power, float max_tilt) {
+    if (window > ESKF_ZUPT_MAX_WINDOW) {
+        window = ESKF_ZUPT_MAX_WINDOW;
+    }
+    eskf->zupt_window = window > 0 ? (window > 1 ? window : 2) : 0;
+    eskf->zupt_acc_var = acc_var;
+    eskf->zupt_gyro_power = gyro_power;
+    eskf->zupt_max_tilt = max_tilt;
+    memset(&eskf->zupt, 0, sizeof(zupt_detector_t));
+}
+
+void eskf_get_zupt_stats(const eskf_t* eskf, eskf_zupt_stats_t* stats) {
+    *stats = eskf->zupt_stats;
+}
+
+void eskf_set_maintenance(eskf_t* eskf, int orthonormalize_interval, int gravity_correction_interval) {
+    eskf->orthonormalize_interval = orthonormalize_interval > 1 ? orthonormalize_interval : 1;
+    eskf->gravity_correction_interval = gravity_correction_interval > 1 ? gravity_correction_interval : 1;
+    eskf->orthonormalize_counter = 0;
+    eskf->gravity_correction_counter = 0;
+}
+
+void eskf_set_attitude_mode(eskf_t* eskf, int mode) {
+    if (mode != ESKF_ATTITUDE_QUATERNION) {
+        mode = ESKF_ATTITUDE_MATRIX;
+    }
+    if (mode == eskf->attitude_mode) {
+        return;
+    }
+
+    // Carry the current attitude over to the new representation
+    state_write_begin(eskf);
+    mat3_t R = *attitude_matrix(eskf);
+    eskf->attitude_mode = mode;
+    attitude_set_matrix(eskf, &R);
+    eskf->delay_count = 0;  // Retained checkpoints hold the other representation
+    eskf->delay_head = 0;
+    state_write_end(eskf);
+}
+
 int eskf_load_rail_nodes(eskf_t* eskf, const rail_node_t* nodes, int count) {
-    if (count > MAX_RAIL_NODES) {
-        count = MAX_RAIL_NODES;
+    if (!eskf->rail_nodes) {
+        return 0;  // No copy storage: use eskf_share_rail_nodes
+    }
+    if (count > eskf->max_rail_nodes) {
+        count = eskf->max_rail_nodes;
     }
 
     memcpy(eskf->rail_nodes, nodes, count * sizeof(rail_node_t));
+    return eskf_share_rail_nodes(eskf, eskf->rail_nodes, count);
+}
+
+int eskf_share_rail_nodes(eskf_t* eskf, const rail_node_t* nodes, int count) {
+    if (count > eskf->max_rail_nodes) {
+        count = eskf->max_rail_nodes;
+    }
+
+    eskf->rail_map = nodes;
     eskf->rail_node_count = count;
+    eskf->rail_enu_valid = 0;
+    eskf->rail_segment = -1;
+
+    // Reference frame is only known after initialization
+    if (eskf->initialized) {
+        project_rail_nodes(eskf);
+    }
     return count;
 }
 
+// Gravity-based rotation correction, run on the maintenance schedule
+// samples: number of IMU samples covered by this prediction
+static void apply_gravity_correction(eskf_t* eskf, const vec3_t* acc_unbias, int samples) {
+    // ===== NEW: Apply gravity-based rotation correction during IMU prediction =====
+    // This provides continuous attitude correction even without GPS
+    // Very low gain (0.001) to avoid interfering with dynamic motion
+    // Only corrects slow gyro drift, not actual vehicle rotation
+    // When run every N samples the gain is scaled by N to keep the same bandwidth
+    eskf->gravity_correction_counter += samples;
+    if (eskf->gravity_correction_counter >= eskf->gravity_correction_interval) {
+        float gain = 0.001f * (float)eskf->gravity_correction_counter;
+        eskf->gravity_correction_counter = 0;
+        correct_rotation_with_gravity(eskf, acc_unbias, gain);
+    }
+}
+
+// Covariance propagation for `steps` IMU intervals of length dt
+static void propagate_covariance(eskf_t* eskf, float dt, int steps) {
+    // ===== IMPROVED: Proper covariance propagation =====
+    // Update covariance based on process noise
+    // State order: [δp(0-2), δv(3-5), δθ(6-8), δba(9-11), δbg(12-14)]
+
+    // Add process noise to covariance diagonal
+    // Position uncertainty increases with velocity and time
+    float vel_norm = vec3_norm(&eskf->state.G_v_I);
+    float pos_noise = eskf->config.acc_noise * dt * dt * 0.5f + vel_norm * dt * 0.01f;
+    for (int i = 0; i < 3; i++) {
+        eskf->state.cov.data[i][i] += pos_noise * pos_noise * steps;
+    }
+
+    // Velocity uncertainty increases with acceleration noise
+    float vel_noise = eskf->config.acc_noise * dt;
+    for (int i = 3; i < 6; i++) {
+        eskf->state.cov.data[i][i] += vel_noise * vel_noise * steps;
+    }
+
+    // Rotation uncertainty increases with gyro noise
+    float rot_noise = eskf->config.gyro_noise * dt;
+    for (int i = 6; i < 9; i++) {
+        eskf->state.cov.data[i][i] += rot_noise * rot_noise * steps;
+    }
+
+    // Accelerometer bias random walk
+    for (int i = 9; i < 12; i++) {
+        eskf->state.cov.data[i][i] += eskf->config.acc_bias_noise * eskf->config.acc_bias_noise * dt * steps;
+    }
+
+    // Gyroscope bias random walk
+    for (int i = 12; i < 15; i++) {
+        eskf->state.cov.data[i][i] += eskf->config.gyro_bias_noise * eskf->config.gyro_bias_noise * dt * steps;
+    }
+}
+
+// Whether the next map match needs a full search of the rail map
+static int map_match_due(const eskf_t* eskf) {
+    if (eskf->rail_segment < 0) {
+        return 1;  // No cursor yet
+    }
+    if (eskf->map_match_period <= 0.0f && eskf->map_match_distance <= 0.0f) {
+        return 1;  // No schedule: search every prediction
+    }
+    if (eskf->in_tunnel && !eskf->map_match_in_tunnel) {
+        return 1;  // Tunnel entry
+    }
+    if (eskf->map_match_period > 0.0f &&
+        eskf->state.timestamp - eskf->last_map_match_time >= eskf->map_match_period) {
+        return 1;
+    }
+    if (eskf->map_match_distance > 0.0f) {
+        vec3_t moved;
+        vec3_subtract(&moved, &eskf->state.G_p_I, &eskf->last_map_match_pos);
+        if (vec3_dot(&moved, &moved) >= eskf->map_match_distance * eskf->map_match_distance) {
+            return 1;
+        }
+    }
+    return 0;
+}
+
 // IMU prediction step
 static void imu_predict(eskf_t* eskf, const imu_data_t* cur_imu) {
     float dt = (float)(cur_imu->timestamp - eskf->last_imu.timestamp);
     float dt2 = dt * dt;
 
-    // Save last state
-    eskf_state_t last_state = eskf->state;
+    // Biases are constant over the step; position uses the velocity before the update
+    const eskf_state_t* last_state = &eskf->state;
 
     // Remove biases from measurements
     vec3_t acc_unbias, gyro_unbias;
@@ -381,23 +929,23 @@ static void imu_predict(eskf_t* eskf, const imu_data_t* cur_imu) {
     vec3_add(&gyro_avg, &eskf->last_imu.gyro, &cur_imu->gyro);
     vec3_scale(&gyro_avg, &gyro_avg, 0.5f);
 
-    vec3_subtract(&acc_unbias, &acc_avg, &last_state.acc_bias);
-    vec3_subtract(&gyro_unbias, &gyro_avg, &last_state.gyro_bias);
+    vec3_subtract(&acc_unbias, &acc_avg, &last_state->acc_bias);
+    vec3_subtract(&gyro_unbias, &gyro_avg, &last_state->gyro_bias);
 
     // Predict position
     vec3_t acc_global;
-    mat3_multiply_vec3(&acc_global, &last_state.G_R_I, &acc_unbias);
+    attitude_rotate(eskf, &acc_global, &acc_unbias);
     vec3_add(&acc_global, &acc_global, &eskf->config.gravity);
 
     vec3_t vel_delta, pos_delta;
-    vec3_scale(&vel_delta, &last_state.G_v_I, dt);
+    vec3_scale(&vel_delta, &last_state->G_v_I, dt);
     vec3_scale(&pos_delta, &acc_global, 0.5f * dt2);
-    vec3_add(&eskf->state.G_p_I, &last_state.G_p_I, &vel_delta);
+    vec3_add(&eskf->state.G_p_I, &eskf->state.G_p_I, &vel_delta);
     vec3_add(&eskf->state.G_p_I, &eskf->state.G_p_I, &pos_delta);
 
     // Predict velocity
     vec3_scale(&vel_delta, &acc_global, dt);
-    vec3_add(&eskf->state.G_v_I, &last_state.G_v_I, &vel_delta);
+    vec3_add(&eskf->state.G_v_I, &eskf->state.G_v_I, &vel_delta);
 
     // Predict rotation
     vec3_t delta_angle;
@@ -405,59 +953,120 @@ static void imu_predict(eskf_t* eskf, const imu_data_t* cur_imu) {
     float angle_norm = vec3_norm(&delta_angle);
 
     if (angle_norm > 1e-12f) {
-        mat3_t delta_R;
-        mat3_from_axis_angle(&delta_R, &delta_angle);
-        mat3_multiply(&eskf->state.G_R_I, &last_state.G_R_I, &delta_R);
-
-        // ===== NEW: Orthonormalize after rotation update =====
-        // Prevents numerical drift from repeated matrix multiplications
-        orthonormalize_rotation(&eskf->state.G_R_I);
+        attitude_apply_delta(eskf, &delta_angle, 0);
     }
 
-    // ===== NEW: Apply gravity-based rotation correction during IMU prediction =====
-    // This provides continuous attitude correction even without GPS
-    // Very low gain (0.001) to avoid interfering with dynamic motion
-    // Only corrects slow gyro drift, not actual vehicle rotation
-    correct_rotation_with_gravity(eskf, &acc_unbias, 0.001f);
+    apply_gravity_correction(eskf, &acc_unbias, 1);
+    propagate_covariance(eskf, dt, 1);
 
-    // Update Euler angles for debugging
-    update_euler_angles(&eskf->state);
+    eskf->state.timestamp = cur_imu->timestamp;
+}
 
-    // ===== IMPROVED: Proper covariance propagation =====
-    // Update covariance based on process noise
-    // State order: [δp(0-2), δv(3-5), δθ(6-8), δba(9-11), δbg(12-14)]
+// Accumulate one IMU interval into the pre-integration window
+// Two-sample coning/sculling recursion (Savage) in the window start frame
+static void preint_accumulate(eskf_t* eskf, const imu_data_t* cur_imu) {
+    imu_preint_t* pre = &eskf->preint;
+    float dt = (float)(cur_imu->timestamp - eskf->last_imu.timestamp);
 
-    // Add process noise to covariance diagonal
-    // Position uncertainty increases with velocity and time
-    float vel_norm = vec3_norm(&eskf->state.G_v_I);
-    float pos_noise = eskf->config.acc_noise * dt * dt * 0.5f + vel_norm * dt * 0.01f;
-    for (int i = 0; i < 3; i++) {
-        eskf->state.cov.data[i][i] += pos_noise * pos_noise;
-    }
+    // Bias-free increments from the average of last and current IMU
+    vec3_t dv, dtheta;
+    vec3_add(&dv, &eskf->last_imu.acc, &cur_imu->acc);
+    vec3_scale(&dv, &dv, 0.5f);
+    vec3_subtract(&dv, &dv, &eskf->state.acc_bias);
+    vec3_scale(&dv, &dv, dt);
+
+    vec3_add(&dtheta, &eskf->last_imu.gyro, &cur_imu->gyro);
+    vec3_scale(&dtheta, &dtheta, 0.5f);
+    vec3_subtract(&dtheta, &dtheta, &eskf->state.gyro_bias);
+    vec3_scale(&dtheta, &dtheta, dt);
+
+    vec3_t term, cross;
+
+    // Position: integrate the rotation-compensated velocity increment so far
+    vec3_cross(&cross, &pre->alpha, &pre->upsilon);
+    vec3_scale(&term, &cross, 0.5f);
+    vec3_add(&term, &term, &pre->upsilon);
+    vec3_add(&term, &term, &pre->gamma);
+    vec3_scale(&term, &term, dt);
+    vec3_add(&pre->delta_p, &pre->delta_p, &term);
+    vec3_scale(&term, &dv, 0.5f * dt);
+    vec3_add(&pre->delta_p, &pre->delta_p, &term);
+
+    // Coning: beta += 1/2 (alpha + 1/12 dtheta_prev) x dtheta
+    vec3_scale(&term, &pre->prev_dtheta, 1.0f / 12.0f);
+    vec3_add(&term, &term, &pre->alpha);
+    vec3_cross(&cross, &term, &dtheta);
+    vec3_scale(&cross, &cross, 0.5f);
+    vec3_add(&pre->beta, &pre->beta, &cross);
+
+    // Sculling: gamma += 1/2 [(alpha + 1/6 dtheta_prev) x dv + (upsilon + 1/6 dv_prev) x dtheta]
+    vec3_scale(&term, &pre->prev_dtheta, 1.0f / 6.0f);
+    vec3_add(&term, &term, &pre->alpha);
+    vec3_cross(&cross, &term, &dv);
+    vec3_scale(&cross, &cross, 0.5f);
+    vec3_add(&pre->gamma, &pre->gamma, &cross);
+
+    vec3_scale(&term, &pre->prev_dv, 1.0f / 6.0f);
+    vec3_add(&term, &term, &pre->upsilon);
+    vec3_cross(&cross, &term, &dtheta);
+    vec3_scale(&cross, &cross, 0.5f);
+    vec3_add(&pre->gamma, &pre->gamma, &cross);
+
+    vec3_add(&pre->alpha, &pre->alpha, &dtheta);
+    vec3_add(&pre->upsilon, &pre->upsilon, &dv);
+    pre->prev_dtheta = dtheta;
+    pre->prev_dv = dv;
+
+    pre->dt_sum += dt;
+    pre->count++;
+    pre->end_time = cur_imu->timestamp;
+}
 
-    // Velocity uncertainty increases with acceleration noise
-    float vel_noise = eskf->config.acc_noise * dt;
-    for (int i = 3; i < 6; i++) {
-        eskf->state.cov.data[i][i] += vel_noise * vel_noise;
+// Run one filter prediction over the accumulated pre-integration window
+static void preint_flush(eskf_t* eskf) {
+    imu_preint_t* pre = &eskf->preint;
+    if (pre->count == 0) {
+        return;
     }
 
-    // Rotation uncertainty increases with gyro noise
-    float rot_noise = eskf->config.gyro_noise * dt;
-    for (int i = 6; i < 9; i++) {
-        eskf->state.cov.data[i][i] += rot_noise * rot_noise;
-    }
+    float T = pre->dt_sum;
+
+    // Total increments over the window
+    vec3_t delta_theta, delta_v, cross;
+    vec3_add(&delta_theta, &pre->alpha, &pre->beta);
+    vec3_cross(&cross, &pre->alpha, &pre->upsilon);
+    vec3_scale(&cross, &cross, 0.5f);
+    vec3_add(&delta_v, &pre->upsilon, &cross);
+    vec3_add(&delta_v, &delta_v, &pre->gamma);
+
+    // Predict position: p += v*T + R*delta_p + 1/2*g*T^2
+    vec3_t term;
+    vec3_scale(&term, &eskf->state.G_v_I, T);
+    vec3_add(&eskf->state.G_p_I, &eskf->state.G_p_I, &term);
+    attitude_rotate(eskf, &term, &pre->delta_p);
+    vec3_add(&eskf->state.G_p_I, &eskf->state.G_p_I, &term);
+    vec3_scale(&term, &eskf->config.gravity, 0.5f * T * T);
+    vec3_add(&eskf->state.G_p_I, &eskf->state.G_p_I, &term);
+
+    // Predict velocity: v += R*delta_v + g*T
+    attitude_rotate(eskf, &term, &delta_v);
+    vec3_add(&eskf->state.G_v_I, &eskf->state.G_v_I, &term);
+    vec3_scale(&term, &eskf->config.gravity, T);
+    vec3_add(&eskf->state.G_v_I, &eskf->state.G_v_I, &term);
 
-    // Accelerometer bias random walk
-    for (int i = 9; i < 12; i++) {
-        eskf->state.cov.data[i][i] += eskf->config.acc_bias_noise * eskf->config.acc_bias_noise * dt;
+    // Predict rotation
+    if (vec3_norm(&delta_theta) > 1e-12f) {
+        attitude_apply_delta(eskf, &delta_theta, 0);
     }
 
-    // Gyroscope bias random walk
-    for (int i = 12; i < 15; i++) {
-        eskf->state.cov.data[i][i] += eskf->config.gyro_bias_noise * eskf->config.gyro_bias_noise * dt;
-    }
+    // Mean specific force over the window for the gravity correction
+    vec3_t acc_mean;
+    vec3_scale(&acc_mean, &pre->upsilon, 1.0f / T);
+    apply_gravity_correction(eskf, &acc_mean, pre->count);
+    propagate_covariance(eskf, T / (float)pre->count, pre->count);
 
-    eskf->state.timestamp = cur_imu->timestamp;
+    eskf->state.timestamp = pre->end_time;
+    memset(pre, 0, sizeof(imu_preint_t));
 }
 
 // GPS update step
@@ -465,11 +1074,11 @@ static void gps_update(eskf_t* eskf, const gps_data_t* gps) {
     // Convert GPS to ENU
     vec3_t G_p_Gps;
     double gps_lla[3] = {gps->lat, gps->lon, gps->alt};
-    lla_to_enu(eskf->init_lla, gps_lla, &G_p_Gps);
+    ltp_lla_to_enu(&eskf->ltp, gps_lla, &G_p_Gps);
 
     // Compute residual
     vec3_t predicted_gps_pos;
-    mat3_multiply_vec3(&predicted_gps_pos, &eskf->state.G_R_I, &eskf->config.I_p_Gps);
+    attitude_rotate(eskf, &predicted_gps_pos, &eskf->config.I_p_Gps);
     vec3_add(&predicted_gps_pos, &eskf->state.G_p_I, &predicted_gps_pos);
 
     vec3_t residual;
@@ -506,6 +1115,20 @@ static void gps_update(eskf_t* eskf, const gps_data_t* gps) {
     vec3_add(&eskf->state.G_v_I, &eskf->state.G_v_I, &vel_correction);
 
     // Update covariance: P = (I - K*H) * P
+    // Cross terms are scaled by the square roots of the diagonal factors
+    // (P = D P D), so correlations from the along-track handoff or the
+    // zero-velocity update stay consistent with the reduced variances
+    float scale[15];
+    for (int i = 0; i < 15; i++) {
+        scale[i] = i < 3 ? sqrtf(1.0f - K_pos) : i < 6 ? sqrtf(1.0f - K_vel) : i < 9 ? sqrtf(0.98f) : 1.0f;
+    }
+    for (int i = 0; i < 15; i++) {
+        for (int j = 0; j < 15; j++) {
+            if (i != j && eskf->state.cov.data[i][j] != 0.0f) {
+                eskf->state.cov.data[i][j] *= scale[i] * scale[j];
+            }
+        }
+    }
     // Reduce uncertainty in position states
     for (int i = 0; i < 3; i++) {
         eskf->state.cov.data[i][i] *= (1.0f - K_pos);
@@ -536,134 +1159,732 @@ static void gps_update(eskf_t* eskf, const gps_data_t* gps) {
         // Lower gain (0.02) for GPS updates to avoid overcorrection
         // This gradually aligns the rotation with gravity over multiple GPS measurements
         correct_rotation_with_gravity(eskf, &acc_unbias, 0.02f);
+    }
+}
 
-        // Update Euler angles for debugging
-        update_euler_angles(&eskf->state);
+// Sum over axes of the window variance
+static double zupt_variance(const double* sum, const double* sq, int n) {
+    double var = 0.0;
+    for (int i = 0; i < 3; i++) {
+        double mean = sum[i] / n;
+        var += sq[i] / n - mean * mean;
     }
+    return var;
 }
 
-int eskf_process_imu(eskf_t* eskf, const imu_data_t* imu) {
-    // Check tunnel status
-    double current_time = imu->timestamp;
-    if (eskf->last_gps_time > 0) {
-        double time_since_gps = current_time - eskf->last_gps_time;
-        eskf->in_tunnel = (time_since_gps > eskf->tunnel_threshold) ? 1 : 0;
-    } else {
-        eskf->in_tunnel = 0;
+// Sum over axes of the window mean square (rotation and noise)
+static double zupt_power(const double* sq, int n) {
+    return (sq[0] + sq[1] + sq[2]) / n;
+}
+
+// The window mean specific force is within max_tilt of the gravity reference
+static int zupt_tilt_below(const double* sum, const vec3_t* gravity_ref, float max_tilt) {
+    double dot = 0.0, mean_sq = 0.0, ref_sq = 0.0;
+    for (int i = 0; i < 3; i++) {
+        dot += sum[i] * gravity_ref->data[i];
+        mean_sq += sum[i] * sum[i];
+        ref_sq += (double)gravity_ref->data[i] * gravity_ref->data[i];
     }
+    double cos_tilt = cos(max_tilt);
+    return dot > 0.0 && dot * dot >= cos_tilt * cos_tilt * mean_sq * ref_sq;
+}
 
-    if (!eskf->initialized) {
-        // Add to buffer for initialization
-        if (eskf->imu_buffer_count < IMU_BUFFER_SIZE) {
-            eskf->imu_buffer[eskf->imu_buffer_count++] = *imu;
-        } else {
-            // Circular buffer
-            eskf->imu_buffer[eskf->imu_buffer_index] = *imu;
-            eskf->imu_buffer_index = (eskf->imu_buffer_index + 1) % IMU_BUFFER_SIZE;
+// Squared distance of a sample from the window mean
+static double zupt_deviation(const vec3_t* v, const double* sum, int n) {
+    double dev = 0.0;
+    for (int i = 0; i < 3; i++) {
+        double d = v->data[i] - sum[i] / n;
+        dev += d * d;
+    }
+    return dev;
+}
+
+// Slide the detection window over one IMU sample (depends on the IMU stream only)
+static void zupt_detect(eskf_t* eskf, const imu_data_t* imu) {
+    zupt_detector_t* z = &eskf->zupt;
+    int w = eskf->zupt_window;
+    if (w == 0) {
+        return;
+    }
+
+    // A sample far off the window mean ends a stop at once (variance lags a window)
+    int jump = 0;
+    if (z->count == w) {
+        jump = zupt_deviation(&imu->acc, z->acc_sum, w) > 9.0 * eskf->zupt_acc_var ||
+               zupt_deviation(&imu->gyro, z->gyro_sum, w) > 9.0 * eskf->zupt_gyro_power;
+        for (int i = 0; i < 3; i++) {
+            double a = z->acc[z->index].data[i], g = z->gyro[z->index].data[i];
+            z->acc_sum[i] -= a;
+            z->acc_sq[i] -= a * a;
+            z->gyro_sum[i] -= g;
+            z->gyro_sq[i] -= g * g;
         }
-        eskf->last_imu = *imu;
-        return 0;
+    } else {
+        z->count++;
     }
 
-    // Predict with IMU
-    if (eskf->state.timestamp > 0) {
-        imu_predict(eskf, imu);
+    z->acc[z->index] = imu->acc;
+    z->gyro[z->index] = imu->gyro;
+    z->index = (z->index + 1) % w;
+    if (z->index == 0) {
+        // Once per wrap: recompute the sums so rounding never accumulates
+        memset(z->acc_sum, 0, sizeof(z->acc_sum));
+        memset(z->acc_sq, 0, sizeof(z->acc_sq));
+        memset(z->gyro_sum, 0, sizeof(z->gyro_sum));
+        memset(z->gyro_sq, 0, sizeof(z->gyro_sq));
+        for (int k = 0; k < z->count; k++) {
+            for (int i = 0; i < 3; i++) {
+                double a = z->acc[k].data[i], g = z->gyro[k].data[i];
+                z->acc_sum[i] += a;
+                z->acc_sq[i] += a * a;
+                z->gyro_sum[i] += g;
+                z->gyro_sq[i] += g * g;
+            }
+        }
+    } else {
+        for (int i = 0; i < 3; i++) {
+            double a = imu->acc.data[i], g = imu->gyro.data[i];
+            z->acc_sum[i] += a;
+            z->acc_sq[i] += a * a;
+            z->gyro_sum[i] += g;
+            z->gyro_sq[i] += g * g;
+        }
+    }
+
+    // Gravity as the IMU sees it: the specific force averaged over minutes,
+    // over which accelerating and braking cancel out
+    if (vec3_dot(&z->gravity_ref, &z->gravity_ref) == 0.0f) {
+        z->gravity_ref = imu->acc;
+    } else {
+        double dt = imu->timestamp - z->last_time;
+        float alpha = dt > 0.0 ? (float)(dt < ESKF_ZUPT_GRAVITY_TAU ? dt / ESKF_ZUPT_GRAVITY_TAU : 1.0) : 0.0f;
+        for (int i = 0; i < 3; i++) {
+            z->gravity_ref.data[i] += alpha * (imu->acc.data[i] - z->gravity_ref.data[i]);
+        }
+    }
+    z->last_time = imu->timestamp;
+
+    z->still = z->count == w && !jump &&
+               zupt_variance(z->acc_sum, z->acc_sq, w) < eskf->zupt_acc_var &&
+               zupt_power(z->gyro_sq, w) < eskf->zupt_gyro_power &&
+               zupt_tilt_below(z->acc_sum, &z->gravity_ref, eskf->zupt_max_tilt);
+}
+
+// Stationary: take the fast path for this sample
+static int zupt_active(const eskf_t* eskf) {
+    return eskf->zupt_window > 0 && eskf->zupt.still;
+}
+
+// Zero-velocity update: Kalman update with velocity measured as zero (H = [0 I 0 0 0])
+static void zupt_update(eskf_t* eskf, const imu_data_t* imu) {
+    const float R = 0.01f * 0.01f;  // Velocity measurement noise ((m/s)^2)
+    float (*P)[15] = eskf->state.cov.data;
+
+    // Bias random walk and attitude noise keep growing while standing still
+    float dt = (float)(imu->timestamp - eskf->state.timestamp);
+    if (dt > 0.0f) {
+        propagate_covariance(eskf, dt, 1);
+    }
+
+    // S = P_vv + R, K = P[:, v] S^-1
+    mat3_t S, S_inv;
+    mat15_get_block_3x3(&eskf->state.cov, 3, 3, &S);
+    for (int i = 0; i < 3; i++) {
+        S.data[i][i] += R;
+    }
+    if (!mat3_inverse(&S_inv, &S)) {
+        eskf->state.timestamp = imu->timestamp;
+        return;
+    }
+    float K[15][3];
+    for (int i = 0; i < 15; i++) {
+        for (int j = 0; j < 3; j++) {
+            K[i][j] = P[i][3] * S_inv.data[0][j] + P[i][4] * S_inv.data[1][j] + P[i][5] * S_inv.data[2][j];
+        }
+    }
+
+    // δx = K (0 - v)
+    float dx[15];
+    const float* v = eskf->state.G_v_I.data;
+    for (int i = 0; i < 15; i++) {
+        dx[i] = -(K[i][0] * v[0] + K[i][1] * v[1] + K[i][2] * v[2]);
+    }
+
+    // P = P - K P[v, :], then symmetrize
+    float P_v[3][15];
+    for (int j = 0; j < 3; j++) {
+        for (int k = 0; k < 15; k++) {
+            P_v[j][k] = P[3 + j][k];
+        }
+    }
+    for (int i = 0; i < 15; i++) {
+        for (int k = 0; k < 15; k++) {
+            P[i][k] -= K[i][0] * P_v[0][k] + K[i][1] * P_v[1][k] + K[i][2] * P_v[2][k];
+        }
+    }
+    for (int i = 0; i < 15; i++) {
+        for (int k = i + 1; k < 15; k++) {
+            float m = 0.5f * (P[i][k] + P[k][i]);
+            P[i][k] = m;
+            P[k][i] = m;
+        }
+    }
+
+    // Inject the error state
+    for (int i = 0; i < 3; i++) {
+        eskf->state.G_p_I.data[i] += dx[i];
+        eskf->state.G_v_I.data[i] += dx[3 + i];
+        eskf->state.acc_bias.data[i] += dx[9 + i];
+        eskf->state.gyro_bias.data[i] += dx[12 + i];
+    }
+    vec3_t d_theta = {{dx[6], dx[7], dx[8]}};
+    if (d_theta.data[0] != 0.0f || d_theta.data[1] != 0.0f || d_theta.data[2] != 0.0f) {
+        attitude_apply_delta(eskf, &d_theta, 1);
+    }
+    eskf->state.timestamp = imu->timestamp;
+}
+
+// ===== Along-track filter (tunnels) =====
+
+#define ALONG_TRACK_RETRY_PERIOD 1.0  // Seconds between entry attempts off the map (one GPS epoch)
+
+// Direction, length and yaw of the current segment (zero-length segments keep the previous direction)
+static void along_track_segment(eskf_t* eskf) {
+    along_track_t* at = &eskf->along_track;
+    const rail_point_t* p1 = &eskf->rail_enu[at->segment];
+    const rail_point_t* p2 = &eskf->rail_enu[at->segment + 1];
+    float dx = p2->east - p1->east;
+    float dy = p2->north - p1->north;
+    at->length = sqrtf(dx * dx + dy * dy);
+    if (at->length > 1e-3f) {
+        at->dir[0] = dx / at->length;
+        at->dir[1] = dy / at->length;
+        at->yaw = atan2f(dy, dx);  // Euler yaw of mat3_from_euler: East = 0, North = π/2
+    }
+}
+
+// Position and velocity on the rail (and the attitude on a new segment) into the full state
+static void along_track_output(eskf_t* eskf, int new_segment) {
+    along_track_t* at = &eskf->along_track;
+    const rail_point_t* p1 = &eskf->rail_enu[at->segment];
+    eskf->state.G_p_I.data[0] = p1->east + at->dir[0] * at->offset;
+    eskf->state.G_p_I.data[1] = p1->north + at->dir[1] * at->offset;
+    eskf->state.G_v_I.data[0] = at->dir[0] * at->speed;
+    eskf->state.G_v_I.data[1] = at->dir[1] * at->speed;
+    eskf->state.G_v_I.data[2] = 0.0f;
+
+    if (new_segment) {
+        mat3_t R;
+        mat3_from_euler(&R, at->roll, at->pitch, at->yaw + at->yaw_offset);
+        attitude_set_matrix(eskf, &R);
+    }
+
+    double current_lla[3];
+    ltp_enu_to_lla(&eskf->ltp, &eskf->state.G_p_I, current_lla);
+    eskf->state.lat = current_lla[0];
+    eskf->state.lon = current_lla[1];
+    eskf->state.alt = current_lla[2];
+}
+
+// Switch to the along-track filter at the closest rail point
+// Returns 0 (full filter kept) when the position is not on the map; the
+// next attempt then waits ALONG_TRACK_RETRY_PERIOD instead of repeating the
+// full map search and pre-integration flush on every sample
+static int along_track_enter(eskf_t* eskf) {
+    along_track_t* at = &eskf->along_track;
+
+    // Bring the state up to the latest IMU sample first
+    preint_flush(eskf);
+
+    float east, north;
+    int segment;
+    float dist;
+    if (map_match_due(eskf)) {
+        dist = find_closest_rail_point(eskf, &eskf->state.G_p_I, 0, eskf->rail_node_count - 2,
+                                      &east, &north, &segment);
+        eskf->last_map_match_time = eskf->state.timestamp;
+        eskf->last_map_match_pos = eskf->state.G_p_I;
+    } else {
+        dist = find_closest_rail_point(eskf, &eskf->state.G_p_I,
+                                      eskf->rail_segment - 1, eskf->rail_segment + 1,
+                                      &east, &north, &segment);
+    }
+    eskf->map_match_in_tunnel = eskf->in_tunnel;
+    if (segment < 0 || dist >= 20.0f) {
+        at->retry_time = eskf->state.timestamp + ALONG_TRACK_RETRY_PERIOD;
+        eskf->along_track_stats.misses++;
+        return 0;
+    }
+
+    // Segment geometry (a zero-length segment takes the vehicle heading)
+    update_euler_angles(eskf);
+    at->segment = segment;
+    at->dir[0] = cosf(eskf->state.yaw);
+    at->dir[1] = sinf(eskf->state.yaw);
+    at->yaw = eskf->state.yaw;
+    along_track_segment(eskf);
+
+    // Chainage and speed along the segment
+    const rail_point_t* p1 = &eskf->rail_enu[segment];
+    const mat15_t* cov = &eskf->state.cov;
+    float d0 = at->dir[0], d1 = at->dir[1];
+    at->offset = (east - p1->east) * d0 + (north - p1->north) * d1;
+    at->speed = eskf->state.G_v_I.data[0] * d0 + eskf->state.G_v_I.data[1] * d1;
+    at->bias = 0.0f;  // On top of the full-state accelerometer bias
+
+    // Roll and pitch are held, yaw follows the rail in the direction the vehicle faces
+    float yaw_error = eskf->state.yaw - at->yaw;
+    while (yaw_error > M_PI) yaw_error -= 2.0f * M_PI;
+    while (yaw_error < -M_PI) yaw_error += 2.0f * M_PI;
+    at->yaw_offset = fabsf(yaw_error) > 0.5f * M_PI ? (float)M_PI : 0.0f;
+    at->roll = eskf->state.roll;
+    at->pitch = eskf->state.pitch;
+    along_track_output(eskf, 1);
+
+    // Track direction in the IMU frame: R^T (d0, d1, 0)
+    const mat3_t* R = attitude_matrix(eskf);
+    for (int j = 0; j < 3; j++) {
+        at->axis.data[j] = R->data[0][j] * d0 + R->data[1][j] * d1;
+    }
+
+    // Full-state variances projected on the track
+    memset(at->cov, 0, sizeof(at->cov));
+    at->cov[0][0] = cov->data[0][0] * d0 * d0 + cov->data[1][1] * d1 * d1;
+    at->cov[1][1] = cov->data[3][3] * d0 * d0 + cov->data[4][4] * d1 * d1;
+    for (int i = 0; i < 3; i++) {
+        at->cov[2][2] += cov->data[9 + i][9 + i] * at->axis.data[i] * at->axis.data[i];
+    }
+
+    eskf->rail_segment = segment;
+    at->active = 1;
+    eskf->along_track_stats.entries++;
+    eskf->along_track_stats.active = 1;
+    return 1;
+}
+
+// Hand back to the full filter. Position, velocity and attitude are already
+// in the full state; the horizontal position/velocity covariance and the
+// accelerometer bias along the track, with their coupling, are taken from
+// the along-track covariance.
+static void along_track_exit(eskf_t* eskf) {
+    along_track_t* at = &eskf->along_track;
+    const float cross_pos_var = 1.0f;   // Across the track: rail snap (m^2)
+    const float cross_vel_var = 0.01f;  // Across the track ((m/s)^2)
+    float (*P)[15] = eskf->state.cov.data;
+    const float* a = at->axis.data;
+    float d0 = at->dir[0], d1 = at->dir[1];
+
+    vec3_t bias;
+    vec3_scale(&bias, &at->axis, at->bias);
+    vec3_add(&eskf->state.acc_bias, &eskf->state.acc_bias, &bias);
+
+    // Drop what the along-track filter replaces: horizontal position and
+    // velocity, and the accelerometer bias along the track axis
+    // (P = M P M^T, M zeroes those rows and projects the bias off the axis)
+    static const int rows[4] = {0, 1, 3, 4};
+    for (int k = 0; k < 4; k++) {
+        for (int j = 0; j < 15; j++) {
+            P[rows[k]][j] = 0.0f;
+            P[j][rows[k]] = 0.0f;
+        }
+    }
+    float Q[3][3];
+    for (int i = 0; i < 3; i++) {
+        for (int k = 0; k < 3; k++) {
+            Q[i][k] = (i == k ? 1.0f : 0.0f) - a[i] * a[k];
+        }
+    }
+    float bias_rows[3][15];
+    for (int i = 0; i < 3; i++) {
+        for (int j = 0; j < 15; j++) {
+            bias_rows[i][j] = Q[i][0] * P[9][j] + Q[i][1] * P[10][j] + Q[i][2] * P[11][j];
+        }
+    }
+    for (int i = 0; i < 3; i++) {
+        for (int j = 0; j < 15; j++) {
+            P[9 + i][j] = bias_rows[i][j];
+        }
+    }
+    for (int j = 0; j < 15; j++) {
+        float column[3];
+        for (int i = 0; i < 3; i++) {
+            column[i] = Q[i][0] * P[j][9] + Q[i][1] * P[j][10] + Q[i][2] * P[j][11];
+        }
+        for (int i = 0; i < 3; i++) {
+            P[j][9 + i] = column[i];
+        }
+    }
+
+    // Add the along-track covariance back, P += J C J^T: chainage on the
+    // horizontal position, speed on the horizontal velocity, bias on the axis
+    float C[3][3];
+    for (int i = 0; i < 3; i++) {
+        for (int k = 0; k < 3; k++) {
+            C[i][k] = 0.5f * (at->cov[i][k] + at->cov[k][i]);
+        }
+    }
+    float J[15][3] = {{0}};
+    J[0][0] = d0;
+    J[1][0] = d1;
+    J[3][1] = d0;
+    J[4][1] = d1;
+    for (int i = 0; i < 3; i++) {
+        J[9 + i][2] = a[i];
+    }
+    float JC[15][3];
+    for (int i = 0; i < 15; i++) {
+        for (int k = 0; k < 3; k++) {
+            JC[i][k] = J[i][0] * C[0][k] + J[i][1] * C[1][k] + J[i][2] * C[2][k];
+        }
+    }
+    for (int i = 0; i < 15; i++) {
+        for (int j = i; j < 15; j++) {
+            float value = JC[i][0] * J[j][0] + JC[i][1] * J[j][1] + JC[i][2] * J[j][2];
+            P[i][j] += value;
+            if (j != i) {
+                P[j][i] = P[i][j];
+            }
+        }
+    }
+
+    // Cross-track variance
+    float n[2] = {-d1, d0};
+    for (int i = 0; i < 2; i++) {
+        for (int j = 0; j < 2; j++) {
+            P[i][j] += cross_pos_var * n[i] * n[j];
+            P[3 + i][3 + j] += cross_vel_var * n[i] * n[j];
+        }
+    }
+
+    at->active = 0;
+    eskf->along_track_stats.handoffs++;
+    eskf->along_track_stats.active = 0;
+}
+
+// Move to the neighbouring segment when the offset leaves the current one,
+// write the output and hand back at either end of the map
+static void along_track_advance(eskf_t* eskf, const imu_data_t* imu) {
+    along_track_t* at = &eskf->along_track;
+    int segment = at->segment;
+    while (at->offset > at->length && at->segment < eskf->rail_node_count - 2) {
+        at->offset -= at->length;
+        at->segment++;
+        along_track_segment(eskf);
+    }
+    while (at->offset < 0.0f && at->segment > 0) {
+        at->segment--;
+        along_track_segment(eskf);
+        at->offset += at->length;
+    }
+    eskf->rail_segment = at->segment;
+    along_track_output(eskf, at->segment != segment);
+    eskf->state.timestamp = imu->timestamp;
+
+    if (at->offset > at->length || at->offset < 0.0f) {
+        along_track_exit(eskf);  // Ran off the map
+        at->off_map = 1;
+    }
+}
+
+// Propagate chainage, speed and bias: x = (s, v, b), s += v dt + (f - b) dt^2 / 2, v += (f - b) dt
+static void along_track_predict(eskf_t* eskf, const imu_data_t* imu) {
+    along_track_t* at = &eskf->along_track;
+    float dt = (float)(imu->timestamp - eskf->last_imu.timestamp);
+    float h = -0.5f * dt * dt;
+
+    // Specific force along the track (gravity has no component along the horizontal track)
+    vec3_t acc_avg;
+    vec3_add(&acc_avg, &eskf->last_imu.acc, &imu->acc);
+    vec3_scale(&acc_avg, &acc_avg, 0.5f);
+    vec3_subtract(&acc_avg, &acc_avg, &eskf->state.acc_bias);
+    float acc = vec3_dot(&at->axis, &acc_avg) - at->bias;
+
+    at->offset += at->speed * dt - h * acc;
+    at->speed += acc * dt;
+
+    // P = F P F^T + Q, F = [1 dt -dt^2/2; 0 1 -dt; 0 0 1]
+    float (*P)[3] = at->cov;
+    float FP[3][3];
+    for (int j = 0; j < 3; j++) {
+        FP[0][j] = P[0][j] + dt * P[1][j] + h * P[2][j];
+        FP[1][j] = P[1][j] - dt * P[2][j];
+        FP[2][j] = P[2][j];
+    }
+    for (int i = 0; i < 3; i++) {
+        P[i][0] = FP[i][0] + dt * FP[i][1] + h * FP[i][2];
+        P[i][1] = FP[i][1] - dt * FP[i][2];
+        P[i][2] = FP[i][2];
+    }
+    float pos_noise = eskf->config.acc_noise * dt * dt * 0.5f;
+    float vel_noise = eskf->config.acc_noise * dt;
+    P[0][0] += pos_noise * pos_noise;
+    P[1][1] += vel_noise * vel_noise;
+    P[2][2] += eskf->config.acc_bias_noise * eskf->config.acc_bias_noise * dt;
+
+    along_track_advance(eskf, imu);
+}
+
+// Standing still in the tunnel: speed measured as zero (also corrects chainage and bias)
+static void along_track_stop(eskf_t* eskf, const imu_data_t* imu) {
+    along_track_t* at = &eskf->along_track;
+    const float R = 0.01f * 0.01f;  // Velocity measurement noise ((m/s)^2)
+    float (*P)[3] = at->cov;
+    float innovation = -at->speed;
+    float S = P[1][1] + R;
+    float K[3] = {P[0][1] / S, P[1][1] / S, P[2][1] / S};
+
+    at->offset += K[0] * innovation;
+    at->speed += K[1] * innovation;
+    at->bias += K[2] * innovation;
+
+    float row[3] = {P[1][0], P[1][1], P[1][2]};
+    for (int i = 0; i < 3; i++) {
+        for (int j = 0; j < 3; j++) {
+            P[i][j] -= K[i] * row[j];
+        }
+    }
+    along_track_advance(eskf, imu);
+}
+
+static int process_imu(eskf_t* eskf, const imu_data_t* imu) {
+    // Check tunnel status
+    double current_time = imu->timestamp;
+    if (eskf->last_gps_time > 0) {
+        double time_since_gps = current_time - eskf->last_gps_time;
+        eskf->in_tunnel = (time_since_gps > eskf->tunnel_threshold) ? 1 : 0;
+    } else {
+        eskf->in_tunnel = 0;
+    }
+
+    if (!eskf->initialized) {
+        // Add to buffer for initialization
+        if (eskf->imu_buffer_count < eskf->imu_buffer_size) {
+            eskf->imu_buffer[eskf->imu_buffer_count++] = *imu;
+        } else {
+            // Circular buffer
+            eskf->imu_buffer[eskf->imu_buffer_index] = *imu;
+            eskf->imu_buffer_index = (eskf->imu_buffer_index + 1) % eskf->imu_buffer_size;
+        }
+        eskf->last_imu = *imu;
+        return 0;
+    }
+
+    // Predict with IMU
+    eskf->zupt_stats.stationary = 0;
+    if (eskf->state.timestamp > 0) {
+        if (eskf->along_track_enabled && eskf->in_tunnel && !eskf->along_track.active &&
+            !eskf->along_track.off_map && eskf->rail_node_count > 0 &&
+            eskf->state.timestamp >= eskf->along_track.retry_time) {
+            along_track_enter(eskf);
+        }
+        if (eskf->along_track.active) {
+            // Tunnel: the along-track filter replaces prediction and map matching
+            STATS_BEGIN(stats_t0);
+            if (zupt_active(eskf)) {
+                along_track_stop(eskf, imu);
+                eskf->zupt_stats.stationary = 1;
+            } else {
+                along_track_predict(eskf, imu);
+            }
+            STATS_END(eskf, ESKF_STAGE_ALONG_TRACK, stats_t0);
+            eskf->along_track_stats.samples++;
+            eskf->last_imu = *imu;
+            return 1;
+        }
+        if (zupt_active(eskf)) {
+            // Standing still: no propagation, gravity correction or map matching
+            if (eskf->preint.count > 0) {
+                preint_flush(eskf);  // Window started while moving
+            }
+            STATS_BEGIN(stats_t0);
+            zupt_update(eskf, imu);
+            STATS_END(eskf, ESKF_STAGE_ZUPT, stats_t0);
+            eskf->zupt_stats.stationary = 1;
+            eskf->last_imu = *imu;
+            return 1;
+        }
+        if (eskf->preint_period > 0.0f) {
+            preint_accumulate(eskf, imu);
+            if (eskf->preint.dt_sum < eskf->preint_period) {
+                // No filter output until the window is complete
+                eskf->last_imu = *imu;
+                return 1;
+            }
+            STATS_BEGIN(stats_t0);
+            preint_flush(eskf);
+            STATS_END(eskf, ESKF_STAGE_PREDICT, stats_t0);
+        } else {
+            STATS_BEGIN(stats_t0);
+            imu_predict(eskf, imu);
+            STATS_END(eskf, ESKF_STAGE_PREDICT, stats_t0);
+        }
     }
 
     // Route projection if enabled and GPS quality is low (< 8 satellites)
     if (eskf->rail_node_count > 0 && eskf->initialized && eskf->current_satellites < 8) {
+        // Snap to railway (map is already in the ENU frame)
+        STATS_BEGIN(stats_match_t0);
+        float snapped_east, snapped_north;
+        int segment;
+        float dist;
+
+        if (map_match_due(eskf)) {
+            // Full search over the whole map
+            dist = find_closest_rail_point(eskf, &eskf->state.G_p_I, 0, eskf->rail_node_count - 2,
+                                          &snapped_east, &snapped_north, &segment);
+            eskf->last_map_match_time = eskf->state.timestamp;
+            eskf->last_map_match_pos = eskf->state.G_p_I;
+        } else {
+            // Between searches only the segments around the cursor are checked
+            dist = find_closest_rail_point(eskf, &eskf->state.G_p_I,
+                                          eskf->rail_segment - 1, eskf->rail_segment + 1,
+                                          &snapped_east, &snapped_north, &segment);
+        }
+        eskf->map_match_in_tunnel = eskf->in_tunnel;
+        if (segment >= 0) {
+            eskf->rail_segment = segment;
+        }
+
+        if (dist < 20.0f) {  // Within 20 meters of track
+            // Update ENU position
+            eskf->state.G_p_I.data[0] = snapped_east;
+            eskf->state.G_p_I.data[1] = snapped_north;
+
+            // ===== NEW: Adjust heading in tunnel using rail direction =====
+            if (eskf->in_tunnel && segment >= 0) {
+                STATS_BEGIN(stats_heading_t0);
+                const rail_point_t* p1 = &eskf->rail_enu[segment];
+                const rail_point_t* p2 = &eskf->rail_enu[segment + 1];
+
+                // Compute rail direction (yaw angle)
+                float dx = p2->east - p1->east;
+                float dy = p2->north - p1->north;
+                float rail_yaw = atan2f(dx, dy);  // North = 0, East = π/2
+
+                // Gradually align IMU yaw with rail yaw
+                update_euler_angles(eskf);
+                float current_yaw = eskf->state.yaw;
+                float yaw_error = rail_yaw - current_yaw;
+
+                // Normalize angle difference to [-π, π]
+                while (yaw_error > M_PI) yaw_error -= 2.0f * M_PI;
+                while (yaw_error < -M_PI) yaw_error += 2.0f * M_PI;
+
+                // Apply correction with smoothing
+                float yaw_correction = yaw_error * eskf->heading_smoothing_factor;
+                float corrected_yaw = current_yaw + yaw_correction;
+
+                // Update rotation matrix from corrected Euler angles
+                mat3_t corrected_R;
+                mat3_from_euler(&corrected_R, eskf->state.roll, eskf->state.pitch, corrected_yaw);
+                STATS_BEGIN(stats_t0);
+                orthonormalize_rotation(&corrected_R);
+                STATS_END(eskf, ESKF_STAGE_ORTHONORMALIZE, stats_t0);
+                attitude_set_matrix(eskf, &corrected_R);
+                STATS_END(eskf, ESKF_STAGE_HEADING, stats_heading_t0);
+            }
+        }
+
         // Convert position to LLA
         double current_lla[3];
-        enu_to_lla(eskf->init_lla, &eskf->state.G_p_I, current_lla);
+        ltp_enu_to_lla(&eskf->ltp, &eskf->state.G_p_I, current_lla);
         eskf->state.lat = current_lla[0];
         eskf->state.lon = current_lla[1];
         eskf->state.alt = current_lla[2];
+        STATS_END(eskf, ESKF_STAGE_MAP_MATCH, stats_match_t0);
+    }
 
-        // Snap to railway
-        double snapped_lat, snapped_lon;
-        float dist = find_closest_rail_point(eskf, eskf->state.lat,
-                                            eskf->state.lon,
-                                            &snapped_lat, &snapped_lon);
+    eskf->last_imu = *imu;
+    return 1;
+}
 
-        if (dist < 20.0f) {  // Within 20 meters of track
-            eskf->state.lat = snapped_lat;
-            eskf->state.lon = snapped_lon;
+int eskf_process_imu(eskf_t* eskf, const imu_data_t* imu) {
+    state_write_begin(eskf);
+    int was_stationary = eskf->zupt_stats.stationary;
+    zupt_detect(eskf, imu);
+    int result = process_imu(eskf, imu);
+    if (result) {
+        eskf_zupt_stats_t* zs = &eskf->zupt_stats;
+        zs->samples++;
+        if (zs->stationary) {
+            zs->stationary_samples++;
+            zs->stops += !was_stationary;
+        }
+        delay_record(eskf, imu);
+        history_record(eskf);
+    }
+    state_write_end(eskf);
+    return result;
+}
 
-            // Update ENU position
-            double snapped_lla[3] = {snapped_lat, snapped_lon, eskf->state.alt};
-            lla_to_enu(eskf->init_lla, snapped_lla, &eskf->state.G_p_I);
+int eskf_process_imu_batch(eskf_t* eskf, const imu_data_t* imu, int count) {
+    int processed = 0;
+    for (int i = 0; i < count; i++) {
+        processed += eskf_process_imu(eskf, &imu[i]);
+    }
+    return processed;
+}
 
-            // ===== NEW: Adjust heading in tunnel using rail direction =====
-            if (eskf->in_tunnel && eskf->rail_node_count > 1) {
-                // Find the rail segment we're on
-                int closest_segment = -1;
-                float min_segment_dist = 1e6f;
-
-                for (int i = 0; i < eskf->rail_node_count - 1; i++) {
-                    float lat1 = eskf->rail_nodes[i].lat;
-                    float lon1 = eskf->rail_nodes[i].lon;
-                    float lat2 = eskf->rail_nodes[i + 1].lat;
-                    float lon2 = eskf->rail_nodes[i + 1].lon;
-
-                    // Check if we're near this segment
-                    float dx = lon2 - lon1;
-                    float dy = lat2 - lat1;
-                    float t = ((snapped_lon - lon1) * dx + (snapped_lat - lat1) * dy) / (dx * dx + dy * dy);
-
-                    if (t >= 0.0f && t <= 1.0f) {
-                        float seg_dist = fabsf(t * sqrtf(dx * dx + dy * dy));
-                        if (seg_dist < min_segment_dist) {
-                            min_segment_dist = seg_dist;
-                            closest_segment = i;
-                        }
-                    }
-                }
-
-                // Apply heading correction if we found a valid segment
-                if (closest_segment >= 0) {
-                    float lat1 = eskf->rail_nodes[closest_segment].lat;
-                    float lon1 = eskf->rail_nodes[closest_segment].lon;
-                    float lat2 = eskf->rail_nodes[closest_segment + 1].lat;
-                    float lon2 = eskf->rail_nodes[closest_segment + 1].lon;
-
-                    // Compute rail direction (yaw angle)
-                    float dx = (lon2 - lon1) * cosf(lat1 * DEG_TO_RAD) * 111000.0f;
-                    float dy = (lat2 - lat1) * 111000.0f;
-                    float rail_yaw = atan2f(dx, dy);  // North = 0, East = π/2
-
-                    // Gradually align IMU yaw with rail yaw
-                    float current_yaw = eskf->state.yaw;
-                    float yaw_error = rail_yaw - current_yaw;
-
-                    // Normalize angle difference to [-π, π]
-                    while (yaw_error > M_PI) yaw_error -= 2.0f * M_PI;
-                    while (yaw_error < -M_PI) yaw_error += 2.0f * M_PI;
-
-                    // Apply correction with smoothing
-                    float yaw_correction = yaw_error * eskf->heading_smoothing_factor;
-                    float corrected_yaw = current_yaw + yaw_correction;
-
-                    // Update rotation matrix from corrected Euler angles
-                    mat3_from_euler(&eskf->state.G_R_I, eskf->state.roll, eskf->state.pitch, corrected_yaw);
-                    orthonormalize_rotation(&eskf->state.G_R_I);
-                    update_euler_angles(&eskf->state);
-                }
-            }
+int eskf_process_imu_values(eskf_t* eskf, double timestamp,
+                            float ax, float ay, float az,
+                            float gx, float gy, float gz) {
+    imu_data_t imu = {timestamp, {{ax, ay, az}}, {{gx, gy, gz}}};
+    return eskf_process_imu(eskf, &imu);
+}
+
+// Merge one instance's IMU and GPS streams by timestamp
+static int process_stream(eskf_stream_t* stream) {
+    eskf_t* eskf = stream->eskf;
+    int stride = stream->state_stride > 1 ? stream->state_stride : 1;
+    int g = 0;
+
+    stream->imu_processed = 0;
+    stream->gps_processed = 0;
+
+    for (int i = 0; i < stream->imu_count; i++) {
+        // Fixes older than this sample
+        while (g < stream->gps_count && stream->gps[g].timestamp < stream->imu[i].timestamp) {
+            stream->gps_processed += eskf_process_gps(eskf, &stream->gps[g++]);
         }
+        stream->imu_processed += eskf_process_imu(eskf, &stream->imu[i]);
+        if (stream->states && i % stride == 0) {
+            eskf_get_state(eskf, &stream->states[i / stride]);
+        }
+    }
+    while (g < stream->gps_count) {
+        stream->gps_processed += eskf_process_gps(eskf, &stream->gps[g++]);
     }
+    return stream->imu_processed;
+}
 
-    eskf->last_imu = *imu;
-    return 1;
+int eskf_process_many(eskf_stream_t* streams, int count, int num_threads) {
+    int total = 0;
+
+    // Instances share nothing writable (rail maps are read-only), so each
+    // one can run on its own thread. Dynamic scheduling balances streams
+    // of different lengths.
+#ifdef _OPENMP
+    if (num_threads <= 0) {
+        num_threads = omp_get_max_threads();
+    }
+    #pragma omp parallel for schedule(dynamic, 1) num_threads(num_threads) reduction(+:total)
+#else
+    (void)num_threads;
+#endif
+    for (int i = 0; i < count; i++) {
+        total += process_stream(&streams[i]);
+    }
+    return total;
 }
 
-int eskf_process_gps(eskf_t* eskf, const gps_data_t* gps) {
+static int process_gps(eskf_t* eskf, const gps_data_t* gps) {
     eskf->last_gps_time = gps->timestamp;
     eskf->in_tunnel = 0;
     eskf->current_satellites = gps->satellites;  // Update satellite count
 
     if (!eskf->initialized) {
         // Initialize with first GPS
-        if (eskf->imu_buffer_count < 10) {
+        if (eskf->imu_buffer_count < ESKF_MIN_IMU_BUFFER) {
             return 0;  // Need more IMU data
         }
 
@@ -671,6 +1892,7 @@ int eskf_process_gps(eskf_t* eskf, const gps_data_t* gps) {
         eskf->init_lla[0] = gps->lat;
         eskf->init_lla[1] = gps->lon;
         eskf->init_lla[2] = gps->alt;
+        ltp_init(&eskf->ltp, eskf->init_lla);
 
         vec3_zero(&eskf->state.G_p_I);
         vec3_zero(&eskf->state.G_v_I);
@@ -678,15 +1900,17 @@ int eskf_process_gps(eskf_t* eskf, const gps_data_t* gps) {
         // Initialize rotation from gravity
         vec3_t gravity_direction;
         compute_gravity_from_acceleration(eskf, &gravity_direction);
-        compute_initial_rotation(&gravity_direction, &eskf->state.G_R_I);
+        mat3_t initial_rotation;
+        compute_initial_rotation(&gravity_direction, &initial_rotation);
+        attitude_set_matrix(eskf, &initial_rotation);
 
         // Initialize biases
         vec3_zero(&eskf->state.acc_bias);
 
         // Compute gyro bias from buffer
         vec3_zero(&eskf->state.gyro_bias);
-        int count = eskf->imu_buffer_count < IMU_BUFFER_SIZE ?
-                   eskf->imu_buffer_count : IMU_BUFFER_SIZE;
+        int count = eskf->imu_buffer_count < eskf->imu_buffer_size ?
+                   eskf->imu_buffer_count : eskf->imu_buffer_size;
         for (int i = 0; i < count; i++) {
             vec3_add(&eskf->state.gyro_bias, &eskf->state.gyro_bias,
                     &eskf->imu_buffer[i].gyro);
@@ -707,17 +1931,701 @@ int eskf_process_gps(eskf_t* eskf, const gps_data_t* gps) {
         eskf->state.alt = gps->alt;
 
         // Initialize Euler angles
-        update_euler_angles(&eskf->state);
+        update_euler_angles(eskf);
 
         eskf->initialized = 1;
+
+        // Convert railway map into the new ENU frame
+        if (eskf->rail_node_count > 0) {
+            project_rail_nodes(eskf);
+        }
         return 1;
     }
 
+    // Bring the state up to the latest IMU sample before the update
+    preint_flush(eskf);
+    if (eskf->along_track.active) {
+        along_track_exit(eskf);  // GPS re-acquired
+    }
+    eskf->along_track.off_map = 0;
+    eskf->along_track.retry_time = 0.0;  // Retry at once in the next tunnel
+
     // Update with GPS
+    STATS_BEGIN(stats_t0);
     gps_update(eskf, gps);
+    STATS_END(eskf, ESKF_STAGE_GPS_UPDATE, stats_t0);
     return 1;
 }
 
+// Fuse a fix at the current state
+static int process_gps_now(eskf_t* eskf, const gps_data_t* gps) {
+    int result = process_gps(eskf, gps);
+    if (result) {
+        delay_update_newest(eskf);
+        history_record(eskf);
+    }
+    return result;
+}
+
+// Fuse a fix that is older than the newest IMU sample at its own time
+// (after the samples not newer than it, as in eskf_process_many)
+static int process_gps_delayed(eskf_t* eskf, const gps_data_t* gps) {
+    eskf_gps_delay_stats_t* stats = &eskf->gps_delay_stats;
+    double newest = delay_entry(eskf, eskf->delay_count - 1)->imu.timestamp;
+    if (gps->timestamp < newest - eskf->gps_delay_window ||
+        gps->timestamp < eskf->last_fused_gps_time) {
+        stats->fixes_rejected++;
+        return 0;
+    }
+    if (gps->timestamp < delay_entry(eskf, 0)->imu.timestamp) {
+        // Buffer shorter than the window: better late than never
+        stats->fixes_on_arrival++;
+        return process_gps_now(eskf, gps);
+    }
+
+    // Last retained sample not newer than the fix
+    int lo = 0, hi = eskf->delay_count - 1;
+    while (lo < hi) {
+        int mid = (lo + hi + 1) / 2;
+        if (delay_entry(eskf, mid)->imu.timestamp <= gps->timestamp) {
+            lo = mid;
+        } else {
+            hi = mid - 1;
+        }
+    }
+
+    // Rewind, fuse, and re-propagate the samples after it
+    eskf_delay_entry_t* entry = delay_entry(eskf, lo);
+    checkpoint_load(eskf, &entry->checkpoint);
+    process_gps(eskf, gps);
+    checkpoint_save(eskf, &entry->checkpoint);
+    history_record(eskf);
+
+    int replay = eskf->delay_count - 1 - lo;
+    for (int i = lo + 1; i < eskf->delay_count; i++) {
+        entry = delay_entry(eskf, i);
+        eskf->zupt.still = entry->still;  // Detector decision the sample had live
+        process_imu(eskf, &entry->imu);
+        checkpoint_save(eskf, &entry->checkpoint);
+        history_record(eskf);
+    }
+
+    stats->fixes_in_past++;
+    stats->replayed_samples += (unsigned long long)replay;
+    if (replay > stats->max_replay) {
+        stats->max_replay = replay;
+    }
+    return 1;
+}
+
+int eskf_process_gps(eskf_t* eskf, const gps_data_t* gps) {
+    state_write_begin(eskf);
+    int result;
+    if (delay_enabled(eskf) && eskf->initialized && eskf->delay_count > 0 &&
+        gps->timestamp < delay_entry(eskf, eskf->delay_count - 1)->imu.timestamp) {
+        result = process_gps_delayed(eskf, gps);
+    } else {
+        result = process_gps_now(eskf, gps);
+    }
+    if (result) {
+        eskf->last_fused_gps_time = gps->timestamp;
+    }
+    state_write_end(eskf);
+    return result;
+}
+
+void eskf_set_gps_delay(eskf_t* eskf, float max_delay_s) {
+    state_write_begin(eskf);
+    eskf->gps_delay_window = max_delay_s > 0.0f ? max_delay_s : 0.0f;
+    eskf->delay_count = 0;
+    eskf->delay_head = 0;
+    state_write_end(eskf);
+}
+
+void eskf_get_gps_delay_stats(const eskf_t* eskf, eskf_gps_delay_stats_t* stats) {
+    *stats = eskf->gps_delay_stats;
+}
+
+int eskf_gps_delay_buffer_size(float max_delay_s, float imu_rate_hz) {
+    if (max_delay_s <= 0.0f || imu_rate_hz <= 0.0f) {
+        return 0;
+    }
+    // A sample at or before (newest - max_delay_s), plus one for timestamp jitter
+    return (int)ceilf(max_delay_s * imu_rate_hz) + 2;
+}
+
+void eskf_set_along_track(eskf_t* eskf, int enabled) {
+    state_write_begin(eskf);
+    eskf->along_track_enabled = enabled ? 1 : 0;
+    if (!eskf->along_track_enabled && eskf->along_track.active) {
+        along_track_exit(eskf);
+        delay_update_newest(eskf);
+    }
+    state_write_end(eskf);
+}
+
+void eskf_get_along_track_stats(const eskf_t* eskf, eskf_along_track_stats_t* stats) {
+    *stats = eskf->along_track_stats;
+}
+
+void eskf_set_preintegration(eskf_t* eskf, float output_rate_hz) {
+    // Pending samples are predicted with the previous setting
+    state_write_begin(eskf);
+    preint_flush(eskf);
+    delay_update_newest(eskf);
+    history_record(eskf);
+    eskf->preint_period = output_rate_hz > 0.0f ? 1.0f / output_rate_hz : 0.0f;
+    state_write_end(eskf);
+}
+
+void eskf_flush_imu(eskf_t* eskf) {
+    state_write_begin(eskf);
+    preint_flush(eskf);
+    delay_update_newest(eskf);
+    history_record(eskf);
+    state_write_end(eskf);
+}
+
 void eskf_get_state(const eskf_t* eskf, eskf_state_t* state) {
     *state = eskf->state;
-}
\ No newline at end of file
+    if (eskf->attitude_mode == ESKF_ATTITUDE_QUATERNION) {
+        quat_to_mat3(&state->G_R_I, &eskf->G_q_I);
+    }
+    if (eskf->euler_dirty) {
+        compute_euler_angles(eskf, &state->roll, &state->pitch, &state->yaw);
+    }
+}
+
+// Time-indexed pose queries
+static const eskf_history_entry_t* history_entry(const eskf_t* eskf, int i) {
+    // i = 0 is the oldest entry
+    int index = eskf->history_head - eskf->history_count + i;
+    if (index < 0) {
+        index += eskf->history_size;
+    }
+    return &eskf->history[index];
+}
+
+// Last entry in [lo, history_count) not newer than t (t within the history)
+static int history_search(const eskf_t* eskf, double t, int lo) {
+    int hi = eskf->history_count - 1;
+    while (lo < hi) {
+        int mid = (lo + hi + 1) / 2;
+        if (history_entry(eskf, mid)->timestamp <= t) {
+            lo = mid;
+        } else {
+            hi = mid - 1;
+        }
+    }
+    return lo;
+}
+
+static void pose_interpolate(const eskf_t* eskf, int i, double t, eskf_pose_t* pose) {
+    const eskf_history_entry_t* a = history_entry(eskf, i);
+    pose->timestamp = t;
+
+    if (i + 1 < eskf->history_count && t > a->timestamp) {
+        const eskf_history_entry_t* b = history_entry(eskf, i + 1);
+        float u = (float)((t - a->timestamp) / (b->timestamp - a->timestamp));
+        for (int k = 0; k < 3; k++) {
+            pose->G_p_I.data[k] = a->G_p_I.data[k] + u * (b->G_p_I.data[k] - a->G_p_I.data[k]);
+            pose->G_v_I.data[k] = a->G_v_I.data[k] + u * (b->G_v_I.data[k] - a->G_v_I.data[k]);
+        }
+        quat_slerp(&pose->G_q_I, &a->G_q_I, &b->G_q_I, u);
+    } else {
+        pose->G_p_I = a->G_p_I;
+        pose->G_v_I = a->G_v_I;
+        pose->G_q_I = a->G_q_I;
+    }
+
+    double lla[3];
+    ltp_enu_to_lla(&eskf->ltp, &pose->G_p_I, lla);
+    pose->lat = lla[0];
+    pose->lon = lla[1];
+    pose->alt = lla[2];
+    quat_to_euler(&pose->G_q_I, &pose->roll, &pose->pitch, &pose->yaw);
+}
+
+static int history_covers(const eskf_t* eskf, double t) {
+    return eskf->history_count > 0 &&
+           t >= history_entry(eskf, 0)->timestamp &&
+           t <= history_entry(eskf, eskf->history_count - 1)->timestamp;
+}
+
+int eskf_query_pose(const eskf_t* eskf, double t, eskf_pose_t* pose) {
+    if (!history_covers(eskf, t)) {
+        memset(pose, 0, sizeof(*pose));
+        pose->timestamp = t;
+        return 0;
+    }
+    pose_interpolate(eskf, history_search(eskf, t, 0), t, pose);
+    return 1;
+}
+
+int eskf_query_poses(const eskf_t* eskf, const double* times, int count, eskf_pose_t* poses) {
+    int valid = 0;
+    int hint = 0;
+    for (int n = 0; n < count; n++) {
+        double t = times[n];
+        if (!history_covers(eskf, t)) {
+            memset(&poses[n], 0, sizeof(eskf_pose_t));
+            poses[n].timestamp = t;
+            continue;
+        }
+        // Sorted queries only search the entries after the previous one
+        int lo = history_entry(eskf, hint)->timestamp <= t ? hint : 0;
+        hint = history_search(eskf, t, lo);
+        pose_interpolate(eskf, hint, t, &poses[n]);
+        valid++;
+    }
+    return valid;
+}
+
+int eskf_get_stats(const eskf_t* eskf, eskf_stats_t* stats) {
+#ifdef ESKF_ENABLE_STATS
+    *stats = eskf->stats;
+    return 1;
+#else
+    (void)eskf;
+    memset(stats, 0, sizeof(*stats));
+    return 0;
+#endif
+}
+
+void eskf_reset_stats(eskf_t* eskf) {
+#ifdef ESKF_ENABLE_STATS
+    memset(&eskf->stats, 0, sizeof(eskf->stats));
+    eskf->stats.enabled = 1;
+#else
+    (void)eskf;
+#endif
+}
+
+const eskf_state_t* eskf_state_view(eskf_t* eskf) {
+    if (!eskf->state_view_enabled) {
+        state_write_begin(eskf);
+        eskf->state_view_enabled = 1;
+        state_write_end(eskf);
+    }
+    return &eskf->state;
+}
+
+unsigned int eskf_state_version(const eskf_t* eskf) {
+    // Fences on both sides: this is called before and after the reads
+    ESKF_MEMORY_BARRIER();
+    unsigned int version = eskf->state_version;
+    ESKF_MEMORY_BARRIER();
+    return version;
+}
+
+// Snapshot serialization
+// Fields are written one by one in native byte order (checked on restore)
+// instead of dumping structs, so padding and pointers never reach the file.
+#define SNAPSHOT_MAGIC 0x464B5345u  // "ESKF"
+#define SNAPSHOT_BYTE_ORDER 0x0102u
+#define SNAPSHOT_HEADER_SIZE 12
+#define SNAPSHOT_GRAVITY_WINDOW 20  // Buffer window read by correct_rotation_with_gravity
+
+typedef struct {
+    unsigned char* data;  // NULL: only count bytes
+    const unsigned char* input;
+    size_t size;
+    size_t pos;
+    int ok;
+} snapshot_io_t;
+
+static void snapshot_put(snapshot_io_t* io, const void* src, size_t n) {
+    if (io->data) {
+        if (io->pos + n > io->size) {
+            io->ok = 0;
+            return;
+        }
+        memcpy(io->data + io->pos, src, n);
+    }
+    io->pos += n;
+}
+
+static void snapshot_get(snapshot_io_t* io, void* dst, size_t n) {
+    if (!io->ok || io->pos + n > io->size) {
+        io->ok = 0;
+        return;
+    }
+    memcpy(dst, io->input + io->pos, n);
+    io->pos += n;
+}
+
+static void snapshot_put_imu(snapshot_io_t* io, const imu_data_t* imu) {
+    snapshot_put(io, &imu->timestamp, sizeof(double));
+    snapshot_put(io, imu->acc.data, sizeof(imu->acc.data));
+    snapshot_put(io, imu->gyro.data, sizeof(imu->gyro.data));
+}
+
+static void snapshot_get_imu(snapshot_io_t* io, imu_data_t* imu) {
+    snapshot_get(io, &imu->timestamp, sizeof(double));
+    snapshot_get(io, imu->acc.data, sizeof(imu->acc.data));
+    snapshot_get(io, imu->gyro.data, sizeof(imu->gyro.data));
+}
+
+// Initialization buffer slots the filter will still read
+// Before initialization every stored sample matters. Afterwards the buffer
+// is frozen and only the gravity-correction window and the latest sample
+// (used by the GPS update) are read.
+static int snapshot_buffer_slots(const eskf_t* eskf, int* slots) {
+    int stored = eskf->imu_buffer_count < eskf->imu_buffer_size ?
+                 eskf->imu_buffer_count : eskf->imu_buffer_size;
+    int n = 0;
+
+    if (!eskf->initialized) {
+        for (int i = 0; i < stored; i++) {
+            slots[n++] = i;
+        }
+        return n;
+    }
+    if (stored == 0) {
+        return 0;
+    }
+
+    int window = eskf->imu_buffer_count < SNAPSHOT_GRAVITY_WINDOW ?
+                 eskf->imu_buffer_count : SNAPSHOT_GRAVITY_WINDOW;
+    if (eskf->imu_buffer_count < 10) {
+        window = 0;  // Variance is not computed below 10 samples
+    }
+    for (int i = 0; i < window; i++) {
+        slots[n++] = (eskf->imu_buffer_index - window + i + eskf->imu_buffer_size) % eskf->imu_buffer_size;
+    }
+
+    int latest = (eskf->imu_buffer_index > 0) ? eskf->imu_buffer_index - 1 : eskf->imu_buffer_count - 1;
+    for (int i = 0; i < n; i++) {
+        if (slots[i] == latest) {
+            return n;
+        }
+    }
+    slots[n++] = latest;
+    return n;
+}
+
+static void snapshot_write(const eskf_t* eskf, snapshot_io_t* io) {
+    unsigned int magic = SNAPSHOT_MAGIC;
+    unsigned short version = ESKF_SNAPSHOT_VERSION;
+    unsigned short byte_order = SNAPSHOT_BYTE_ORDER;
+    unsigned int total_size = (unsigned int)eskf_snapshot_size(eskf);
+
+    snapshot_put(io, &magic, sizeof(magic));
+    snapshot_put(io, &version, sizeof(version));
+    snapshot_put(io, &byte_order, sizeof(byte_order));
+    snapshot_put(io, &total_size, sizeof(total_size));
+
+    // Filter state with the attitude materialized
+    eskf_state_t state;
+    eskf_get_state(eskf, &state);
+    snapshot_put(io, &eskf->initialized, sizeof(int));
+    snapshot_put(io, &eskf->attitude_mode, sizeof(int));
+    snapshot_put(io, &state.timestamp, sizeof(double));
+    snapshot_put(io, &state.lat, sizeof(double));
+    snapshot_put(io, &state.lon, sizeof(double));
+    snapshot_put(io, &state.alt, sizeof(double));
+    snapshot_put(io, state.G_p_I.data, sizeof(state.G_p_I.data));
+    snapshot_put(io, state.G_v_I.data, sizeof(state.G_v_I.data));
+    snapshot_put(io, state.G_R_I.data, sizeof(state.G_R_I.data));
+    snapshot_put(io, eskf->G_q_I.data, sizeof(eskf->G_q_I.data));
+    snapshot_put(io, state.acc_bias.data, sizeof(state.acc_bias.data));
+    snapshot_put(io, state.gyro_bias.data, sizeof(state.gyro_bias.data));
+
+    // Covariance is symmetric: upper triangle only
+    for (int i = 0; i < 15; i++) {
+        snapshot_put(io, &state.cov.data[i][i], (15 - i) * sizeof(float));
+    }
+
+    snapshot_put(io, &eskf->orthonormalize_counter, sizeof(int));
+    snapshot_put(io, &eskf->gravity_correction_counter, sizeof(int));
+    snapshot_put(io, eskf->init_lla, sizeof(eskf->init_lla));
+
+    // Tunnel detection and GPS quality
+    snapshot_put(io, &eskf->last_gps_time, sizeof(double));
+    snapshot_put(io, &eskf->in_tunnel, sizeof(int));
+    snapshot_put(io, &eskf->current_satellites, sizeof(int));
+
+    snapshot_put_imu(io, &eskf->last_imu);
+
+    // Map-match cursor (only valid for a map with the same node count)
+    snapshot_put(io, &eskf->rail_node_count, sizeof(int));
+    snapshot_put(io, &eskf->rail_segment, sizeof(int));
+    snapshot_put(io, &eskf->last_map_match_time, sizeof(double));
+    snapshot_put(io, eskf->last_map_match_pos.data, sizeof(eskf->last_map_match_pos.data));
+    snapshot_put(io, &eskf->map_match_in_tunnel, sizeof(int));
+
+    // Pending pre-integration window
+    const imu_preint_t* pre = &eskf->preint;
+    snapshot_put(io, pre->alpha.data, sizeof(pre->alpha.data));
+    snapshot_put(io, pre->beta.data, sizeof(pre->beta.data));
+    snapshot_put(io, pre->upsilon.data, sizeof(pre->upsilon.data));
+    snapshot_put(io, pre->gamma.data, sizeof(pre->gamma.data));
+    snapshot_put(io, pre->delta_p.data, sizeof(pre->delta_p.data));
+    snapshot_put(io, pre->prev_dtheta.data, sizeof(pre->prev_dtheta.data));
+    snapshot_put(io, pre->prev_dv.data, sizeof(pre->prev_dv.data));
+    snapshot_put(io, &pre->dt_sum, sizeof(float));
+    snapshot_put(io, &pre->count, sizeof(int));
+    snapshot_put(io, &pre->end_time, sizeof(double));
+
+    // Stationary detector window (only the filled slots)
+    const zupt_detector_t* z = &eskf->zupt;
+    snapshot_put(io, &z->count, sizeof(int));
+    snapshot_put(io, &z->index, sizeof(int));
+    snapshot_put(io, &z->still, sizeof(int));
+    snapshot_put(io, &eskf->zupt_stats.stationary, sizeof(int));
+    for (int k = 0; k < z->count; k++) {
+        snapshot_put(io, z->acc[k].data, sizeof(z->acc[k].data));
+        snapshot_put(io, z->gyro[k].data, sizeof(z->gyro[k].data));
+    }
+    snapshot_put(io, z->acc_sum, sizeof(z->acc_sum));
+    snapshot_put(io, z->acc_sq, sizeof(z->acc_sq));
+    snapshot_put(io, z->gyro_sum, sizeof(z->gyro_sum));
+    snapshot_put(io, z->gyro_sq, sizeof(z->gyro_sq));
+    snapshot_put(io, z->gravity_ref.data, sizeof(z->gravity_ref.data));
+    snapshot_put(io, &z->last_time, sizeof(double));
+
+    // Along-track filter
+    const along_track_t* at = &eskf->along_track;
+    snapshot_put(io, &at->active, sizeof(int));
+    snapshot_put(io, &at->off_map, sizeof(int));
+    snapshot_put(io, &at->retry_time, sizeof(double));
+    snapshot_put(io, &at->segment, sizeof(int));
+    snapshot_put(io, &at->offset, sizeof(float));
+    snapshot_put(io, &at->speed, sizeof(float));
+    snapshot_put(io, &at->bias, sizeof(float));
+    snapshot_put(io, at->cov, sizeof(at->cov));
+    snapshot_put(io, at->dir, sizeof(at->dir));
+    snapshot_put(io, &at->length, sizeof(float));
+    snapshot_put(io, &at->yaw, sizeof(float));
+    snapshot_put(io, &at->yaw_offset, sizeof(float));
+    snapshot_put(io, &at->roll, sizeof(float));
+    snapshot_put(io, &at->pitch, sizeof(float));
+    snapshot_put(io, at->axis.data, sizeof(at->axis.data));
+
+    // Initialization buffer entries still in use, with their slots
+    int slot_storage[SNAPSHOT_GRAVITY_WINDOW + 1];
+    int* slots = eskf->initialized ? slot_storage : NULL;
+    int entries = eskf->initialized ? snapshot_buffer_slots(eskf, slots) :
+                  (eskf->imu_buffer_count < eskf->imu_buffer_size ? eskf->imu_buffer_count : eskf->imu_buffer_size);
+    snapshot_put(io, &eskf->imu_buffer_size, sizeof(int));
+    snapshot_put(io, &eskf->imu_buffer_count, sizeof(int));
+    snapshot_put(io, &eskf->imu_buffer_index, sizeof(int));
+    snapshot_put(io, &entries, sizeof(int));
+    for (int i = 0; i < entries; i++) {
+        int slot = slots ? slots[i] : i;
+        snapshot_put(io, &slot, sizeof(int));
+        snapshot_put_imu(io, &eskf->imu_buffer[slot]);
+    }
+}
+
+size_t eskf_snapshot_size(const eskf_t* eskf) {
+    // Everything except the buffer entries has a fixed size
+    static const size_t imu_size = sizeof(double) + 6 * sizeof(float);
+    size_t size = SNAPSHOT_HEADER_SIZE;
+    size += 2 * sizeof(int) + 4 * sizeof(double);      // initialized, mode, timestamp, lla
+    size += (3 + 3 + 9 + 4 + 3 + 3) * sizeof(float);   // p, v, R, q, biases
+    size += 120 * sizeof(float);                       // Covariance upper triangle
+    size += 2 * sizeof(int) + 3 * sizeof(double);      // Maintenance counters, init_lla
+    size += sizeof(double) + 2 * sizeof(int);          // Tunnel, satellites
+    size += imu_size;                                  // last_imu
+    size += 2 * sizeof(int) + sizeof(double) + 3 * sizeof(float) + sizeof(int);  // Map match
+    size += 22 * sizeof(float) + sizeof(int) + sizeof(double);                   // Pre-integration
+    size += 4 * sizeof(int) + 13 * sizeof(double) + 3 * sizeof(float);           // Stationary detector
+    size += (size_t)eskf->zupt.count * 6 * sizeof(float);                        // Its window
+    size += 3 * sizeof(int) + sizeof(double) + 22 * sizeof(float);               // Along-track filter
+    size += 4 * sizeof(int);                                                     // Buffer header
+
+    int entries;
+    if (eskf->initialized) {
+        int slots[SNAPSHOT_GRAVITY_WINDOW + 1];
+        entries = snapshot_buffer_slots(eskf, slots);
+    } else {
+        entries = eskf->imu_buffer_count < eskf->imu_buffer_size ?
+                  eskf->imu_buffer_count : eskf->imu_buffer_size;
+    }
+    return size + (size_t)entries * (sizeof(int) + imu_size);
+}
+
+size_t eskf_save_state(const eskf_t* eskf, void* buffer, size_t size) {
+    snapshot_io_t io = {(unsigned char*)buffer, NULL, size, 0, 1};
+    if (!buffer || size < eskf_snapshot_size(eskf)) {
+        return 0;
+    }
+    snapshot_write(eskf, &io);
+    return io.ok ? io.pos : 0;
+}
+
+int eskf_restore_state(eskf_t* eskf, const void* buffer, size_t size) {
+    snapshot_io_t io = {NULL, (const unsigned char*)buffer, size, 0, buffer != NULL};
+    unsigned int magic = 0, total_size = 0;
+    unsigned short version = 0, byte_order = 0;
+
+    snapshot_get(&io, &magic, sizeof(magic));
+    snapshot_get(&io, &version, sizeof(version));
+    snapshot_get(&io, &byte_order, sizeof(byte_order));
+    snapshot_get(&io, &total_size, sizeof(total_size));
+    if (!io.ok || magic != SNAPSHOT_MAGIC || version != ESKF_SNAPSHOT_VERSION ||
+        byte_order != SNAPSHOT_BYTE_ORDER || total_size > size) {
+        return 0;
+    }
+    io.size = total_size;
+
+    // Parse into a copy so a rejected snapshot leaves the filter untouched
+    eskf_t restored = *eskf;
+    eskf_state_t* state = &restored.state;
+
+    snapshot_get(&io, &restored.initialized, sizeof(int));
+    snapshot_get(&io, &restored.attitude_mode, sizeof(int));
+    snapshot_get(&io, &state->timestamp, sizeof(double));
+    snapshot_get(&io, &state->lat, sizeof(double));
+    snapshot_get(&io, &state->lon, sizeof(double));
+    snapshot_get(&io, &state->alt, sizeof(double));
+    snapshot_get(&io, state->G_p_I.data, sizeof(state->G_p_I.data));
+    snapshot_get(&io, state->G_v_I.data, sizeof(state->G_v_I.data));
+    snapshot_get(&io, state->G_R_I.data, sizeof(state->G_R_I.data));
+    snapshot_get(&io, restored.G_q_I.data, sizeof(restored.G_q_I.data));
+    snapshot_get(&io, state->acc_bias.data, sizeof(state->acc_bias.data));
+    snapshot_get(&io, state->gyro_bias.data, sizeof(state->gyro_bias.data));
+
+    for (int i = 0; i < 15; i++) {
+        snapshot_get(&io, &state->cov.data[i][i], (15 - i) * sizeof(float));
+        for (int j = i + 1; j < 15; j++) {
+            state->cov.data[j][i] = state->cov.data[i][j];
+        }
+    }
+
+    snapshot_get(&io, &restored.orthonormalize_counter, sizeof(int));
+    snapshot_get(&io, &restored.gravity_correction_counter, sizeof(int));
+    snapshot_get(&io, restored.init_lla, sizeof(restored.init_lla));
+
+    snapshot_get(&io, &restored.last_gps_time, sizeof(double));
+    snapshot_get(&io, &restored.in_tunnel, sizeof(int));
+    snapshot_get(&io, &restored.current_satellites, sizeof(int));
+
+    snapshot_get_imu(&io, &restored.last_imu);
+
+    int saved_rail_count = 0;
+    snapshot_get(&io, &saved_rail_count, sizeof(int));
+    snapshot_get(&io, &restored.rail_segment, sizeof(int));
+    snapshot_get(&io, &restored.last_map_match_time, sizeof(double));
+    snapshot_get(&io, restored.last_map_match_pos.data, sizeof(restored.last_map_match_pos.data));
+    snapshot_get(&io, &restored.map_match_in_tunnel, sizeof(int));
+
+    imu_preint_t* pre = &restored.preint;
+    snapshot_get(&io, pre->alpha.data, sizeof(pre->alpha.data));
+    snapshot_get(&io, pre->beta.data, sizeof(pre->beta.data));
+    snapshot_get(&io, pre->upsilon.data, sizeof(pre->upsilon.data));
+    snapshot_get(&io, pre->gamma.data, sizeof(pre->gamma.data));
+    snapshot_get(&io, pre->delta_p.data, sizeof(pre->delta_p.data));
+    snapshot_get(&io, pre->prev_dtheta.data, sizeof(pre->prev_dtheta.data));
+    snapshot_get(&io, pre->prev_dv.data, sizeof(pre->prev_dv.data));
+    snapshot_get(&io, &pre->dt_sum, sizeof(float));
+    snapshot_get(&io, &pre->count, sizeof(int));
+    snapshot_get(&io, &pre->end_time, sizeof(double));
+
+    zupt_detector_t* z = &restored.zupt;
+    snapshot_get(&io, &z->count, sizeof(int));
+    snapshot_get(&io, &z->index, sizeof(int));
+    snapshot_get(&io, &z->still, sizeof(int));
+    snapshot_get(&io, &restored.zupt_stats.stationary, sizeof(int));
+    // The window must fit the restoring filter's detector (same zupt window)
+    if (!io.ok || z->count < 0 || z->count > eskf->zupt_window || z->index < 0 ||
+        z->index >= (eskf->zupt_window > 0 ? eskf->zupt_window : 1)) {
+        return 0;
+    }
+    for (int k = 0; k < z->count; k++) {
+        snapshot_get(&io, z->acc[k].data, sizeof(z->acc[k].data));
+        snapshot_get(&io, z->gyro[k].data, sizeof(z->gyro[k].data));
+    }
+    snapshot_get(&io, z->acc_sum, sizeof(z->acc_sum));
+    snapshot_get(&io, z->acc_sq, sizeof(z->acc_sq));
+    snapshot_get(&io, z->gyro_sum, sizeof(z->gyro_sum));
+    snapshot_get(&io, z->gyro_sq, sizeof(z->gyro_sq));
+    snapshot_get(&io, z->gravity_ref.data, sizeof(z->gravity_ref.data));
+    snapshot_get(&io, &z->last_time, sizeof(double));
+
+    along_track_t* at = &restored.along_track;
+    snapshot_get(&io, &at->active, sizeof(int));
+    snapshot_get(&io, &at->off_map, sizeof(int));
+    snapshot_get(&io, &at->retry_time, sizeof(double));
+    snapshot_get(&io, &at->segment, sizeof(int));
+    snapshot_get(&io, &at->offset, sizeof(float));
+    snapshot_get(&io, &at->speed, sizeof(float));
+    snapshot_get(&io, &at->bias, sizeof(float));
+    snapshot_get(&io, at->cov, sizeof(at->cov));
+    snapshot_get(&io, at->dir, sizeof(at->dir));
+    snapshot_get(&io, &at->length, sizeof(float));
+    snapshot_get(&io, &at->yaw, sizeof(float));
+    snapshot_get(&io, &at->yaw_offset, sizeof(float));
+    snapshot_get(&io, &at->roll, sizeof(float));
+    snapshot_get(&io, &at->pitch, sizeof(float));
+    snapshot_get(&io, at->axis.data, sizeof(at->axis.data));
+
+    int buffer_size = 0, entries = 0;
+    snapshot_get(&io, &buffer_size, sizeof(int));
+    snapshot_get(&io, &restored.imu_buffer_count, sizeof(int));
+    snapshot_get(&io, &restored.imu_buffer_index, sizeof(int));
+    snapshot_get(&io, &entries, sizeof(int));
+
+    if (!io.ok || buffer_size != eskf->imu_buffer_size || entries < 0 || entries > buffer_size ||
+        restored.imu_buffer_count < 0 || restored.imu_buffer_index < 0 ||
+        restored.imu_buffer_index >= buffer_size ||
+        (restored.attitude_mode != ESKF_ATTITUDE_MATRIX && restored.attitude_mode != ESKF_ATTITUDE_QUATERNION) ||
+        (at->active && saved_rail_count == eskf->rail_node_count &&
+         (at->segment < 0 || at->segment >= eskf->rail_node_count - 1))) {
+        return 0;
+    }
+
+    // Check every buffer entry before writing any of them
+    size_t entries_pos = io.pos;
+    for (int i = 0; i < entries; i++) {
+        int slot = -1;
+        imu_data_t imu;
+        snapshot_get(&io, &slot, sizeof(int));
+        snapshot_get_imu(&io, &imu);
+        if (slot < 0 || slot >= buffer_size) {
+            return 0;
+        }
+    }
+    if (!io.ok) {
+        return 0;
+    }
+
+    // Commit
+    state_write_begin(eskf);
+
+    io.pos = entries_pos;
+    for (int i = 0; i < entries; i++) {
+        int slot = 0;
+        snapshot_get(&io, &slot, sizeof(int));
+        snapshot_get_imu(&io, &eskf->imu_buffer[slot]);
+    }
+
+    restored.rotation_dirty = restored.attitude_mode == ESKF_ATTITUDE_QUATERNION;
+    restored.euler_dirty = 1;
+    if (restored.initialized) {
+        ltp_init(&restored.ltp, restored.init_lla);
+    }
+    if (saved_rail_count != eskf->rail_node_count) {
+        restored.rail_segment = -1;  // Cursor belongs to a different map
+        memset(&restored.along_track, 0, sizeof(along_track_t));  // Re-entered from the restored full state
+    }
+    restored.rail_enu_valid = 0;
+    restored.history_count = 0;  // Poses before the restored state no longer apply
+    restored.history_head = 0;
+    restored.delay_count = 0;
+    restored.delay_head = 0;
+    restored.last_fused_gps_time = 0;
+    restored.along_track_stats.active = restored.along_track.active;
+    restored.state_version = eskf->state_version;
+    *eskf = restored;
+
+    // Railway map in the restored reference frame
+    if (eskf->initialized && eskf->rail_node_count > 0) {
+        project_rail_nodes(eskf);
+    }
+    history_record(eskf);
+
+    state_write_end(eskf);
+    return 1;
+}
@@ -2,14 +2,29 @@
 #define ESKF_H
 
 #include "matrix.h"
+#include <stddef.h>
 
 #ifdef __cplusplus
 extern "C" {
 #endif
 
 // Constants
-#define MAX_RAIL_NODES 5000
-#define IMU_BUFFER_SIZE 500
+#define MAX_RAIL_NODES 5000      // Default railway map capacity (eskf_create)
+#define IMU_BUFFER_SIZE 500      // Default initialization buffer size (eskf_create)
+#define ESKF_MIN_IMU_BUFFER 10   // Samples needed before the first GPS fix initializes
+#define ESKF_MEMORY_ALIGNMENT 8  // Required alignment of caller-provided memory
+#define ESKF_HISTORY_SIZE 512    // Default pose history length in filter outputs (eskf_create)
+#define ESKF_DELAY_BUFFER_SIZE 32  // Default IMU samples kept for delayed GPS fusion (eskf_create)
+#define ESKF_ZUPT_MAX_WINDOW 64  // Longest stationary detection window (IMU samples)
+#define ESKF_ZUPT_GRAVITY_TAU 120.0  // Averaging time of the stationary detector's gravity reference (s)
+
+// Attitude representation used by the propagation
+#define ESKF_ATTITUDE_MATRIX     0  // G_R_I rotation matrix (default)
+#define ESKF_ATTITUDE_QUATERNION 1  // Unit quaternion, G_R_I materialized on demand
+
+#ifndef ESKF_DEFAULT_ATTITUDE_MODE
+#define ESKF_DEFAULT_ATTITUDE_MODE ESKF_ATTITUDE_MATRIX
+#endif
 
 // Data structures
 typedef struct {
@@ -43,10 +58,177 @@ typedef struct {
 } eskf_state_t;
 
 typedef struct {
-    float lat;
-    float lon;
+    double lat;
+    double lon;
 } rail_node_t;
 
+// Per-stage performance counters (compiled in with -DESKF_ENABLE_STATS;
+// without it the filter carries no counters and no timing code)
+#define ESKF_STAGE_PREDICT        0  // IMU prediction (imu_predict / pre-integration flush)
+#define ESKF_STAGE_GPS_UPDATE     1  // GPS measurement update
+#define ESKF_STAGE_MAP_MATCH      2  // Railway search and snap
+#define ESKF_STAGE_HEADING        3  // Tunnel heading correction from the rail direction
+#define ESKF_STAGE_ORTHONORMALIZE 4  // Rotation matrix orthonormalization (also counted in its caller's stage)
+#define ESKF_STAGE_ZUPT           5  // Zero-velocity update replacing the prediction while stationary
+#define ESKF_STAGE_ALONG_TRACK    6  // Reduced along-track filter replacing prediction and map matching in tunnels
+#define ESKF_STAGE_COUNT          7
+#define ESKF_STATS_BUCKETS 16        // Latency histogram buckets
+#define ESKF_STATS_BUCKET0_NS 250    // Upper edge of bucket 0; edges double, the last bucket is open-ended
+
+typedef struct {
+    unsigned long long calls;
+    double total_ns;
+    double min_ns;     // Valid when calls > 0
+    double max_ns;
+    unsigned int histogram[ESKF_STATS_BUCKETS];
+} eskf_stage_stats_t;
+
+typedef struct {
+    int enabled;       // 0 when the library was built without ESKF_ENABLE_STATS
+    eskf_stage_stats_t stage[ESKF_STAGE_COUNT];
+} eskf_stats_t;
+
+// Pose at one filter output, kept in the time-indexed history
+typedef struct {
+    double timestamp;
+    vec3_t G_p_I;         // IMU position in global frame (ENU)
+    vec3_t G_v_I;         // IMU velocity in global frame
+    quat_t G_q_I;         // Rotation from IMU to global frame
+} eskf_history_entry_t;
+
+// Pose interpolated at an arbitrary time (eskf_query_pose)
+typedef struct {
+    double timestamp;
+    double lat, lon, alt;  // WGS84 position (0 when the time is not covered)
+    vec3_t G_p_I;         // IMU position in global frame (ENU)
+    vec3_t G_v_I;         // IMU velocity in global frame
+    quat_t G_q_I;         // Rotation from IMU to global frame
+    float roll;           // Euler angles of G_q_I (radians)
+    float pitch;
+    float yaw;
+} eskf_pose_t;
+
+// Railway node projected into the local ENU frame (meters)
+typedef struct {
+    float east;
+    float north;
+} rail_point_t;
+
+// Local tangent plane (ENU) reference frame
+// Trig terms and radius factors are computed once from the reference position
+typedef struct {
+    double lla[3];         // Reference position (deg, deg, m)
+    double m_per_deg_lat;  // North meters per degree of latitude
+    double m_per_deg_lon;  // East meters per degree of longitude
+    double deg_per_m_lat;  // Inverse of m_per_deg_lat
+    double deg_per_m_lon;  // Inverse of m_per_deg_lon
+} ltp_t;
+
+// IMU pre-integration accumulator
+// Increments are expressed in the IMU frame at the start of the window
+typedef struct {
+    vec3_t alpha;        // Sum of angle increments (rad)
+    vec3_t beta;         // Coning correction (rad)
+    vec3_t upsilon;      // Sum of velocity increments (m/s)
+    vec3_t gamma;        // Sculling correction (m/s)
+    vec3_t delta_p;      // Double-integrated specific force (m)
+    vec3_t prev_dtheta;  // Previous sample angle increment
+    vec3_t prev_dv;      // Previous sample velocity increment
+    float dt_sum;        // Window length (s)
+    int count;           // Number of IMU samples in the window
+    double end_time;     // Timestamp of the last accumulated sample
+} imu_preint_t;
+
+// Reduced filter along the railway polyline, used in tunnels instead of the
+// full state: distance along the current segment, speed and accelerometer
+// bias along the track. Yaw follows the rail, roll and pitch are held.
+typedef struct {
+    int active;
+    int off_map;        // Ran off either end of the map: no re-entry before the next fix
+    double retry_time;  // Last entry attempt was off the map: no new one before this time
+    int segment;        // Current rail segment (rail_enu[segment] -> [segment + 1])
+    float offset;       // Distance from the segment start (m)
+    float speed;        // Speed in node order (m/s)
+    float bias;         // Accelerometer bias along the track (m/s^2)
+    float cov[3][3];    // Covariance of (offset, speed, bias)
+    float dir[2];       // Segment unit direction (east, north)
+    float length;       // Segment length (m)
+    float yaw;          // Segment yaw (East = 0, North = pi/2, as mat3_from_euler)
+    float yaw_offset;   // Vehicle yaw minus segment yaw: 0, or pi when running against node order
+    float roll, pitch;  // Held from the entry
+    vec3_t axis;        // IMU-frame direction of increasing node order (fixed at the entry)
+} along_track_t;
+
+// Along-track mode counters
+typedef struct {
+    unsigned long long entries;   // Switches from the full filter to the along-track filter
+    unsigned long long handoffs;  // Switches back (GPS re-acquired, end of the map, mode turned off)
+    unsigned long long samples;   // IMU samples processed by the along-track filter
+    unsigned long long misses;    // Entry attempts that found the position off the map
+    int active;                   // The along-track filter is running
+} eskf_along_track_stats_t;
+
+// Everything that evolves per sample after initialization, for rewinding
+// to an earlier IMU sample (delayed GPS fusion)
+typedef struct {
+    eskf_state_t state;
+    quat_t G_q_I;
+    int rotation_dirty;
+    int euler_dirty;
+    int orthonormalize_counter;
+    int gravity_correction_counter;
+    double last_gps_time;
+    int in_tunnel;
+    int current_satellites;
+    imu_data_t last_imu;
+    imu_preint_t preint;
+    double last_map_match_time;
+    vec3_t last_map_match_pos;
+    int rail_segment;
+    int map_match_in_tunnel;
+    along_track_t along_track;
+} eskf_checkpoint_t;
+
+// One retained IMU sample and the filter right after it (including fixes
+// fused before the next sample)
+typedef struct {
+    imu_data_t imu;
+    int still;    // Stationary detector decision for this sample
+    eskf_checkpoint_t checkpoint;
+} eskf_delay_entry_t;
+
+// Delayed GPS fusion counters
+typedef struct {
+    unsigned long long fixes_in_past;     // Fixes fused at an earlier IMU sample
+    unsigned long long fixes_rejected;    // Older than the window or the previous fused fix
+    unsigned long long fixes_on_arrival;  // In the window but older than the buffer: fused at once
+    unsigned long long replayed_samples;  // IMU samples re-propagated after those fixes
+    int max_replay;                       // Longest single re-propagation (IMU samples)
+} eskf_gps_delay_stats_t;
+
+// Stationary detector on the IMU alone: accel variance, gyro power and the
+// tilt of the mean specific force over a sliding window (running sums,
+// recomputed from the window once per wrap)
+typedef struct {
+    vec3_t acc[ESKF_ZUPT_MAX_WINDOW];
+    vec3_t gyro[ESKF_ZUPT_MAX_WINDOW];
+    double acc_sum[3], acc_sq[3];
+    double gyro_sum[3], gyro_sq[3];
+    int count;    // Samples in the window
+    int index;    // Next slot to write
+    int still;    // All window tests passed and the newest sample is consistent with the window
+    vec3_t gravity_ref;  // Specific force averaged over ESKF_ZUPT_GRAVITY_TAU: gravity as mounted (0: no sample yet)
+    double last_time;    // Timestamp of the newest sample
+} zupt_detector_t;
+
+// Zero-velocity fast path counters
+typedef struct {
+    unsigned long long samples;             // IMU samples processed after initialization
+    unsigned long long stationary_samples;  // Of those, handled by the zero-velocity update
+    unsigned long long stops;               // Transitions from moving to stationary
+    int stationary;                         // The last sample took the fast path
+} eskf_zupt_stats_t;
+
 // ESKF Configuration
 typedef struct {
     float acc_noise;       // Accelerometer noise (m/s^2)
@@ -66,17 +248,43 @@ typedef struct {
     eskf_state_t state;
     int initialized;
 
+    // Attitude representation
+    int attitude_mode;    // ESKF_ATTITUDE_MATRIX or ESKF_ATTITUDE_QUATERNION
+    quat_t G_q_I;         // Rotation from IMU to global frame (quaternion mode)
+    int rotation_dirty;   // state.G_R_I is stale with respect to G_q_I
+    int euler_dirty;      // state.roll/pitch/yaw are stale (computed lazily)
+
+    // Attitude maintenance cadence (in IMU samples, 1 = every sample)
+    int orthonormalize_interval;
+    int gravity_correction_interval;
+    int orthonormalize_counter;
+    int gravity_correction_counter;
+
     // Reference position
     double init_lla[3];
+    ltp_t ltp;            // Cached ENU frame at init_lla (valid once initialized)
 
     // IMU buffer for initialization
-    imu_data_t imu_buffer[IMU_BUFFER_SIZE];
+    imu_data_t* imu_buffer;     // imu_buffer_size entries
+    int imu_buffer_size;
     int imu_buffer_count;
     int imu_buffer_index;
 
     // Railway map
-    rail_node_t rail_nodes[MAX_RAIL_NODES];
+    rail_node_t* rail_nodes;    // Copy storage for eskf_load_rail_nodes (NULL: shared maps only)
+    const rail_node_t* rail_map; // Active map: rail_nodes or a shared caller array
+    rail_point_t* rail_enu;     // rail_map in the ltp frame (max_rail_nodes entries)
+    int max_rail_nodes;
     int rail_node_count;
+    int rail_enu_valid;   // rail_enu matches the current ltp
+
+    // Map matching schedule (period and distance 0 = full search every prediction)
+    float map_match_period;       // Minimum time between full map searches (s)
+    float map_match_distance;     // Distance travelled that forces a full search (m)
+    double last_map_match_time;
+    vec3_t last_map_match_pos;
+    int rail_segment;             // Map-match cursor: segment of the last snap (-1 = none)
+    int map_match_in_tunnel;      // Tunnel flag at the last map match
 
     // Tunnel detection
     double last_gps_time;
@@ -89,30 +297,212 @@ typedef struct {
 
     // Last IMU data for prediction
     imu_data_t last_imu;
+
+    // IMU pre-integration (disabled when preint_period is 0)
+    float preint_period;  // Filter prediction period (s)
+    imu_preint_t preint;
+
+    // Pose history (ring of the last history_size outputs, oldest first from
+    // history_head - history_count; disabled when history_size is 0)
+    eskf_history_entry_t* history;
+    int history_size;
+    int history_count;
+    int history_head;     // Next entry to write
+
+    // Delayed GPS fusion (off while gps_delay_window is 0): ring of the last
+    // delay_buffer_size IMU samples with the filter after each of them
+    eskf_delay_entry_t* delay_buffer;
+    int delay_buffer_size;
+    int delay_count;
+    int delay_head;       // Next entry to write
+    float gps_delay_window;        // Oldest fix age fused at its own time (s)
+    double last_fused_gps_time;    // Fixes older than this are rejected while the mode is on
+    eskf_gps_delay_stats_t gps_delay_stats;
+
+    // Zero-velocity detection (off while zupt_window is 0)
+    int zupt_window;      // Detection window (IMU samples)
+    float zupt_acc_var;    // Stationary below this accel variance (sum over axes, (m/s^2)^2)
+    float zupt_gyro_power; // ... and this gyro mean square (sum over axes, (rad/s)^2)
+    float zupt_max_tilt;   // ... with the mean specific force within this angle of gravity (rad)
+    zupt_detector_t zupt;
+    eskf_zupt_stats_t zupt_stats;
+
+    // Along-track filter in tunnels (off while along_track_enabled is 0)
+    int along_track_enabled;
+    along_track_t along_track;
+    eskf_along_track_stats_t along_track_stats;
+
+    int owns_memory;      // Allocated by eskf_create (freed by eskf_destroy)
+
+    // Live state view (seqlock): odd while an update is in progress
+    volatile unsigned int state_version;
+    int state_view_enabled;  // Keep G_R_I and roll/pitch/yaw current after every update
+
+#ifdef ESKF_ENABLE_STATS
+    eskf_stats_t stats;
+#endif
 } eskf_t;
 
+// Runtime capacities for eskf_init / eskf_required_size
+typedef struct {
+    int max_rail_nodes;   // Largest railway map (loaded or shared)
+    int imu_buffer_size;  // IMU samples kept for initialization (>= ESKF_MIN_IMU_BUFFER)
+    int copy_rail_nodes;  // Reserve storage for eskf_load_rail_nodes (0: shared maps only)
+    int history_size;     // Filter outputs kept for eskf_query_pose (0: no history)
+    int delay_buffer_size;  // IMU samples kept for eskf_set_gps_delay (0: mode unavailable)
+} eskf_capacity_t;
+
+// One instance and its own input streams for eskf_process_many
+typedef struct {
+    eskf_t* eskf;
+    const imu_data_t* imu;      // IMU samples in time order
+    int imu_count;
+    const gps_data_t* gps;      // GPS fixes in time order (may be NULL)
+    int gps_count;
+    eskf_state_t* states;       // Optional: state after each IMU sample (imu_count entries)
+    int state_stride;           // Record only every n-th sample's state (0/1: all, else ceil(imu_count / n) entries)
+    int imu_processed;          // Output: IMU samples processed after initialization
+    int gps_processed;          // Output: GPS fixes accepted
+} eskf_stream_t;
+
 // API Functions
 eskf_t* eskf_create(void);
 void eskf_destroy(eskf_t* eskf);
+
+// Place a filter into caller-provided memory (no allocation)
+// memory must be ESKF_MEMORY_ALIGNMENT aligned and at least
+// eskf_required_size(capacity) bytes; capacity NULL uses the eskf_create
+// defaults. Returns NULL if the memory or capacities are unusable.
+// eskf_destroy is a no-op on such filters; the caller releases the memory.
+size_t eskf_required_size(const eskf_capacity_t* capacity);
+eskf_t* eskf_init(void* memory, size_t size, const eskf_capacity_t* capacity);
 void eskf_reset(eskf_t* eskf);
 
 // Configure ESKF
 void eskf_set_config(eskf_t* eskf, const eskf_config_t* config);
+void eskf_set_attitude_mode(eskf_t* eskf, int mode);
+void eskf_set_maintenance(eskf_t* eskf, int orthonormalize_interval, int gravity_correction_interval);
+
+// IMU pre-integration: predict at output_rate_hz (and on every GPS fix)
+// instead of every IMU sample. 0 disables it.
+void eskf_set_preintegration(eskf_t* eskf, float output_rate_hz);
+void eskf_flush_imu(eskf_t* eskf);
+
+// Delayed GPS fusion: fixes that arrive after newer IMU samples (receiver
+// latency) are fused at their own timestamp. The filter rewinds to the last
+// retained IMU sample not newer than the fix, applies it and re-propagates
+// the retained samples since, so the result equals fusing the fix on time
+// (in eskf_process_many order).
+// Fixes older than max_delay_s or than the previously fused fix are
+// rejected (eskf_process_gps returns 0). Fixes within max_delay_s but older
+// than every retained sample are fused at the current state, as with the
+// mode off. The re-propagation cost is bounded by the capacity's
+// delay_buffer_size; eskf_gps_delay_buffer_size gives the size that covers
+// max_delay_s at an IMU rate.
+// 0 turns the mode off (fixes are applied at the current state, as before).
+void eskf_set_gps_delay(eskf_t* eskf, float max_delay_s);
+void eskf_get_gps_delay_stats(const eskf_t* eskf, eskf_gps_delay_stats_t* stats);
+int eskf_gps_delay_buffer_size(float max_delay_s, float imu_rate_hz);  // 0 if either is <= 0
+
+// Zero-velocity fast path for stops, detected from the IMU alone. Over the
+// last window samples:
+//   - accel variance (sum over axes) below acc_var: no ride vibration,
+//   - gyro mean square (sum over axes) below gyro_power: not rotating,
+//   - mean specific force within max_tilt of the gravity direction (the
+//     specific force averaged over ESKF_ZUPT_GRAVITY_TAU): not accelerating.
+// Each such sample only applies a zero-velocity Kalman update (no
+// propagation or map matching) until motion resumes. window 0 turns it
+// off (the default); at most ESKF_ZUPT_MAX_WINDOW.
+void eskf_set_zupt(eskf_t* eskf, int window, float acc_var, float gyro_power, float max_tilt);
+void eskf_get_zupt_stats(const eskf_t* eskf, eskf_zupt_stats_t* stats);
+
+// Along-track mode for tunnels: once the filter is in a tunnel and on the
+// railway map, the 15-state prediction and map matching are replaced by a
+// 3-state filter (chainage, speed, accelerometer bias) moving along the
+// rail polyline. Position, velocity and yaw are taken from the rail. The
+// next GPS fix hands back to the full filter, with the position and
+// velocity covariance taken from the along-track filter. Needs a railway
+// map; 0 turns it off (and hands back at once if it is running).
+void eskf_set_along_track(eskf_t* eskf, int enabled);
+void eskf_get_along_track_stats(const eskf_t* eskf, eskf_along_track_stats_t* stats);
+
+// Map matching schedule: full map search at most rate_hz times per second
+// or every distance_m travelled (and always on tunnel entry). In between,
+// the position is projected onto the segments around the last match.
+void eskf_set_map_match_schedule(eskf_t* eskf, float rate_hz, float distance_m);
 
 // Process sensor data
 int eskf_process_imu(eskf_t* eskf, const imu_data_t* imu);
 int eskf_process_gps(eskf_t* eskf, const gps_data_t* gps);
 
+// Process an array of IMU samples in one call (returns number of predictions)
+int eskf_process_imu_batch(eskf_t* eskf, const imu_data_t* imu, int count);
+
+// Single IMU sample passed by value (cheap entry point for language bindings)
+int eskf_process_imu_values(eskf_t* eskf, double timestamp,
+                            float ax, float ay, float az,
+                            float gx, float gy, float gz);
+
+// Advance independent instances on their own streams in one call
+// GPS fixes are applied after the IMU samples that are not newer than them.
+// Instances run in parallel with OpenMP when compiled with -fopenmp
+// (num_threads <= 0: OpenMP default). Returns the total of imu_processed.
+int eskf_process_many(eskf_stream_t* streams, int count, int num_threads);
+
 // Get current state
 void eskf_get_state(const eskf_t* eskf, eskf_state_t* state);
 
+// Live read-only view of the state (no copy). Enables keeping G_R_I and
+// roll/pitch/yaw current after every update (they are otherwise computed
+// lazily). Readers take eskf_state_version before and after reading: the
+// data is consistent if both are equal and even.
+const eskf_state_t* eskf_state_view(eskf_t* eskf);
+unsigned int eskf_state_version(const eskf_t* eskf);
+
+// Pose at an arbitrary time between the oldest and the newest filter output
+// in the history: binary search, linear interpolation of position and
+// velocity, slerp of the attitude. Returns 1, or 0 (pose zeroed except
+// timestamp) when t is outside the history. The batch variant fills one
+// pose per time and returns how many were covered; sorted times are
+// searched incrementally. The history is cleared by reset and restore.
+int eskf_query_pose(const eskf_t* eskf, double t, eskf_pose_t* pose);
+int eskf_query_poses(const eskf_t* eskf, const double* times, int count, eskf_pose_t* poses);
+
+// Per-stage counters (see ESKF_STAGE_*). Returns 1 with the counters
+// copied to stats, or 0 (stats zeroed) when built without ESKF_ENABLE_STATS.
+// Read from the thread driving the filter; counters are not part of snapshots.
+int eskf_get_stats(const eskf_t* eskf, eskf_stats_t* stats);
+void eskf_reset_stats(eskf_t* eskf);
+
+// Checkpoint / restore
+// Versioned binary snapshot of everything that evolves while running: state
+// and covariance, attitude, init LLA, tunnel flags, last IMU, map-match
+// cursor, pending pre-integration, the stationary detector window, the
+// along-track filter and the initialization buffer entries still in use.
+// Configuration and the railway map are not included; restore into a filter
+// configured like the saved one (same map, imu_buffer_size and zupt window).
+// Snapshots of another version are rejected.
+#define ESKF_SNAPSHOT_VERSION 2
+size_t eskf_snapshot_size(const eskf_t* eskf);
+size_t eskf_save_state(const eskf_t* eskf, void* buffer, size_t size);  // Bytes written, 0 if too small
+int eskf_restore_state(eskf_t* eskf, const void* buffer, size_t size);  // 1 on success, 0 if rejected
+
 // Load railway nodes for route projection
 int eskf_load_rail_nodes(eskf_t* eskf, const rail_node_t* nodes, int count);
 
+// Use a caller-owned railway map without copying it (one map shared by many
+// instances; must stay valid and unchanged while in use)
+int eskf_share_rail_nodes(eskf_t* eskf, const rail_node_t* nodes, int count);
+
 // Coordinate transformations
 void lla_to_enu(const double* init_lla, const double* target_lla, vec3_t* enu);
 void enu_to_lla(const double* init_lla, const vec3_t* enu, double* lla);
 
+// Coordinate transformations with a precomputed reference frame
+void ltp_init(ltp_t* ltp, const double* ref_lla);
+void ltp_lla_to_enu(const ltp_t* ltp, const double* target_lla, vec3_t* enu);
+void ltp_enu_to_lla(const ltp_t* ltp, const vec3_t* enu, double* lla);
+
 #ifdef __cplusplus
 }
 #endif
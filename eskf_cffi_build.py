@@ -0,0 +1,92 @@
+"""Build the ``_eskf_cffi`` Python extension from eskf.h / matrix.h.
+
+Usage:
+    python eskf_cffi_build.py
+    ESKF_ENABLE_STATS=1 python eskf_cffi_build.py   # with per-stage timing counters
+
+The C declarations are taken from the headers directly, so the extension
+always matches the library sources. The NumPy dtypes in eskf_ext.py are
+checked against the compiled struct layout with static asserts: a
+mismatch fails the build instead of corrupting memory at runtime.
+"""
+import os
+import re
+import sys
+from pathlib import Path
+
+from cffi import FFI
+
+from eskf_ext import STRUCT_DTYPES
+
+ROOT = Path(__file__).parent
+HEADERS = ['matrix.h', 'eskf.h', 'ringbuf.h']
+SOURCES = ['matrix.c', 'eskf.c', 'ringbuf.c']
+
+# Optional features switched by environment variables
+DEFINES = [name for name in ('ESKF_ENABLE_STATS',) if os.environ.get(name, '0') not in ('', '0')]
+
+# OpenMP for eskf_process_many (Apple clang has no -fopenmp by default)
+if sys.platform == 'win32':
+    OPENMP_COMPILE, OPENMP_LINK = ['/openmp'], []
+elif sys.platform.startswith('linux'):
+    OPENMP_COMPILE, OPENMP_LINK = ['-fopenmp'], ['-fopenmp']
+else:
+    OPENMP_COMPILE, OPENMP_LINK = [], []
+
+
+def header_cdef(path, defines=()):
+    """Turn a C header into cffi cdef text.
+
+    Keeps integer #defines and declarations; drops includes and guards.
+    #ifdef/#ifndef blocks are resolved against ``defines`` (never
+    __cplusplus), so optional struct members match the compiled layout.
+    """
+    lines = []
+    active = [True]
+    for line in path.read_text(encoding='utf-8').splitlines():
+        stripped = line.strip()
+        if stripped.startswith('#'):
+            conditional = re.match(r'#(ifdef|ifndef)\s+(\w+)', stripped)
+            if conditional:
+                defined = conditional.group(2) in defines
+                active.append(active[-1] and defined == (conditional.group(1) == 'ifdef'))
+            elif stripped.startswith('#else'):
+                active[-1] = not active[-1] and active[-2]
+            elif stripped.startswith('#endif'):
+                active.pop()
+            elif active[-1] and re.match(r'#define\s+\w+\s+-?\d+\s*(//.*)?$', stripped):
+                lines.append(re.sub(r'\s*//.*$', '', stripped))
+            continue
+        if active[-1]:
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def layout_checks():
+    """Static asserts comparing the NumPy dtypes with the C structs."""
+    checks = ['#include <stddef.h>']
+    for ctype, dtype in STRUCT_DTYPES.items():
+        checks.append(f'_Static_assert(sizeof({ctype}) == {dtype.itemsize}, '
+                      f'"{ctype}: size differs from eskf_ext dtype");')
+        for name in dtype.names:
+            offset = dtype.fields[name][1]
+            checks.append(f'_Static_assert(offsetof({ctype}, {name}) == {offset}, '
+                          f'"{ctype}.{name}: offset differs from eskf_ext dtype");')
+    return '\n'.join(checks)
+
+
+ffibuilder = FFI()
+ffibuilder.cdef('\n'.join(header_cdef(ROOT / h, DEFINES) for h in HEADERS))
+ffibuilder.set_source(
+    '_eskf_cffi',
+    '#include "eskf.h"\n#include "ringbuf.h"\n' + layout_checks(),
+    sources=[str(ROOT / s) for s in SOURCES],
+    include_dirs=[str(ROOT)],
+    define_macros=[('_USE_MATH_DEFINES', None)] + [(name, None) for name in DEFINES],
+    extra_compile_args=OPENMP_COMPILE + ([] if sys.platform == 'win32' else ['-O2']),
+    extra_link_args=OPENMP_LINK,
+    libraries=[] if sys.platform == 'win32' else ['m'],
+)
+
+if __name__ == '__main__':
+    ffibuilder.compile(tmpdir=str(ROOT / 'build'), target=str(ROOT / '_eskf_cffi.*'), verbose=True)
@@ -0,0 +1,615 @@
+"""Python bindings for the ESKF C library.
+
+Wraps the compiled cffi extension ``_eskf_cffi`` (built with
+``python eskf_cffi_build.py``). All calls into C release the GIL.
+
+The NumPy dtypes below mirror the C structs in eskf.h; the build script
+checks their layout against the C compiler with static asserts.
+"""
+import threading
+import time
+import warnings
+
+import numpy as np
+
+try:
+    from _eskf_cffi import ffi, lib
+except ImportError:  # Extension not built yet
+    ffi = lib = None
+
+IMU_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('acc', np.float32, (3,)),
+    ('gyro', np.float32, (3,)),
+], align=True)
+
+GPS_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('lat', np.float64),
+    ('lon', np.float64),
+    ('alt', np.float64),
+    ('cov', np.float32, (3, 3)),
+    ('satellites', np.int32),
+], align=True)
+
+STATE_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('lat', np.float64),
+    ('lon', np.float64),
+    ('alt', np.float64),
+    ('G_p_I', np.float32, (3,)),
+    ('G_v_I', np.float32, (3,)),
+    ('G_R_I', np.float32, (3, 3)),
+    ('acc_bias', np.float32, (3,)),
+    ('gyro_bias', np.float32, (3,)),
+    ('cov', np.float32, (15, 15)),
+    ('roll', np.float32),
+    ('pitch', np.float32),
+    ('yaw', np.float32),
+], align=True)
+
+POSE_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('lat', np.float64),
+    ('lon', np.float64),
+    ('alt', np.float64),
+    ('G_p_I', np.float32, (3,)),
+    ('G_v_I', np.float32, (3,)),
+    ('G_q_I', np.float32, (4,)),
+    ('roll', np.float32),
+    ('pitch', np.float32),
+    ('yaw', np.float32),
+], align=True)
+
+RAIL_NODE_DTYPE = np.dtype([
+    ('lat', np.float64),
+    ('lon', np.float64),
+], align=True)
+
+# C struct name -> NumPy dtype, used by the build-time layout check
+STRUCT_DTYPES = {
+    'imu_data_t': IMU_DTYPE,
+    'gps_data_t': GPS_DTYPE,
+    'eskf_state_t': STATE_DTYPE,
+    'eskf_pose_t': POSE_DTYPE,
+    'rail_node_t': RAIL_NODE_DTYPE,
+}
+
+# GPS covariance used when process_gps is called without one (m^2)
+GPS_DEFAULT_COV = np.eye(3) * 25.0
+
+ATTITUDE_MATRIX = 0
+ATTITUDE_QUATERNION = 1
+
+# eskf_stats_t stage order (ESKF_STAGE_* in eskf.h)
+STAGE_NAMES = ['predict', 'gps_update', 'map_match', 'heading', 'orthonormalize', 'zupt', 'along_track']
+
+
+def _require_extension():
+    if lib is None:
+        raise RuntimeError("ESKF extension not built. Run: python eskf_cffi_build.py")
+
+
+def rail_node_array(lat, lon):
+    """RAIL_NODE_DTYPE array from latitude/longitude sequences."""
+    nodes = np.empty(len(lat), dtype=RAIL_NODE_DTYPE)
+    nodes['lat'] = lat
+    nodes['lon'] = lon
+    return nodes
+
+
+def _capacity(max_rail_nodes, imu_buffer_size, copy_rail_nodes, history_size=None, delay_buffer_size=None):
+    capacity = ffi.new("eskf_capacity_t *")
+    capacity.max_rail_nodes = lib.MAX_RAIL_NODES if max_rail_nodes is None else max_rail_nodes
+    capacity.imu_buffer_size = lib.IMU_BUFFER_SIZE if imu_buffer_size is None else imu_buffer_size
+    capacity.copy_rail_nodes = 1 if copy_rail_nodes else 0
+    capacity.history_size = lib.ESKF_HISTORY_SIZE if history_size is None else history_size
+    capacity.delay_buffer_size = lib.ESKF_DELAY_BUFFER_SIZE if delay_buffer_size is None else delay_buffer_size
+    return capacity
+
+
+def gps_delay_buffer_size(max_delay_s, imu_rate_hz):
+    """delay_buffer_size that lets set_gps_delay(max_delay_s) rewind at an IMU rate."""
+    _require_extension()
+    return lib.eskf_gps_delay_buffer_size(max_delay_s, imu_rate_hz)
+
+
+def required_size(max_rail_nodes=None, imu_buffer_size=None, copy_rail_nodes=True, history_size=None,
+                  delay_buffer_size=None):
+    """Bytes needed by one filter with the given capacities (0 if invalid)."""
+    _require_extension()
+    return lib.eskf_required_size(_capacity(max_rail_nodes, imu_buffer_size, copy_rail_nodes, history_size,
+                                            delay_buffer_size))
+
+
+class Eskf:
+    """One ESKF filter instance backed by the C library.
+
+    Without arguments the filter is allocated by eskf_create. Capacities
+    and/or a writable buffer (``memory``) place it with eskf_init instead;
+    the buffer is kept alive by the instance.
+    """
+
+    def __init__(self, max_rail_nodes=None, imu_buffer_size=None, copy_rail_nodes=True, memory=None,
+                 history_size=None, delay_buffer_size=None):
+        _require_extension()
+        self._memory = None
+        self._copy_rail_nodes = copy_rail_nodes
+        if (memory is None and max_rail_nodes is None and imu_buffer_size is None and copy_rail_nodes and
+                history_size is None and delay_buffer_size is None):
+            self._ptr = lib.eskf_create()
+        else:
+            capacity = _capacity(max_rail_nodes, imu_buffer_size, copy_rail_nodes, history_size,
+                                 delay_buffer_size)
+            size = lib.eskf_required_size(capacity)
+            if size == 0:
+                raise ValueError("Invalid ESKF capacities")
+            if memory is None:
+                memory = np.empty(size, dtype=np.uint8)
+            self._memory = memory
+            self._ptr = lib.eskf_init(ffi.from_buffer(memory), len(memoryview(memory).cast('B')), capacity)
+        if self._ptr == ffi.NULL:
+            raise MemoryError("ESKF allocation failed")
+        self._gps = ffi.new("gps_data_t *")
+
+    def close(self):
+        if self._ptr is not None:
+            lib.eskf_destroy(self._ptr)
+            self._ptr = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        if lib is not None and getattr(self, '_ptr', None) is not None:
+            self.close()
+
+    @property
+    def ptr(self):
+        """Raw ``eskf_t *`` for calling other C functions directly."""
+        return self._ptr
+
+    # Configuration
+    def reset(self):
+        lib.eskf_reset(self._ptr)
+
+    def set_attitude_mode(self, mode):
+        lib.eskf_set_attitude_mode(self._ptr, mode)
+
+    def set_maintenance(self, orthonormalize_interval, gravity_correction_interval):
+        lib.eskf_set_maintenance(self._ptr, orthonormalize_interval, gravity_correction_interval)
+
+    def set_preintegration(self, output_rate_hz):
+        lib.eskf_set_preintegration(self._ptr, output_rate_hz)
+
+    def set_gps_delay(self, max_delay_s, imu_rate_hz=None):
+        """Fuse late GPS fixes (up to max_delay_s old) at their own timestamp; 0 turns it off.
+
+        With imu_rate_hz, warns when the filter's delay buffer cannot hold
+        max_delay_s of IMU samples (fixes older than the buffer are then
+        fused on arrival); size it with Eskf(delay_buffer_size=
+        gps_delay_buffer_size(max_delay_s, imu_rate_hz)).
+        """
+        if imu_rate_hz is not None and max_delay_s > 0:
+            needed = gps_delay_buffer_size(max_delay_s, imu_rate_hz)
+            if self._ptr.delay_buffer_size < needed:
+                warnings.warn(f"Delay buffer of {self._ptr.delay_buffer_size} IMU samples covers "
+                              f"{self._ptr.delay_buffer_size / imu_rate_hz:.3f} s at {imu_rate_hz:g} Hz, less than "
+                              f"{max_delay_s:g} s; older fixes are fused on arrival. "
+                              f"Use delay_buffer_size={needed}", RuntimeWarning, stacklevel=2)
+        lib.eskf_set_gps_delay(self._ptr, max_delay_s)
+
+    def get_gps_delay_stats(self):
+        stats = ffi.new("eskf_gps_delay_stats_t *")
+        lib.eskf_get_gps_delay_stats(self._ptr, stats)
+        return {'fixes_in_past': stats.fixes_in_past, 'fixes_rejected': stats.fixes_rejected,
+                'fixes_on_arrival': stats.fixes_on_arrival, 'replayed_samples': stats.replayed_samples,
+                'max_replay': stats.max_replay}
+
+    def set_zupt(self, window=50, acc_var=0.0035, gyro_power=1e-4, max_tilt=0.04):
+        """Zero-velocity fast path at stops (window in IMU samples, 0 turns it off).
+
+        acc_var and gyro_power are summed over the three axes, in (m/s^2)^2
+        and (rad/s)^2; max_tilt is in rad. The defaults separate stops from
+        motion on simulate.py --vibration 0.006 logs at 100 Hz and never
+        fire on data.csv (no stops); accel variance grows with the IMU
+        rate and the sensor noise, so recheck acc_var for other IMUs.
+        """
+        lib.eskf_set_zupt(self._ptr, window, acc_var, gyro_power, max_tilt)
+
+    def get_zupt_stats(self):
+        """Stationary sample counts and the share of the per-sample work they skipped.
+
+        'skipped_fraction' is the share of IMU samples that took the fast
+        path. With ESKF_ENABLE_STATS, 'compute_saved_fraction' estimates the
+        share of the IMU-path time (prediction + map matching) saved: the
+        skipped samples are costed at the mean of the moving ones, minus
+        the zero-velocity updates actually run.
+        """
+        zs = ffi.new("eskf_zupt_stats_t *")
+        lib.eskf_get_zupt_stats(self._ptr, zs)
+        result = {'samples': zs.samples, 'stationary_samples': zs.stationary_samples, 'stops': zs.stops,
+                  'stationary': bool(zs.stationary),
+                  'skipped_fraction': zs.stationary_samples / zs.samples if zs.samples else 0.0}
+        stages = self.get_stats()
+        moving = zs.samples - zs.stationary_samples
+        if stages is not None and moving > 0:
+            moving_ns = stages['predict']['total_ns'] + stages['map_match']['total_ns']
+            skipped_ns = zs.stationary_samples * moving_ns / moving
+            total_ns = moving_ns + skipped_ns
+            result['compute_saved_fraction'] = \
+                (skipped_ns - stages['zupt']['total_ns']) / total_ns if total_ns > 0 else 0.0
+        return result
+
+    def set_along_track(self, enabled=True):
+        """Reduced chainage/speed/bias filter along the rail in tunnels (needs a railway map)."""
+        lib.eskf_set_along_track(self._ptr, 1 if enabled else 0)
+
+    def get_along_track_stats(self):
+        """Along-track mode counters.
+
+        With ESKF_ENABLE_STATS, 'along_track_ns' and 'full_ns' are the mean
+        per-sample cost of the along-track filter and of the full filter's
+        IMU path (prediction + map matching).
+        """
+        at = ffi.new("eskf_along_track_stats_t *")
+        lib.eskf_get_along_track_stats(self._ptr, at)
+        result = {'entries': at.entries, 'handoffs': at.handoffs, 'samples': at.samples,
+                  'misses': at.misses, 'active': bool(at.active)}
+        stages = self.get_stats()
+        if stages is not None:
+            result['along_track_ns'] = stages['along_track']['mean_ns']
+            predict = stages['predict']
+            result['full_ns'] = (predict['total_ns'] + stages['map_match']['total_ns']) / predict['calls'] \
+                if predict['calls'] else 0.0
+        return result
+
+    def set_map_match_schedule(self, rate_hz, distance_m):
+        lib.eskf_set_map_match_schedule(self._ptr, rate_hz, distance_m)
+
+    def load_rail_nodes(self, lat, lon):
+        """Copy a railway map into the filter. Returns the node count loaded."""
+        if not self._copy_rail_nodes:
+            raise RuntimeError("Filter was created with copy_rail_nodes=False and has no map storage; "
+                               "use share_rail_nodes(rail_node_array(lat, lon)) instead")
+        nodes = rail_node_array(lat, lon)
+        return lib.eskf_load_rail_nodes(self._ptr, ffi.from_buffer("rail_node_t[]", nodes), len(nodes))
+
+    def share_rail_nodes(self, nodes):
+        """Use a RAIL_NODE_DTYPE array without copying (same array for many filters)."""
+        nodes = np.ascontiguousarray(nodes, dtype=RAIL_NODE_DTYPE)
+        self._shared_rail = nodes  # C keeps a pointer into it
+        return lib.eskf_share_rail_nodes(self._ptr, ffi.from_buffer("rail_node_t[]", nodes), len(nodes))
+
+    # Sensor input
+    def process_imu(self, timestamp, acc, gyro):
+        return lib.eskf_process_imu_values(self._ptr, timestamp,
+                                           acc[0], acc[1], acc[2], gyro[0], gyro[1], gyro[2])
+
+    def process_imu_array(self, imu):
+        """Process a contiguous IMU_DTYPE array in one C call. Returns predictions run."""
+        imu = np.ascontiguousarray(imu, dtype=IMU_DTYPE)
+        if len(imu) == 0:
+            return 0
+        return lib.eskf_process_imu_batch(self._ptr, ffi.from_buffer("imu_data_t[]", imu), len(imu))
+
+    def process_gps(self, timestamp, lat, lon, alt=0.0, satellites=0, cov=None):
+        """Fuse one GPS fix; cov defaults to GPS_DEFAULT_COV (25 m^2 diagonal)."""
+        gps = self._gps
+        gps.timestamp = timestamp
+        gps.lat = lat
+        gps.lon = lon
+        gps.alt = alt
+        gps.satellites = satellites
+        if cov is None:
+            cov = GPS_DEFAULT_COV
+        for i in range(3):
+            for j in range(3):
+                gps.cov.data[i][j] = cov[i][j]
+        return lib.eskf_process_gps(self._ptr, gps)
+
+    def process_gps_array(self, gps):
+        """Process a GPS_DTYPE array in order (one C call per fix). Returns fixes accepted."""
+        gps = np.ascontiguousarray(gps, dtype=GPS_DTYPE)
+        fixes = ffi.from_buffer("gps_data_t[]", gps)
+        return sum(lib.eskf_process_gps(self._ptr, fixes + i) for i in range(len(gps)))
+
+    def flush_imu(self):
+        lib.eskf_flush_imu(self._ptr)
+
+    # State output
+    def get_state(self, out=None):
+        """Copy the current state into an ``eskf_state_t`` cdata (reused if given)."""
+        if out is None:
+            out = ffi.new("eskf_state_t *")
+        lib.eskf_get_state(self._ptr, out)
+        return out
+
+    def query_pose(self, t):
+        """POSE_DTYPE record interpolated at time t, or None outside the history."""
+        pose = np.zeros((), dtype=POSE_DTYPE)
+        if not lib.eskf_query_pose(self._ptr, t, ffi.from_buffer("eskf_pose_t *", pose)):
+            return None
+        return pose
+
+    def query_poses(self, times):
+        """POSE_DTYPE array with one pose per query time (one C call).
+
+        Times outside the history give zero rows (lat == 0) that keep only
+        their timestamp. Sorted times are the fastest to look up.
+        """
+        times = np.ascontiguousarray(times, dtype=np.float64)
+        poses = np.zeros(len(times), dtype=POSE_DTYPE)
+        if len(times):
+            lib.eskf_query_poses(self._ptr, ffi.from_buffer("double[]", times), len(times),
+                                 ffi.from_buffer("eskf_pose_t[]", poses))
+        return poses
+
+    def save_state(self):
+        """Checkpoint the running filter as a versioned binary snapshot (bytes)."""
+        size = lib.eskf_snapshot_size(self._ptr)
+        buffer = ffi.new("char[]", size)
+        written = lib.eskf_save_state(self._ptr, buffer, size)
+        return ffi.buffer(buffer, written)[:]
+
+    def restore_state(self, snapshot):
+        """Restore a snapshot from save_state. Returns False if it was rejected."""
+        return bool(lib.eskf_restore_state(self._ptr, ffi.from_buffer(snapshot), len(snapshot)))
+
+    # Performance counters (built with ESKF_ENABLE_STATS=1)
+    def get_stats(self):
+        """Per-stage call counts, latencies (ns) and latency histograms.
+
+        Returns None when the extension was built without ESKF_ENABLE_STATS.
+        Histogram bucket k counts calls below ``bucket_edges_ns[k]``
+        (the last bucket is open-ended).
+        """
+        stats = ffi.new("eskf_stats_t *")
+        if not lib.eskf_get_stats(self._ptr, stats):
+            return None
+        edges = [lib.ESKF_STATS_BUCKET0_NS * 2.0 ** k for k in range(lib.ESKF_STATS_BUCKETS - 1)]
+        result = {}
+        for k, name in enumerate(STAGE_NAMES):
+            stage = stats.stage[k]
+            result[name] = {
+                'calls': stage.calls,
+                'total_ns': stage.total_ns,
+                'mean_ns': stage.total_ns / stage.calls if stage.calls else 0.0,
+                'min_ns': stage.min_ns,
+                'max_ns': stage.max_ns,
+                'histogram': list(stage.histogram),
+                'bucket_edges_ns': edges + [float('inf')],
+            }
+        return result
+
+    def reset_stats(self):
+        lib.eskf_reset_stats(self._ptr)
+
+    def state_view(self):
+        """Read-only NumPy view of the live state (see StateView)."""
+        return StateView(self)
+
+    def get_state_array(self):
+        """Copy the current state into a STATE_DTYPE record."""
+        state = np.zeros((), dtype=STATE_DTYPE)
+        lib.eskf_get_state(self._ptr, ffi.from_buffer("eskf_state_t *", state))
+        return state
+
+
+class StateView:
+    """Read-only NumPy arrays backed directly by a filter's eskf_state_t.
+
+    Fields (``view.G_p_I``, ``view.cov``, ...) always show the current
+    values without copying. A reader on another thread checks consistency
+    with the version counter:
+
+        v = view.begin_read()
+        p, P = view.G_p_I[0], view.cov[0, 0]
+        if view.end_read(v): ...  # no update happened in between
+
+    or takes a consistent copy with snapshot(). The view must not outlive
+    the filter.
+    """
+
+    def __init__(self, eskf):
+        self._eskf = eskf
+        ptr = lib.eskf_state_view(eskf.ptr)
+        record = np.frombuffer(ffi.buffer(ptr, STATE_DTYPE.itemsize), dtype=STATE_DTYPE).reshape(())
+        record.flags.writeable = False
+        self.record = record
+        # Field views (0-d arrays for the scalars), bound once
+        for name in STATE_DTYPE.names:
+            setattr(self, name, record[name])
+
+    def version(self):
+        return lib.eskf_state_version(self._eskf.ptr)
+
+    def begin_read(self):
+        """Wait until no update is in progress and return the version."""
+        while True:
+            version = self.version()
+            if not version & 1:
+                return version
+
+    def end_read(self, version):
+        """True if the state did not change since begin_read."""
+        return self.version() == version
+
+    def snapshot(self, max_retries=1000):
+        """Consistent copy of the state as a STATE_DTYPE record."""
+        for _ in range(max_retries):
+            version = self.begin_read()
+            copy = self.record.copy()
+            if self.end_read(version):
+                return copy
+        raise RuntimeError("State kept changing during snapshot")
+
+
+def create_arena(count, max_rail_nodes=None, imu_buffer_size=None, copy_rail_nodes=True, history_size=None,
+                 delay_buffer_size=None):
+    """Place ``count`` filters back to back in one contiguous NumPy buffer.
+
+    Returns the list of Eskf instances; the arena lives as long as any of
+    them does.
+    """
+    size = required_size(max_rail_nodes, imu_buffer_size, copy_rail_nodes, history_size, delay_buffer_size)
+    if size == 0:
+        raise ValueError("Invalid ESKF capacities")
+    arena = np.empty(count * size, dtype=np.uint8)
+    return [Eskf(max_rail_nodes, imu_buffer_size, copy_rail_nodes, memory=arena[i * size:(i + 1) * size],
+                 history_size=history_size, delay_buffer_size=delay_buffer_size)
+            for i in range(count)]
+
+
+def process_many(filters, imu_arrays, gps_arrays=None, num_threads=0, record_states=False, state_stride=1):
+    """Advance several filters on their own IMU/GPS arrays in one C call.
+
+    filters: sequence of Eskf; imu_arrays / gps_arrays: one IMU_DTYPE /
+    GPS_DTYPE array (or None) per filter. The filters run in parallel on
+    OpenMP threads with the GIL released.
+
+    Returns the IMU samples processed per filter, plus one STATE_DTYPE
+    array per filter if record_states: the state after every
+    state_stride-th IMU sample (samples 0, n, 2n, ...).
+    """
+    _require_extension()
+    count = len(filters)
+    if gps_arrays is None:
+        gps_arrays = [None] * count
+
+    streams = ffi.new("eskf_stream_t[]", count)
+    keep = []  # Buffers referenced by the streams during the call
+    states = []
+    for i, (eskf, imu, gps) in enumerate(zip(filters, imu_arrays, gps_arrays)):
+        imu = np.ascontiguousarray(imu, dtype=IMU_DTYPE)
+        streams[i].eskf = eskf.ptr
+        streams[i].imu = ffi.from_buffer("imu_data_t[]", imu)
+        streams[i].imu_count = len(imu)
+        keep.append(imu)
+        if gps is not None and len(gps):
+            gps = np.ascontiguousarray(gps, dtype=GPS_DTYPE)
+            streams[i].gps = ffi.from_buffer("gps_data_t[]", gps)
+            streams[i].gps_count = len(gps)
+            keep.append(gps)
+        if record_states:
+            out = np.zeros(-(-len(imu) // max(state_stride, 1)), dtype=STATE_DTYPE)
+            streams[i].states = ffi.from_buffer("eskf_state_t[]", out)
+            streams[i].state_stride = state_stride
+            states.append(out)
+
+    lib.eskf_process_many(streams, count, num_threads)
+
+    processed = np.array([streams[i].imu_processed for i in range(count)])
+    if record_states:
+        return processed, states
+    return processed
+
+
+class SensorRing:
+    """Lock-free single-producer/single-consumer sensor queue (ringbuf.c).
+
+    The Python side is the producer: push IMU_DTYPE / GPS_DTYPE arrays
+    (one C call each, GIL released). A RingConsumer, or C code calling
+    eskf_drain_ring, fuses the queued messages on another thread.
+    Messages that do not fit are rejected and counted in ``dropped``.
+    """
+
+    def __init__(self, capacity=4096):
+        _require_extension()
+        size = lib.sensor_ring_required_size(capacity)
+        if size == 0:
+            raise ValueError("Ring capacity must be a power of two >= 2")
+        self._memory = np.empty(-(-size // 8), dtype=np.uint64)  # 8-byte aligned
+        self._ptr = lib.sensor_ring_init(ffi.from_buffer(self._memory), size, capacity)
+        if self._ptr == ffi.NULL:
+            raise MemoryError("Ring initialization failed")
+
+    @property
+    def ptr(self):
+        return self._ptr
+
+    @property
+    def capacity(self):
+        return lib.sensor_ring_capacity(self._ptr)
+
+    @property
+    def dropped(self):
+        return lib.sensor_ring_dropped(self._ptr)
+
+    def __len__(self):
+        return lib.sensor_ring_count(self._ptr)
+
+    def _push(self, push, ctype, array, block):
+        if len(array) == 0:
+            return 0
+        items = ffi.from_buffer(ctype, array)
+        if not block:
+            return push(self._ptr, items, len(array))
+        # Only offer what fits (the consumer can only free more), so nothing counts as dropped
+        pushed = 0
+        while pushed < len(array):
+            room = min(self.capacity - len(self), len(array) - pushed)
+            if room > 0:
+                pushed += push(self._ptr, items + pushed, room)
+            else:
+                time.sleep(0)  # Let the consumer make room
+        return pushed
+
+    def push_imu_array(self, imu, block=False):
+        """Queue IMU samples; returns how many fitted (all of them if block)."""
+        imu = np.ascontiguousarray(imu, dtype=IMU_DTYPE)
+        return self._push(lib.sensor_ring_push_imu_batch, "imu_data_t[]", imu, block)
+
+    def push_gps_array(self, gps, block=False):
+        """Queue GPS fixes; returns how many fitted (all of them if block)."""
+        gps = np.ascontiguousarray(gps, dtype=GPS_DTYPE)
+        return self._push(lib.sensor_ring_push_gps_batch, "gps_data_t[]", gps, block)
+
+    def push_stream(self, imu, gps, block=True):
+        """Queue a log in eskf_process_many order (GPS before the first newer IMU sample)."""
+        gps_before = np.searchsorted(imu['timestamp'], gps['timestamp'], side='right')
+        pushed = 0
+        start = 0
+        for k, stop in enumerate(gps_before):
+            pushed += self.push_imu_array(imu[start:stop], block)
+            pushed += self.push_gps_array(gps[k:k + 1], block)
+            start = stop
+        return pushed + self.push_imu_array(imu[start:], block)
+
+
+class RingConsumer:
+    """Filter thread draining a SensorRing into an Eskf.
+
+    The whole loop runs in C (eskf_ring_consume) without the GIL; it sleeps
+    idle_sleep_us whenever the ring is empty. stop() returns after every
+    message queued before it has been fused.
+    """
+
+    def __init__(self, eskf, ring, idle_sleep_us=100):
+        self.eskf = eskf
+        self.ring = ring
+        self.idle_sleep_us = idle_sleep_us
+        self.processed = 0
+        self._stop = ffi.new("int *")
+        self._thread = threading.Thread(target=self._run, name='eskf-ring-consumer', daemon=True)
+
+    def _run(self):
+        self.processed = lib.eskf_ring_consume(self.eskf.ptr, self.ring.ptr, self._stop, self.idle_sleep_us)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop[0] = 1
+        self._thread.join()
+        return self.processed
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
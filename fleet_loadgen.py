@@ -0,0 +1,210 @@
+"""Fleet load generator for ingest_server.py: how many vehicles fit on one machine?
+
+Simulates N vehicles, each with its own TCP connection (HELLO with its
+vehicle ID and direction, then SUBSCRIBE) replaying data.csv from its own
+random position at the log rate, looping with increasing timestamps. Every
+returned pose carries the send time of the newest sample it includes, so
+end-to-end latency is measured on the generator's clock only (the server
+may run on another machine).
+
+The fleet is ramped through the given vehicle counts; vehicles keep their
+IDs and log positions from step to step. A step passes when every
+vehicle's p99 latency stays within the deadline (the IMU period by
+default) and the generator kept up with the log rate; the largest passing
+step is reported as the capacity.
+
+Usage:
+    python ingest_server.py --port 5600 --report 5
+    python fleet_loadgen.py --port 5600 --vehicles 25 50 100 200 400 --step 20 --output fleet.json
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from ingest_server import (HEADER, PAYLOADS, MSG_HELLO, MSG_SUBSCRIBE, MSG_POSE, FORMAT_BINARY, DIRECTIONS,
+                           encode_frame)
+from replay import load_sensor_log
+from sensor_client import log_messages
+
+
+class VehicleStream:
+    """Endless per-vehicle replay of the log, starting at a random message."""
+
+    def __init__(self, vehicle_id, direction, messages, start):
+        self.id = vehicle_id
+        self.direction = direction
+        self.messages = messages
+        self.cursor = start
+        self.lap = 0
+        self.span = messages[-1][0] - messages[0][0] + 1.0  # Log length plus a gap between laps
+
+    def next(self):
+        timestamp, message_type, values = self.messages[self.cursor]
+        shift = self.lap * self.span
+        self.cursor += 1
+        if self.cursor == len(self.messages):
+            self.cursor = 0
+            self.lap += 1
+        return timestamp + shift, message_type, (values[0] + shift,) + values[1:]
+
+
+def positive_float(text):
+    """argparse type for values that must be > 0."""
+    value = float(text)
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {text}")
+    return value
+
+
+async def run_vehicle(stream, host, port, speed, duration, warmup, result):
+    """Drive one vehicle for a step; fills result with latencies and counters."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_frame(MSG_HELLO, stream.id, DIRECTIONS.index(stream.direction)) +
+                 encode_frame(MSG_SUBSCRIBE, 1, FORMAT_BINARY))
+    pose = PAYLOADS[MSG_POSE]
+    start = time.monotonic()
+    record_from = int((start + warmup) * 1e9)
+
+    async def receive():
+        try:
+            while True:
+                _, message_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                values = pose.unpack(await reader.readexactly(length))
+                now = time.monotonic_ns()
+                result['poses'] += 1
+                if message_type == MSG_POSE and values[0] >= record_from:
+                    result['latencies'].append((now - values[0]) * 1e-9)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+
+    receiver = asyncio.create_task(receive())
+    log_start = None
+    try:
+        while True:
+            timestamp, message_type, values = stream.next()
+            if log_start is None:
+                log_start = timestamp
+            due = start + (timestamp - log_start) / speed
+            if due - start >= duration:
+                break
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif due >= start + warmup:
+                result['send_lag'].append(-delay)
+            writer.write(encode_frame(message_type, time.monotonic_ns(), *values))
+            await writer.drain()
+            result['sent'] += 1
+        await asyncio.sleep(0.2)  # Poses still in flight
+    finally:
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+        writer.close()
+
+
+async def run_step(streams, host, port, speed, duration, warmup):
+    results = [{'sent': 0, 'poses': 0, 'latencies': [], 'send_lag': []} for _ in streams]
+    start = time.monotonic()
+    await asyncio.gather(*(run_vehicle(stream, host, port, speed, duration, warmup, result)
+                           for stream, result in zip(streams, results)))
+    return results, time.monotonic() - start
+
+
+def step_summary(vehicles, results, elapsed, target_rate, deadline):
+    latencies = [np.asarray(r['latencies']) * 1e3 for r in results]
+    vehicle_p99 = np.array([np.percentile(l, 99) if len(l) else np.inf for l in latencies])
+    everything = np.concatenate([l for l in latencies if len(l)]) if any(len(l) for l in latencies) else np.zeros(1)
+    lag = np.concatenate([np.asarray(r['send_lag']) for r in results]) * 1e3
+    sent = sum(r['sent'] for r in results)
+    achieved = sent / elapsed
+    summary = {
+        'vehicles': vehicles,
+        'target_msg_per_s': target_rate * vehicles,
+        'sent_msg_per_s': achieved,
+        'poses_received': sum(r['poses'] for r in results),
+        'latency_ms': {
+            'p50': float(np.percentile(everything, 50)),
+            'p99': float(np.percentile(everything, 99)),
+            'max': float(everything.max()),
+        },
+        'vehicle_p99_ms': {
+            'median': float(np.median(vehicle_p99)),
+            'worst': float(vehicle_p99.max()),
+            'worst_vehicle': int(np.argmax(vehicle_p99)),
+        },
+        'vehicles_within_deadline': int((vehicle_p99 <= deadline * 1e3).sum()),
+        'send_lag_p99_ms': float(np.percentile(lag, 99)) if len(lag) else 0.0,
+        'per_vehicle_p99_ms': [float(v) for v in vehicle_p99],
+    }
+    # Kept up: each vehicle's p99 within the deadline and the generator itself on schedule
+    summary['passed'] = bool(summary['vehicles_within_deadline'] == vehicles and
+                             summary['send_lag_p99_ms'] <= deadline * 1e3)
+    return summary
+
+
+async def main(args):
+    imu, gps = load_sensor_log(args.log)
+    messages = log_messages(imu, gps)
+    imu_rate = 1.0 / np.median(np.diff(imu['timestamp']))
+    deadline = args.deadline_ms * 1e-3 if args.deadline_ms else 1.0 / (imu_rate * args.speed)
+    target_rate = len(messages) / (messages[-1][0] - messages[0][0]) * args.speed
+
+    rng = np.random.default_rng(args.seed)
+    streams = []
+    print(f"Per vehicle: {target_rate:.0f} msg/s, deadline {deadline * 1e3:.1f} ms; "
+          f"{args.step:.0f} s per step ({args.warmup:.0f} s warm-up)")
+    print(f"{'vehicles':>8s} {'msg/s':>9s} {'target':>9s} {'p50 ms':>8s} {'p99 ms':>8s} "
+          f"{'veh p99':>8s} {'worst':>8s} {'ok':>5s} {'lag p99':>8s}")
+
+    steps = []
+    capacity = 0
+    for vehicles in args.vehicles:
+        while len(streams) < vehicles:
+            k = len(streams)
+            streams.append(VehicleStream(args.first_id + k, args.directions[k % len(args.directions)],
+                                         messages, int(rng.integers(len(messages)))))
+        results, elapsed = await run_step(streams[:vehicles], args.host, args.port, args.speed,
+                                          args.step, args.warmup)
+        summary = step_summary(vehicles, results, elapsed, target_rate, deadline)
+        steps.append(summary)
+        print(f"{vehicles:8d} {summary['sent_msg_per_s']:9.0f} {summary['target_msg_per_s']:9.0f} "
+              f"{summary['latency_ms']['p50']:8.2f} {summary['latency_ms']['p99']:8.2f} "
+              f"{summary['vehicle_p99_ms']['median']:8.2f} {summary['vehicle_p99_ms']['worst']:8.2f} "
+              f"{summary['vehicles_within_deadline']:5d} {summary['send_lag_p99_ms']:8.2f}", flush=True)
+        if summary['passed']:
+            capacity = vehicles
+        elif args.stop_on_fail:
+            break
+
+    print(f"\nCapacity: {capacity} vehicles within {deadline * 1e3:.1f} ms p99"
+          if capacity else "\nNo step kept every vehicle within the deadline")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'deadline_ms': deadline * 1e3, 'capacity': capacity, 'configuration': vars(args),
+                       'steps': steps}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate N vehicles against ingest_server.py')
+    parser.add_argument('--log', default='data/data.csv', help='Sensor log replayed by every vehicle')
+    parser.add_argument('--host', default='127.0.0.1', help='Ingest server address')
+    parser.add_argument('--port', type=int, default=5600, help='Ingest server port')
+    parser.add_argument('--vehicles', type=int, nargs='+', default=[10, 25, 50, 100, 200],
+                        help='Vehicle counts to ramp through')
+    parser.add_argument('--directions', nargs='+', choices=['up', 'down'], default=['up', 'down'],
+                        help='Directions (상행/하행) assigned to vehicles in turn')
+    parser.add_argument('--step', type=float, default=20.0, help='Seconds per step')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Seconds per step excluded from statistics')
+    parser.add_argument('--speed', type=positive_float, default=1.0,
+                        help='Log rate multiplier per vehicle (> 0; the load is always paced)')
+    parser.add_argument('--deadline-ms', type=float, default=None,
+                        help='Per-vehicle p99 latency limit (default: IMU period)')
+    parser.add_argument('--first-id', type=int, default=1, help='Vehicle ID of the first simulated vehicle')
+    parser.add_argument('--stop-on-fail', action='store_true', help='Stop at the first failing step')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for log start positions')
+    parser.add_argument('--output', default=None, help='Write the JSON report here')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,457 @@
+"""Live sensor ingest service (asyncio, TCP and UDP).
+
+Sensors send IMU and GPS messages in a compact binary framing; a
+persistent filter per vehicle fuses them in arrival order and every fused
+pose is published to that vehicle's subscribers (e.g. a bridge to the web
+UI). Vehicles are keyed by the ID in their HELLO frame and filters on the
+same direction share one railway map (fleet mode); clients that send no
+HELLO are vehicle 0.
+
+Framing (little-endian): a 4-byte header <sync 0xA5, type, payload length>
+followed by the payload. UDP datagrams carry one or more whole frames.
+
+    type 1  IMU        <q d 6f>        send_ns, timestamp, acc xyz (m/s^2), gyro xyz (rad/s)
+    type 2  GPS        <q d 3d i f>    send_ns, timestamp, lat, lon, alt, satellites, variance (m^2)
+    type 3  SUBSCRIBE  <H B>           every n-th pose, format (0 binary, 1 JSON lines)
+    type 4  HELLO      <I B>           vehicle ID, direction (0 up, 1 down, 255 server default);
+                                       first frame of a TCP connection or of a UDP datagram
+    type 5  SEQ        <I>             UDP datagram sequence number per sender (optional, wraps at 2^32)
+    type 16 POSE       <q q d 3d 6f>   source send_ns, publish_ns, timestamp, lat, lon, alt,
+                                       velocity ENU (m/s), roll/pitch/yaw (rad)
+
+send_ns is time.monotonic_ns() of the sender, so end-to-end latency is
+measured on one host (the clock is system-wide on Linux and Windows).
+
+Backpressure: TCP readers await room in the vehicle's bounded input
+queue, so a fast sender is throttled by TCP flow control; UDP messages
+that find the queue full are dropped and counted. UDP datagrams can also
+be dropped by the kernel when the socket receive buffer overflows; the
+server never sees those, so it raises SO_RCVBUF (--udp-rcvbuf) and counts
+them from gaps in the senders' SEQ numbers. Senders without SEQ frames
+lose such datagrams silently, and losses after a sender's last received
+datagram are not visible either. Each subscriber has a small pose queue that
+keeps the newest poses (the oldest is dropped when a client reads slowly).
+Counters and latency histograms (fleet-wide and per vehicle) are served at
+http://host:metrics-port/metrics.
+
+Usage:
+    python ingest_server.py --direction up --port 5600 --metrics-port 9100
+    python sensor_client.py --port 5600 --speed 1 --subscribe
+    python fleet_loadgen.py --port 5600 --vehicles 50 100 200 --step 20
+"""
+import argparse
+import asyncio
+import json
+import socket
+import struct
+import time
+
+import numpy as np
+
+import eskf_ext
+from eskf_ext import Eskf, IMU_DTYPE, GPS_DTYPE
+from metrics import Registry, CONTENT_TYPE
+from replay import load_rail_file
+
+SYNC = 0xA5
+HEADER = struct.Struct('<BBH')
+MSG_IMU = 1
+MSG_GPS = 2
+MSG_SUBSCRIBE = 3
+MSG_HELLO = 4
+MSG_SEQ = 5
+MSG_POSE = 16
+PAYLOADS = {
+    MSG_IMU: struct.Struct('<qd6f'),
+    MSG_GPS: struct.Struct('<qddddif'),
+    MSG_SUBSCRIBE: struct.Struct('<HB'),
+    MSG_HELLO: struct.Struct('<IB'),
+    MSG_SEQ: struct.Struct('<I'),
+    MSG_POSE: struct.Struct('<qqdddd6f'),
+}
+FORMAT_BINARY = 0
+FORMAT_JSON = 1
+SEQ_MODULUS = 1 << 32
+UDP_RCVBUF = 4 << 20  # Requested UDP socket receive buffer (bytes)
+DIRECTIONS = ('up', 'down')  # HELLO direction codes; other values: server default
+
+# Ingest latency buckets (s): 50 us .. 1 s
+INGEST_BUCKETS = (5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+
+def encode_frame(message_type, *values):
+    payload = PAYLOADS[message_type].pack(*values)
+    return HEADER.pack(SYNC, message_type, len(payload)) + payload
+
+
+def decode_frames(data):
+    """(type, values) for every whole frame in a buffer; stops at the first bad frame."""
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        sync, message_type, length = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        payload = PAYLOADS.get(message_type)
+        if sync != SYNC or payload is None or payload.size != length or offset + length > len(data):
+            raise ValueError(f"Bad frame (sync {sync:#x}, type {message_type}, length {length})")
+        yield message_type, payload.unpack_from(data, offset)
+        offset += length
+
+
+class Subscriber:
+    """Pose queue of one client that keeps the newest poses."""
+
+    def __init__(self, writer, every, output_format, queue_size, service):
+        self.writer = writer
+        self.every = max(int(every), 1)
+        self.format = output_format
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.service = service
+        self.count = 0
+
+    def offer(self, pose):
+        self.count += 1
+        if self.count % self.every:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.service.pose_drops.inc()
+        self.queue.put_nowait(pose)
+
+    async def run(self):
+        while True:
+            pose = await self.queue.get()
+            if self.format == FORMAT_JSON:
+                keys = ('source_ns', 'publish_ns', 'timestamp', 'lat', 'lon', 'alt',
+                        've', 'vn', 'vu', 'roll', 'pitch', 'yaw')
+                self.writer.write((json.dumps(dict(zip(keys, pose))) + '\n').encode())
+            else:
+                self.writer.write(encode_frame(MSG_POSE, *pose))
+            await self.writer.drain()
+            self.service.poses_sent.inc()
+
+
+class Vehicle:
+    """Filter, input queue and pose subscribers of one vehicle."""
+
+    def __init__(self, vehicle_id, direction, eskf, queue_size):
+        self.id = vehicle_id
+        self.direction = direction
+        self.eskf = eskf
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.subscribers = set()
+        self.messages = 0
+        self.window = []  # Ingest latencies (s) since the last console report
+        self.task = None
+
+
+def fuse_batch(eskf, batch):
+    """Fuse messages in arrival order; IMU runs go to C as one array."""
+    imu = np.zeros(len(batch), dtype=IMU_DTYPE)
+    imu_count = 0
+    gps = np.zeros(1, dtype=GPS_DTYPE)
+    for message_type, values in batch:
+        if message_type == MSG_IMU:
+            imu[imu_count] = (values[1], values[2:5], values[5:8])
+            imu_count += 1
+        else:
+            if imu_count:
+                eskf.process_imu_array(imu[:imu_count])
+                imu_count = 0
+            _, timestamp, lat, lon, alt, satellites, variance = values
+            gps[0] = (timestamp, lat, lon, alt, np.eye(3) * variance, satellites)
+            eskf.process_gps_array(gps)
+    if imu_count:
+        eskf.process_imu_array(imu[:imu_count])
+
+
+class IngestService(asyncio.DatagramProtocol):
+    """Per-vehicle bounded input queue -> filter task -> subscriber queues.
+
+    make_filter(direction) returns a configured Eskf for a new vehicle.
+    Messages before any HELLO belong to vehicle 0 on the default direction,
+    so single-sensor clients need no handshake.
+    """
+
+    def __init__(self, make_filter, default_direction='up', queue_size=4096, max_batch=256,
+                 subscriber_queue=64, max_vehicles=1000):
+        self.make_filter = make_filter
+        self.default_direction = default_direction
+        self.queue_size = queue_size
+        self.max_batch = max_batch
+        self.subscriber_queue = subscriber_queue
+        self.max_vehicles = max_vehicles
+        self.vehicles = {}
+        self.udp_next_seq = {}  # Sender address -> next expected SEQ
+
+        self.registry = Registry()
+        self.messages = self.registry.counter('eskf_ingest_messages_total', 'Sensor messages received',
+                                              ['type', 'transport'])
+        self.drops = self.registry.counter('eskf_ingest_dropped_total', 'Messages dropped', ['reason'])
+        self.udp_lost = self.registry.counter('eskf_ingest_udp_datagrams_lost_total',
+                                              'UDP datagrams missing from sender SEQ numbers')
+        self.udp_reordered = self.registry.counter('eskf_ingest_udp_datagrams_reordered_total',
+                                                   'UDP datagrams that arrived after a newer one')
+        self.latency = self.registry.histogram('eskf_ingest_latency_seconds',
+                                               'Sensor send to filter update', ['type'], INGEST_BUCKETS)
+        self.vehicle_latency = self.registry.histogram('eskf_vehicle_ingest_latency_seconds',
+                                                       'Sensor send to filter update per vehicle',
+                                                       ['vehicle'], INGEST_BUCKETS)
+        self.batch_size = self.registry.histogram('eskf_ingest_batch_messages', 'Messages per filter batch',
+                                                  buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+        self.poses = self.registry.counter('eskf_poses_published_total', 'Fused poses published')
+        self.poses_sent = self.registry.counter('eskf_poses_sent_total', 'Poses written to subscribers')
+        self.pose_drops = self.registry.counter('eskf_pose_dropped_total', 'Poses dropped for slow subscribers')
+        queue_depth = self.registry.gauge('eskf_ingest_queue_depth', 'Messages waiting for the filters')
+        subscriber_count = self.registry.gauge('eskf_subscribers', 'Connected pose subscribers')
+        vehicle_count = self.registry.gauge('eskf_vehicles', 'Vehicles with a filter instance', ['direction'])
+
+        def collect():
+            queue_depth.set(sum(v.queue.qsize() for v in self.vehicles.values()))
+            subscriber_count.set(sum(len(v.subscribers) for v in self.vehicles.values()))
+            for direction in DIRECTIONS:
+                vehicle_count.set(sum(v.direction == direction for v in self.vehicles.values()),
+                                  direction=direction)
+        self.registry.add_collector(collect)
+
+    def vehicle(self, vehicle_id=0, direction=None):
+        """The vehicle's state, created on first use (None when the fleet is full)."""
+        vehicle = self.vehicles.get(vehicle_id)
+        if vehicle is None:
+            if len(self.vehicles) >= self.max_vehicles:
+                return None
+            direction = direction or self.default_direction
+            vehicle = Vehicle(vehicle_id, direction, self.make_filter(direction), self.queue_size)
+            vehicle.task = asyncio.get_running_loop().create_task(self.filter_loop(vehicle))
+            self.vehicles[vehicle_id] = vehicle
+        return vehicle
+
+    def hello(self, values):
+        vehicle_id, direction = values
+        return self.vehicle(vehicle_id, DIRECTIONS[direction] if direction < len(DIRECTIONS) else None)
+
+    # UDP: a datagram may start with HELLO to address its frames to a vehicle
+    def datagram_received(self, data, addr):
+        vehicle = None
+        try:
+            for message_type, values in decode_frames(data):
+                if message_type == MSG_HELLO:
+                    vehicle = self.hello(values)
+                    if vehicle is None:
+                        self.drops.inc(reason='fleet_full')
+                        return
+                elif message_type == MSG_SEQ:
+                    self.track_sequence(addr, values[0])
+                elif message_type in (MSG_IMU, MSG_GPS):
+                    self.enqueue_nowait(vehicle or self.vehicle(), message_type, values, 'udp')
+                else:
+                    self.drops.inc(reason='unexpected_type')
+        except ValueError:
+            self.drops.inc(reason='bad_frame')
+
+    def track_sequence(self, addr, sequence):
+        """Count datagrams lost before reaching the server from gaps in a sender's SEQ numbers."""
+        expected = self.udp_next_seq.get(addr)
+        gap = 0 if expected is None else (sequence - expected) % SEQ_MODULUS
+        if gap >= SEQ_MODULUS // 2:
+            # Older than the newest seen: it was counted as lost when the gap opened
+            self.udp_reordered.inc()
+            return
+        if gap:
+            self.udp_lost.inc(gap)
+        self.udp_next_seq[addr] = (sequence + 1) % SEQ_MODULUS
+
+    def enqueue_nowait(self, vehicle, message_type, values, transport):
+        if vehicle is None:
+            self.drops.inc(reason='fleet_full')
+            return
+        self.messages.inc(type='imu' if message_type == MSG_IMU else 'gps', transport=transport)
+        try:
+            vehicle.queue.put_nowait((message_type, values))
+            vehicle.messages += 1
+        except asyncio.QueueFull:
+            self.drops.inc(reason='queue_full')
+
+    # TCP: one connection serves one vehicle (HELLO first, or vehicle 0)
+    async def handle_tcp(self, reader, writer):
+        vehicle = None
+        subscriber = None
+        subscriber_task = None
+        try:
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                sync, message_type, length = HEADER.unpack(header)
+                payload = PAYLOADS.get(message_type)
+                if sync != SYNC or payload is None or payload.size != length:
+                    self.drops.inc(reason='bad_frame')
+                    break  # The stream cannot be resynchronized safely
+                values = payload.unpack(await reader.readexactly(length))
+                if message_type == MSG_HELLO and vehicle is None:
+                    vehicle = self.hello(values)
+                    if vehicle is None:
+                        self.drops.inc(reason='fleet_full')
+                        break
+                    continue
+                vehicle = vehicle or self.vehicle()
+                if vehicle is None:
+                    self.drops.inc(reason='fleet_full')
+                    break
+                if message_type in (MSG_IMU, MSG_GPS):
+                    self.messages.inc(type='imu' if message_type == MSG_IMU else 'gps', transport='tcp')
+                    await vehicle.queue.put((message_type, values))  # Blocks the sender when full
+                    vehicle.messages += 1
+                elif message_type == MSG_SUBSCRIBE and subscriber is None:
+                    subscriber = Subscriber(writer, values[0], values[1], self.subscriber_queue, self)
+                    vehicle.subscribers.add(subscriber)
+                    subscriber_task = asyncio.create_task(subscriber.run())
+                else:
+                    self.drops.inc(reason='unexpected_type')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if subscriber is not None:
+                vehicle.subscribers.discard(subscriber)
+                subscriber_task.cancel()
+            writer.close()
+
+    # Filter
+    async def filter_loop(self, vehicle):
+        label = str(vehicle.id)
+        while True:
+            batch = [await vehicle.queue.get()]
+            while len(batch) < self.max_batch and not vehicle.queue.empty():
+                batch.append(vehicle.queue.get_nowait())
+            fuse_batch(vehicle.eskf, batch)
+
+            done_ns = time.monotonic_ns()
+            for message_type, values in batch:
+                latency = (done_ns - values[0]) * 1e-9
+                self.latency.observe(latency, type='imu' if message_type == MSG_IMU else 'gps')
+                self.vehicle_latency.observe(latency, vehicle=label)
+                vehicle.window.append(latency)
+            self.batch_size.observe(len(batch))
+
+            state = vehicle.eskf.get_state_array()
+            pose = (batch[-1][1][0], time.monotonic_ns(), float(state['timestamp']),
+                    float(state['lat']), float(state['lon']), float(state['alt']),
+                    *(float(v) for v in state['G_v_I']),
+                    float(state['roll']), float(state['pitch']), float(state['yaw']))
+            self.poses.inc()
+            for subscriber in vehicle.subscribers:
+                subscriber.offer(pose)
+            await asyncio.sleep(0)  # Let readers and other vehicles run between batches
+
+    def vehicle_latencies(self):
+        """Per-vehicle ingest latency percentiles (ms) since the last call."""
+        summary = {}
+        for vehicle in self.vehicles.values():
+            window, vehicle.window = vehicle.window, []
+            if window:
+                ms = np.asarray(window) * 1e3
+                summary[vehicle.id] = {'messages': len(ms), 'p50_ms': float(np.percentile(ms, 50)),
+                                       'p99_ms': float(np.percentile(ms, 99)), 'max_ms': float(ms.max())}
+        return summary
+
+    async def report_loop(self, interval):
+        last = 0.0
+        while True:
+            await asyncio.sleep(interval)
+            total = sum(self.messages.value(type=t, transport=tr) for t in ('imu', 'gps') for tr in ('tcp', 'udp'))
+            depth = sum(v.queue.qsize() for v in self.vehicles.values())
+            subscribers = sum(len(v.subscribers) for v in self.vehicles.values())
+            line = f"[ingest] {(total - last) / interval:8.0f} msg/s, vehicles {len(self.vehicles)}, " \
+                   f"queued {depth:5d}, subscribers {subscribers}"
+            latencies = self.vehicle_latencies()
+            if latencies:
+                p99 = np.array([v['p99_ms'] for v in latencies.values()])
+                worst = max(latencies, key=lambda k: latencies[k]['p99_ms'])
+                line += f", vehicle p99 median {np.median(p99):.2f} ms, worst {p99.max():.2f} ms (#{worst})"
+            print(line, flush=True)
+            last = total
+
+    async def handle_metrics(self, reader, writer):
+        """Minimal HTTP responder for GET /metrics."""
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if request_line.split()[1:2] == [b'/metrics']:
+                body = self.registry.render().encode()
+                status = b'200 OK'
+            else:
+                body, status = b'Not found\n', b'404 Not Found'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: ' + CONTENT_TYPE.encode() +
+                         b'\r\nContent-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(service, host, port, metrics_port=None, report_interval=5.0, udp_rcvbuf=UDP_RCVBUF):
+    loop = asyncio.get_running_loop()
+    tcp = await asyncio.start_server(service.handle_tcp, host, port)
+    udp, _ = await loop.create_datagram_endpoint(lambda: service, local_addr=(host, port))
+    if udp_rcvbuf:
+        # Bursts beyond the buffer are dropped by the kernel; the OS may cap the size (net.core.rmem_max)
+        sock = udp.get_extra_info('socket')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, udp_rcvbuf)
+        granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        print(f"UDP receive buffer: requested {udp_rcvbuf} bytes, got {granted}", flush=True)
+    tasks = []
+    if report_interval > 0:
+        tasks.append(asyncio.create_task(service.report_loop(report_interval)))
+    servers = [tcp]
+    if metrics_port:
+        servers.append(await asyncio.start_server(service.handle_metrics, host, metrics_port))
+    print(f"Listening on {host}:{port} (TCP and UDP)"
+          + (f", metrics on http://{host}:{metrics_port}/metrics" if metrics_port else ''), flush=True)
+    try:
+        await asyncio.gather(*(s.serve_forever() for s in servers), *tasks)
+    finally:
+        udp.close()
+
+
+def shared_filter_factory(rail=True, max_rail_nodes=None):
+    """make_filter(direction) whose filters share one railway map per direction."""
+    rail_maps = {}
+
+    def make_filter(direction):
+        if not rail:
+            return Eskf()
+        if direction not in rail_maps:
+            rail_maps[direction] = eskf_ext.rail_node_array(*load_rail_file(direction))
+        nodes = rail_maps[direction]
+        eskf = Eskf(max_rail_nodes=max(len(nodes), max_rail_nodes or 0) or None, copy_rail_nodes=False)
+        eskf.share_rail_nodes(nodes)
+        return eskf
+    return make_filter
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Live IMU/GPS ingest service')
+    parser.add_argument('--direction', choices=['up', 'down'], default='up',
+                        help='Railway direction (상행/하행) for clients that send no HELLO')
+    parser.add_argument('--host', default='127.0.0.1', help='Listen address')
+    parser.add_argument('--port', type=int, default=5600, help='TCP and UDP sensor/subscriber port')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve /metrics on this port')
+    parser.add_argument('--queue', type=int, default=4096, help='Input queue size per vehicle (messages)')
+    parser.add_argument('--max-batch', type=int, default=256, help='Messages fused per filter batch')
+    parser.add_argument('--subscriber-queue', type=int, default=64, help='Poses buffered per subscriber')
+    parser.add_argument('--max-vehicles', type=int, default=1000, help='Filter instances hosted at most')
+    parser.add_argument('--udp-rcvbuf', type=int, default=UDP_RCVBUF,
+                        help='UDP socket receive buffer to request (bytes, 0: OS default)')
+    parser.add_argument('--report', type=float, default=5.0, help='Console report interval (s, 0: off)')
+    parser.add_argument('--no-rail', action='store_true', help='Run without the railway map')
+    args = parser.parse_args()
+
+    if eskf_ext.lib is None:
+        print("ESKF extension module not found. Build it first: python eskf_cffi_build.py")
+        exit(1)
+
+    service = IngestService(shared_filter_factory(not args.no_rail), args.direction, args.queue,
+                            args.max_batch, args.subscriber_queue, args.max_vehicles)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.metrics_port, args.report, args.udp_rcvbuf))
+    except KeyboardInterrupt:
+        pass
@@ -296,4 +296,184 @@ void mat3_skew(mat3_t* result, const vec3_t* v) {
     result->data[2][0] = -v->data[1];
     result->data[2][1] = v->data[0];
     result->data[2][2] = 0;
-}
\ No newline at end of file
+}
+// Quaternion operations
+void quat_identity(quat_t* q) {
+    q->data[0] = 1.0f;
+    q->data[1] = 0.0f;
+    q->data[2] = 0.0f;
+    q->data[3] = 0.0f;
+}
+
+void quat_multiply(quat_t* result, const quat_t* a, const quat_t* b) {
+    float aw = a->data[0], ax = a->data[1], ay = a->data[2], az = a->data[3];
+    float bw = b->data[0], bx = b->data[1], by = b->data[2], bz = b->data[3];
+
+    result->data[0] = aw*bw - ax*bx - ay*by - az*bz;
+    result->data[1] = aw*bx + ax*bw + ay*bz - az*by;
+    result->data[2] = aw*by - ax*bz + ay*bw + az*bx;
+    result->data[3] = aw*bz + ax*by - ay*bx + az*bw;
+}
+
+void quat_normalize(quat_t* result, const quat_t* q) {
+    float n2 = q->data[0] * q->data[0] + q->data[1] * q->data[1] +
+               q->data[2] * q->data[2] + q->data[3] * q->data[3];
+
+    if (n2 < 1e-24f) {
+        quat_identity(result);
+        return;
+    }
+
+    // Close to unit length: one Newton step for 1/sqrt avoids the sqrt/divide
+    float scale;
+    if (fabsf(n2 - 1.0f) < 1e-3f) {
+        scale = 1.5f - 0.5f * n2;
+    } else {
+        scale = 1.0f / sqrtf(n2);
+    }
+
+    for (int i = 0; i < 4; i++) {
+        result->data[i] = q->data[i] * scale;
+    }
+}
+
+void quat_from_axis_angle(quat_t* result, const vec3_t* axis_angle) {
+    float angle2 = vec3_dot(axis_angle, axis_angle);
+    float w, s;
+
+    if (angle2 < 1e-6f) {
+        // Small angle: Taylor expansion of cos(a/2) and sin(a/2)/a
+        w = 1.0f - angle2 / 8.0f;
+        s = 0.5f - angle2 / 48.0f;
+    } else {
+        float angle = sqrtf(angle2);
+        w = cosf(0.5f * angle);
+        s = sinf(0.5f * angle) / angle;
+    }
+
+    result->data[0] = w;
+    result->data[1] = axis_angle->data[0] * s;
+    result->data[2] = axis_angle->data[1] * s;
+    result->data[3] = axis_angle->data[2] * s;
+}
+
+void quat_rotate_vec3(vec3_t* result, const quat_t* q, const vec3_t* v) {
+    // v' = v + w*t + u x t, with t = 2 * (u x v)
+    vec3_t u = {{q->data[1], q->data[2], q->data[3]}};
+    vec3_t t, ut;
+
+    vec3_cross(&t, &u, v);
+    vec3_scale(&t, &t, 2.0f);
+    vec3_cross(&ut, &u, &t);
+
+    for (int i = 0; i < 3; i++) {
+        result->data[i] = v->data[i] + q->data[0] * t.data[i] + ut.data[i];
+    }
+}
+
+void quat_rotate_vec3_inverse(vec3_t* result, const quat_t* q, const vec3_t* v) {
+    quat_t conj = {{q->data[0], -q->data[1], -q->data[2], -q->data[3]}};
+    quat_rotate_vec3(result, &conj, v);
+}
+
+void quat_to_mat3(mat3_t* m, const quat_t* q) {
+    float w = q->data[0], x = q->data[1], y = q->data[2], z = q->data[3];
+
+    m->data[0][0] = 1.0f - 2.0f * (y*y + z*z);
+    m->data[0][1] = 2.0f * (x*y - w*z);
+    m->data[0][2] = 2.0f * (x*z + w*y);
+
+    m->data[1][0] = 2.0f * (x*y + w*z);
+    m->data[1][1] = 1.0f - 2.0f * (x*x + z*z);
+    m->data[1][2] = 2.0f * (y*z - w*x);
+
+    m->data[2][0] = 2.0f * (x*z - w*y);
+    m->data[2][1] = 2.0f * (y*z + w*x);
+    m->data[2][2] = 1.0f - 2.0f * (x*x + y*y);
+}
+
+void quat_from_mat3(quat_t* q, const mat3_t* m) {
+    float trace = m->data[0][0] + m->data[1][1] + m->data[2][2];
+
+    if (trace > 0.0f) {
+        float s = sqrtf(trace + 1.0f) * 2.0f;
+        q->data[0] = 0.25f * s;
+        q->data[1] = (m->data[2][1] - m->data[1][2]) / s;
+        q->data[2] = (m->data[0][2] - m->data[2][0]) / s;
+        q->data[3] = (m->data[1][0] - m->data[0][1]) / s;
+    } else if (m->data[0][0] > m->data[1][1] && m->data[0][0] > m->data[2][2]) {
+        float s = sqrtf(1.0f + m->data[0][0] - m->data[1][1] - m->data[2][2]) * 2.0f;
+        q->data[0] = (m->data[2][1] - m->data[1][2]) / s;
+        q->data[1] = 0.25f * s;
+        q->data[2] = (m->data[0][1] + m->data[1][0]) / s;
+        q->data[3] = (m->data[0][2] + m->data[2][0]) / s;
+    } else if (m->data[1][1] > m->data[2][2]) {
+        float s = sqrtf(1.0f + m->data[1][1] - m->data[0][0] - m->data[2][2]) * 2.0f;
+        q->data[0] = (m->data[0][2] - m->data[2][0]) / s;
+        q->data[1] = (m->data[0][1] + m->data[1][0]) / s;
+        q->data[2] = 0.25f * s;
+        q->data[3] = (m->data[1][2] + m->data[2][1]) / s;
+    } else {
+        float s = sqrtf(1.0f + m->data[2][2] - m->data[0][0] - m->data[1][1]) * 2.0f;
+        q->data[0] = (m->data[1][0] - m->data[0][1]) / s;
+        q->data[1] = (m->data[0][2] + m->data[2][0]) / s;
+        q->data[2] = (m->data[1][2] + m->data[2][1]) / s;
+        q->data[3] = 0.25f * s;
+    }
+
+    quat_normalize(q, q);
+}
+
+void quat_to_euler(const quat_t* q, float* roll, float* pitch, float* yaw) {
+    // Same convention as mat3_to_euler, using only the required matrix entries
+    float w = q->data[0], x = q->data[1], y = q->data[2], z = q->data[3];
+
+    float r20 = 2.0f * (x*z - w*y);
+    float r21 = 2.0f * (y*z + w*x);
+    float r22 = 1.0f - 2.0f * (x*x + y*y);
+    float r10 = 2.0f * (x*y + w*z);
+    float r00 = 1.0f - 2.0f * (y*y + z*z);
+
+    *pitch = asinf(fmaxf(-1.0f, fminf(1.0f, -r20)));
+
+    if (cosf(*pitch) > 1e-6f) {
+        *roll = atan2f(r21, r22);
+        *yaw = atan2f(r10, r00);
+    } else {
+        float r01 = 2.0f * (x*y - w*z);
+        float r11 = 1.0f - 2.0f * (x*x + z*z);
+        *roll = 0;
+        *yaw = atan2f(-r01, r11);
+    }
+}
+
+void quat_slerp(quat_t* result, const quat_t* a, const quat_t* b, float u) {
+    float dot = a->data[0] * b->data[0] + a->data[1] * b->data[1] +
+                a->data[2] * b->data[2] + a->data[3] * b->data[3];
+
+    // q and -q are the same rotation: interpolate along the shorter arc
+    float sign = 1.0f;
+    if (dot < 0.0f) {
+        dot = -dot;
+        sign = -1.0f;
+    }
+
+    float wa, wb;
+    if (dot > 0.9995f) {
+        // Nearly parallel: linear interpolation, normalized below
+        wa = 1.0f - u;
+        wb = u;
+    } else {
+        float theta = acosf(dot);
+        float inv_sin = 1.0f / sinf(theta);
+        wa = sinf((1.0f - u) * theta) * inv_sin;
+        wb = sinf(u * theta) * inv_sin;
+    }
+    wb *= sign;
+
+    quat_t q;
+    for (int i = 0; i < 4; i++) {
+        q.data[i] = wa * a->data[i] + wb * b->data[i];
+    }
+    quat_normalize(result, &q);
+}
@@ -25,6 +25,11 @@ typedef struct {
     float data[15];
 } vec15_t;
 
+// Unit quaternion (Hamilton convention): data = {w, x, y, z}
+typedef struct {
+    float data[4];
+} quat_t;
+
 // 3x3 Matrix operations
 void mat3_identity(mat3_t* m);
 void mat3_zero(mat3_t* m);
@@ -64,4 +69,16 @@ void vec3_normalize(vec3_t* result, const vec3_t* v);
 // Skew symmetric matrix
 void mat3_skew(mat3_t* result, const vec3_t* v);
 
+// Quaternion operations
+void quat_identity(quat_t* q);
+void quat_multiply(quat_t* result, const quat_t* a, const quat_t* b);
+void quat_normalize(quat_t* result, const quat_t* q);
+void quat_from_axis_angle(quat_t* result, const vec3_t* axis_angle);
+void quat_rotate_vec3(vec3_t* result, const quat_t* q, const vec3_t* v);
+void quat_rotate_vec3_inverse(vec3_t* result, const quat_t* q, const vec3_t* v);
+void quat_to_mat3(mat3_t* m, const quat_t* q);
+void quat_from_mat3(quat_t* q, const mat3_t* m);
+void quat_to_euler(const quat_t* q, float* roll, float* pitch, float* yaw);
+void quat_slerp(quat_t* result, const quat_t* a, const quat_t* b, float u);  // u in [0, 1], shortest arc
+
 #endif // MATRIX_H
\ No newline at end of file
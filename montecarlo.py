@@ -0,0 +1,216 @@
+"""Monte Carlo filter error statistics on a simulated trajectory.
+
+One ground-truth trajectory (simulate.py) is shared by all runs; every run
+draws its own IMU noise and bias walks, GPS noise and satellite counts,
+and tunnel placement. Runs are processed in batches with
+eskf_process_many (one OpenMP thread per filter, GIL released), and each
+filter's position is split into along-track and cross-track error against
+the truth, overall and separately inside tunnels.
+
+Usage:
+    python montecarlo.py --direction up --runs 200 --tunnels 2 --output mc_summary.json
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import eskf_ext
+from eskf_ext import Eskf, IMU_DTYPE, GPS_DTYPE, ATTITUDE_MATRIX, ATTITUDE_QUATERNION, process_many
+from replay import load_rail_file
+from simulate import (EARTH_RADIUS, route_geometry, simulate_truth, synthesize_imu, synthesize_gps,
+                      random_tunnels, tunnel_mask)
+
+
+def realization(geometry, truth, imu_rate, rng, tunnel_count=2, gps_rate=1.0, **noise):
+    """One noisy IMU_DTYPE/GPS_DTYPE input pair and its tunnel mask."""
+    gps_keys = ('satellites', 'satellite_std', 'gps_noise')
+    gps_options = {k: v for k, v in noise.items() if k in gps_keys}
+    imu_options = {k: v for k, v in noise.items() if k not in gps_keys}
+
+    in_tunnel = tunnel_mask(truth, random_tunnels(geometry['length'], tunnel_count, rng))
+    acc, gyro = synthesize_imu(truth, imu_rate, rng, **imu_options)
+    rows, lat, lon, sats = synthesize_gps(truth, imu_rate, rng, in_tunnel, gps_rate, **gps_options)
+
+    imu = np.zeros(len(truth['timestamp']), dtype=IMU_DTYPE)
+    imu['timestamp'] = truth['timestamp']
+    imu['acc'] = acc
+    imu['gyro'] = gyro
+
+    gps = np.zeros(len(rows), dtype=GPS_DTYPE)
+    gps['timestamp'] = truth['timestamp'][rows]
+    gps['lat'] = lat
+    gps['lon'] = lon
+    gps['satellites'] = sats
+    gps['cov'] = np.eye(3) * 25.0
+    return imu, gps, in_tunnel
+
+
+def track_errors(states, truth, geometry, stride):
+    """Along-track and cross-track error (m) at the recorded states.
+
+    Entries before the filter initialized are NaN.
+    """
+    index = np.arange(len(states)) * stride
+    origin_lat, origin_lon = geometry['origin']
+    east = np.radians(states['lon'] - origin_lon) * EARTH_RADIUS * np.cos(np.radians(origin_lat))
+    north = np.radians(states['lat'] - origin_lat) * EARTH_RADIUS
+    de = east - truth['east'][index]
+    dn = north - truth['north'][index]
+
+    yaw = truth['yaw'][index]
+    along = de * np.cos(yaw) + dn * np.sin(yaw)
+    cross = -de * np.sin(yaw) + dn * np.cos(yaw)
+    initialized = states['lat'] != 0.0
+    along[~initialized] = np.nan
+    cross[~initialized] = np.nan
+    return along, cross
+
+
+def error_summary(along, cross):
+    """Bias, RMS and |error| percentiles of along/cross-track errors."""
+    summary = {'samples': int(np.isfinite(along).sum())}
+    for name, error in (('along_track', along), ('cross_track', cross)):
+        error = error[np.isfinite(error)]
+        if len(error) == 0:
+            continue
+        magnitude = np.abs(error)
+        summary[name] = {
+            'mean': float(error.mean()),
+            'rms': float(np.sqrt(np.mean(error ** 2))),
+            'p50': float(np.percentile(magnitude, 50)),
+            'p95': float(np.percentile(magnitude, 95)),
+            'p99': float(np.percentile(magnitude, 99)),
+            'max': float(magnitude.max()),
+        }
+    return summary
+
+
+def run_monte_carlo(geometry, truth, imu_rate, runs, make_filter, batch=None, stride=None, seed=0,
+                    num_threads=0, progress=True, **noise):
+    """Along/cross-track errors of every run: (runs, grid) arrays plus tunnel flags."""
+    stride = stride or int(imu_rate)  # 1 Hz error samples by default
+    batch = batch or max(os.cpu_count() or 1, 1) * 2
+    grid = -(-len(truth['timestamp']) // stride)
+    along = np.full((runs, grid), np.nan)
+    cross = np.full((runs, grid), np.nan)
+    in_tunnel = np.zeros((runs, grid), dtype=bool)
+
+    seeds = np.random.SeedSequence(seed).spawn(runs)
+    for first in range(0, runs, batch):
+        count = min(batch, runs - first)
+        filters, imu_arrays, gps_arrays = [], [], []
+        for k in range(count):
+            rng = np.random.default_rng(seeds[first + k])
+            imu, gps, tunnel = realization(geometry, truth, imu_rate, rng, **noise)
+            filters.append(make_filter())
+            imu_arrays.append(imu)
+            gps_arrays.append(gps)
+            in_tunnel[first + k] = tunnel[::stride]
+
+        _, states = process_many(filters, imu_arrays, gps_arrays, num_threads,
+                                 record_states=True, state_stride=stride)
+        for k, recorded in enumerate(states):
+            along[first + k], cross[first + k] = track_errors(recorded, truth, geometry, stride)
+            filters[k].close()
+        if progress:
+            print(f"  {first + count}/{runs} runs")
+    return along, cross, in_tunnel
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo ESKF error statistics')
+    parser.add_argument('--direction', choices=['up', 'down'], default='up',
+                        help='Railway direction: up (상행) or down (하행)')
+    parser.add_argument('--runs', type=int, default=200, help='Noise realizations')
+    parser.add_argument('--batch', type=int, default=None, help='Filters per eskf_process_many call')
+    parser.add_argument('--threads', type=int, default=0, help='OpenMP threads (0: all cores)')
+    parser.add_argument('--imu-rate', type=float, default=100.0, help='IMU rate (Hz)')
+    parser.add_argument('--laps', type=int, default=1, help='One-way trips per run')
+    parser.add_argument('--max-speed', type=float, default=80.0, help='Maximum speed (km/h)')
+    parser.add_argument('--stations', type=int, default=10, help='Intermediate station stops per trip')
+    parser.add_argument('--tunnels', type=int, default=2, help='Random tunnels per run')
+    parser.add_argument('--satellites', type=float, default=10.0, help='Mean satellite count')
+    parser.add_argument('--gps-noise', type=float, default=2.5, help='GPS sigma at 10 satellites (m)')
+    parser.add_argument('--attitude', choices=['matrix', 'quaternion'], default='matrix',
+                        help='Filter attitude representation')
+    parser.add_argument('--no-rail', action='store_true', help='Run without the railway map')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--output', default=None, help='Write the summary JSON here')
+    parser.add_argument('--envelope', default=None,
+                        help='Write per-time error percentiles across runs to this CSV')
+    args = parser.parse_args()
+
+    if eskf_ext.lib is None:
+        print("ESKF extension module not found. Build it first: python eskf_cffi_build.py")
+        exit(1)
+
+    rail_lat, rail_lon = load_rail_file(args.direction)
+    rail_nodes = eskf_ext.rail_node_array(rail_lat, rail_lon)
+    geometry = route_geometry(rail_lat, rail_lon)
+    truth = simulate_truth(geometry, args.imu_rate, args.laps, max_speed=args.max_speed / 3.6,
+                           stations=args.stations, start_time=1700000000.0)
+
+    def make_filter():
+        eskf = Eskf()
+        eskf.set_attitude_mode(ATTITUDE_QUATERNION if args.attitude == 'quaternion' else ATTITUDE_MATRIX)
+        if not args.no_rail:
+            eskf.share_rail_nodes(rail_nodes)
+        return eskf
+
+    duration = truth['timestamp'][-1] - truth['timestamp'][0]
+    print(f"Monte Carlo: {args.runs} runs x {len(truth['timestamp'])} IMU samples ({duration:.0f} s each)")
+    start = time.perf_counter()
+    along, cross, in_tunnel = run_monte_carlo(
+        geometry, truth, args.imu_rate, args.runs, make_filter, args.batch, seed=args.seed,
+        num_threads=args.threads, tunnel_count=args.tunnels,
+        satellites=args.satellites, gps_noise=args.gps_noise)
+    elapsed = time.perf_counter() - start
+
+    run_rms = np.sqrt(np.nanmean(along ** 2 + cross ** 2, axis=1))
+    summary = {
+        'runs': args.runs,
+        'imu_samples_per_run': len(truth['timestamp']),
+        'seconds': elapsed,
+        'configuration': vars(args),
+        'all': error_summary(along.ravel(), cross.ravel()),
+        'open_sky': error_summary(along[~in_tunnel], cross[~in_tunnel]),
+        'tunnel': error_summary(along[in_tunnel], cross[in_tunnel]),
+        'run_rms': {
+            'p50': float(np.nanpercentile(run_rms, 50)),
+            'p95': float(np.nanpercentile(run_rms, 95)),
+            'worst_run': int(np.nanargmax(run_rms)),
+        },
+    }
+
+    print(f"\nFinished in {elapsed:.1f} s "
+          f"({args.runs * len(truth['timestamp']) / elapsed / 1e6:.2f} M IMU samples/s)")
+    print(f"{'':10s} {'':12s} {'mean':>9s} {'rms':>9s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}")
+    for part in ('all', 'open_sky', 'tunnel'):
+        for axis in ('along_track', 'cross_track'):
+            s = summary[part].get(axis)
+            if s:
+                print(f"{part:10s} {axis:12s} {s['mean']:9.2f} {s['rms']:9.2f} {s['p50']:9.2f} "
+                      f"{s['p95']:9.2f} {s['p99']:9.2f} {s['max']:9.2f}")
+    print(f"Per-run RMS: p50 {summary['run_rms']['p50']:.2f} m, p95 {summary['run_rms']['p95']:.2f} m "
+          f"(worst run {summary['run_rms']['worst_run']})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nSummary saved to {args.output}")
+
+    if args.envelope:
+        stride = int(args.imu_rate)
+        envelope = {'timestamp': truth['timestamp'][::stride], 'along_track_m': truth['along_track'][::stride]}
+        valid = np.isfinite(along).any(axis=0)  # Columns before any filter initialized stay NaN
+        for name, error in (('along', along), ('cross', cross)):
+            for q in (50, 95):
+                column = np.full(along.shape[1], np.nan)
+                column[valid] = np.nanpercentile(np.abs(error[:, valid]), q, axis=0)
+                envelope[f'{name}_p{q}'] = column
+        pd.DataFrame(envelope).to_csv(args.envelope, index=False)
+        print(f"Error envelope saved to {args.envelope}")
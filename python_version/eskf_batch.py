@@ -0,0 +1,616 @@
+"""Batched NumPy ESKF.
+
+Python reference engine for eskf.c. Every state array carries a leading
+batch dimension, so N filter instances (different noise configs or noise
+realizations of the same data) are propagated in lockstep with NumPy array
+operations instead of N separate runs.
+
+The algorithm mirrors eskf.c step by step in float32 (timestamps and
+lat/lon in float64): IMU prediction with the rotation matrix attitude,
+gravity-based attitude correction, diagonal covariance propagation, the
+simplified GPS update, tunnel detection and rail map matching with the
+tunnel heading correction. Pre-integration and the quaternion attitude mode
+are C-only.
+
+Example:
+    eskf = BatchESKF(1000, acc_noise=np.linspace(0.1, 1.0, 1000))
+    eskf.load_rail_nodes(rail_lat, rail_lon)
+    for row in data:
+        eskf.process_imu(t, acc, gyro)      # acc/gyro: (3,) or (N, 3)
+        if has_gps:
+            eskf.process_gps(t, lat, lon, satellites=sats)
+    state = eskf.get_state()                # dict of (N, ...) arrays
+"""
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+DEG_TO_RAD = np.pi / 180.0
+IMU_BUFFER_SIZE = 500
+MAP_MATCH_MAX_DIST = 20.0  # Snap to the track within this distance (m)
+
+F32 = np.float32
+
+
+# Batched vector/matrix helpers, shapes (N, 3) and (N, 3, 3)
+def _normalize(v):
+    norm = np.linalg.norm(v, axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(norm > 1e-12, v * (F32(1.0) / norm), F32(0.0)).astype(F32)
+
+
+def _rotate(R, v):
+    return np.matmul(R, v[..., None])[..., 0]
+
+
+def _rotate_inverse(R, v):
+    return np.matmul(v[..., None, :], R)[..., 0, :]
+
+
+def _skew(v):
+    S = np.zeros(v.shape[:-1] + (3, 3), dtype=F32)
+    S[..., 0, 1] = -v[..., 2]
+    S[..., 0, 2] = v[..., 1]
+    S[..., 1, 0] = v[..., 2]
+    S[..., 1, 2] = -v[..., 0]
+    S[..., 2, 0] = -v[..., 1]
+    S[..., 2, 1] = v[..., 0]
+    return S
+
+
+def _axis_angle_to_matrix(axis_angle):
+    # Rodrigues' formula (mat3_from_axis_angle)
+    angle = np.linalg.norm(axis_angle, axis=-1)
+    small = angle < 1e-12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        axis = axis_angle * (F32(1.0) / np.where(small, F32(1.0), angle))[..., None]
+    c = np.cos(angle)
+    s = np.sin(angle)
+    t = F32(1.0) - c
+    x, y, z = axis[..., 0], axis[..., 1], axis[..., 2]
+
+    R = np.empty(axis_angle.shape[:-1] + (3, 3), dtype=F32)
+    R[..., 0, 0] = t * x * x + c
+    R[..., 0, 1] = t * x * y - s * z
+    R[..., 0, 2] = t * x * z + s * y
+    R[..., 1, 0] = t * x * y + s * z
+    R[..., 1, 1] = t * y * y + c
+    R[..., 1, 2] = t * y * z - s * x
+    R[..., 2, 0] = t * x * z - s * y
+    R[..., 2, 1] = t * y * z + s * x
+    R[..., 2, 2] = t * z * z + c
+    R[small] = np.eye(3, dtype=F32)
+    return R
+
+
+def _orthonormalize(R):
+    # Gram-Schmidt on the columns, z = x cross y keeps it right-handed
+    x = _normalize(R[..., :, 0])
+    y = R[..., :, 1]
+    y = _normalize(y - x * np.sum(x * y, axis=-1, keepdims=True))
+    z = np.cross(x, y)
+    return np.stack([x, y, z], axis=-1)
+
+
+def _euler_from_matrix(R):
+    pitch = np.arcsin(-R[..., 2, 0])
+    regular = np.cos(pitch) > 1e-6
+    roll = np.where(regular, np.arctan2(R[..., 2, 1], R[..., 2, 2]), F32(0.0))
+    yaw = np.where(regular, np.arctan2(R[..., 1, 0], R[..., 0, 0]),
+                   np.arctan2(-R[..., 0, 1], R[..., 1, 1]))
+    return roll.astype(F32), pitch.astype(F32), yaw.astype(F32)
+
+
+def _matrix_from_euler(roll, pitch, yaw):
+    cr, sr = np.cos(roll), np.sin(roll)
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+
+    R = np.empty(np.shape(roll) + (3, 3), dtype=F32)
+    R[..., 0, 0] = cy * cp
+    R[..., 0, 1] = cy * sp * sr - sy * cr
+    R[..., 0, 2] = cy * sp * cr + sy * sr
+    R[..., 1, 0] = sy * cp
+    R[..., 1, 1] = sy * sp * sr + cy * cr
+    R[..., 1, 2] = sy * sp * cr - cy * sr
+    R[..., 2, 0] = -sp
+    R[..., 2, 1] = cp * sr
+    R[..., 2, 2] = cp * cr
+    return R
+
+
+def _initial_rotation(gravity_direction):
+    # Rotation aligning the measured gravity direction with +z
+    z_axis = np.array([0.0, 0.0, 1.0], dtype=F32)
+    dot = gravity_direction[..., 2]
+    v = np.cross(gravity_direction, z_axis)
+    s = np.linalg.norm(v, axis=-1)
+
+    vx = _skew(v)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = (F32(1.0) - dot) / (s * s)
+    R = np.eye(3, dtype=F32) + vx + np.matmul(vx, vx) * scale[..., None, None]
+
+    identity = (np.abs(dot - F32(1.0)) < 1e-6) | (s <= 1e-6)
+    R[identity] = np.eye(3, dtype=F32)
+    return R.astype(F32)
+
+
+def _batch_param(value, n, width=None):
+    shape = (n,) if width is None else (n, width)
+    return np.array(np.broadcast_to(np.asarray(value, dtype=F32), shape), dtype=F32)
+
+
+class BatchESKF:
+    """N ESKF instances advanced in lockstep.
+
+    Scalar parameters may be given per filter as arrays of length N. All
+    filters receive the same IMU timestamps; measurements may be shared
+    ((3,) arrays) or per filter ((N, 3) arrays).
+    """
+
+    def __init__(self, n, acc_noise=0.5, gyro_noise=0.01, acc_bias_noise=0.01,
+                 gyro_bias_noise=0.001, gravity=(0.0, 0.0, -9.81007), I_p_Gps=(0.0, 0.0, 0.0),
+                 tunnel_threshold=5.0, heading_smoothing_factor=0.5,
+                 orthonormalize_interval=1, gravity_correction_interval=1):
+        self.n = n
+
+        # Configuration (eskf_config_t plus the eskf_t tuning fields)
+        self.acc_noise = _batch_param(acc_noise, n)
+        self.gyro_noise = _batch_param(gyro_noise, n)
+        self.acc_bias_noise = _batch_param(acc_bias_noise, n)
+        self.gyro_bias_noise = _batch_param(gyro_bias_noise, n)
+        self.gravity = _batch_param(gravity, n, 3)
+        self.I_p_Gps = _batch_param(I_p_Gps, n, 3)
+        self.tunnel_threshold = np.array(np.broadcast_to(tunnel_threshold, (n,)), dtype=np.float64)
+        self.heading_smoothing_factor = _batch_param(heading_smoothing_factor, n)
+        self.orthonormalize_interval = max(int(orthonormalize_interval), 1)
+        self.gravity_correction_interval = max(int(gravity_correction_interval), 1)
+
+        # Railway map (shared lat/lon, per-filter ENU once initialized)
+        self.rail_lat = np.zeros(0)
+        self.rail_lon = np.zeros(0)
+        self.rail_enu = None
+        self.map_match_period = 0.0
+        self.map_match_distance = 0.0
+
+        self.reset()
+
+    def reset(self):
+        n = self.n
+        self.initialized = np.zeros(n, dtype=bool)
+        self.imu_buffer_acc = np.zeros((n, IMU_BUFFER_SIZE, 3), dtype=F32)
+        self.imu_buffer_gyro = np.zeros((n, IMU_BUFFER_SIZE, 3), dtype=F32)
+        self.imu_buffer_count = np.zeros(n, dtype=np.int64)
+        self.imu_buffer_index = np.zeros(n, dtype=np.int64)
+        self.last_gps_time = np.zeros(n)
+        self.in_tunnel = np.zeros(n, dtype=bool)
+        self.current_satellites = np.zeros(n, dtype=np.int64)
+        self.rail_segment = np.full(n, -1, dtype=np.int64)
+        self.last_map_match_time = np.zeros(n)
+        self.last_map_match_pos = np.zeros((n, 3), dtype=F32)
+        self.map_match_in_tunnel = np.zeros(n, dtype=bool)
+
+        # Filter state (eskf_state_t)
+        self.timestamp = np.zeros(n)
+        self.lat = np.zeros(n)
+        self.lon = np.zeros(n)
+        self.alt = np.zeros(n)
+        self.G_p_I = np.zeros((n, 3), dtype=F32)
+        self.G_v_I = np.zeros((n, 3), dtype=F32)
+        self.G_R_I = np.tile(np.eye(3, dtype=F32), (n, 1, 1))
+        self.acc_bias = np.zeros((n, 3), dtype=F32)
+        self.gyro_bias = np.zeros((n, 3), dtype=F32)
+        self.cov = np.tile(np.eye(15, dtype=F32) * F32(0.01), (n, 1, 1))
+        self.orthonormalize_counter = np.zeros(n, dtype=np.int64)
+        self.gravity_correction_counter = np.zeros(n, dtype=np.int64)
+
+        # Local tangent plane (ltp_t)
+        self.init_lla = np.zeros((n, 3))
+        self.m_per_deg_lat = EARTH_RADIUS_M * DEG_TO_RAD
+        self.m_per_deg_lon = np.ones(n)
+
+        # The initialization buffer is frozen once a filter is initialized,
+        # so the statistics the gravity correction reads from it are fixed
+        self.buffer_acc_variance = np.zeros(n, dtype=F32)
+        self.buffer_latest_acc = np.zeros((n, 3), dtype=F32)
+
+        self.last_imu_time = 0.0
+        self.last_acc = np.zeros((n, 3), dtype=F32)
+        self.last_gyro = np.zeros((n, 3), dtype=F32)
+
+        self.rail_enu = None
+
+    # Configuration
+    def set_map_match_schedule(self, rate_hz, distance_m):
+        self.map_match_period = 1.0 / rate_hz if rate_hz > 0 else 0.0
+        self.map_match_distance = distance_m if distance_m > 0 else 0.0
+
+    def load_rail_nodes(self, lat, lon):
+        self.rail_lat = np.asarray(lat, dtype=np.float64)
+        self.rail_lon = np.asarray(lon, dtype=np.float64)
+        self.rail_enu = None
+        self.rail_segment[:] = -1
+        if self.initialized.any():
+            self._project_rail_nodes()
+        return len(self.rail_lat)
+
+    # Coordinates
+    def _lla_to_enu(self, idx, lat, lon, alt):
+        enu = np.empty((len(idx), 3), dtype=F32)
+        enu[:, 0] = (lon - self.init_lla[idx, 1]) * self.m_per_deg_lon[idx]
+        enu[:, 1] = (lat - self.init_lla[idx, 0]) * self.m_per_deg_lat
+        enu[:, 2] = alt - self.init_lla[idx, 2]
+        return enu
+
+    def _enu_to_lla(self, idx):
+        enu = self.G_p_I[idx].astype(np.float64)
+        self.lat[idx] = self.init_lla[idx, 0] + enu[:, 1] * (1.0 / self.m_per_deg_lat)
+        self.lon[idx] = self.init_lla[idx, 1] + enu[:, 0] * (1.0 / self.m_per_deg_lon[idx])
+        self.alt[idx] = self.init_lla[idx, 2] + enu[:, 2]
+
+    def _project_rail_nodes(self):
+        # (N, M, 2) east/north of every rail node in each filter's frame
+        east = (self.rail_lon[None, :] - self.init_lla[:, 1:2]) * self.m_per_deg_lon[:, None]
+        north = (self.rail_lat[None, :] - self.init_lla[:, 0:1]) * self.m_per_deg_lat
+        self.rail_enu = np.stack([east, north], axis=-1).astype(F32)
+
+    # Attitude
+    def _apply_delta(self, idx, delta_angle, small_angle):
+        # G_R_I = G_R_I * Exp(delta_angle)
+        if small_angle:
+            delta_R = np.eye(3, dtype=F32) + _skew(delta_angle)
+        else:
+            delta_R = _axis_angle_to_matrix(delta_angle)
+        R = np.matmul(self.G_R_I[idx], delta_R)
+
+        self.orthonormalize_counter[idx] += 1
+        due = self.orthonormalize_counter[idx] >= self.orthonormalize_interval
+        if due.any():
+            R[due] = _orthonormalize(R[due])
+            self.orthonormalize_counter[idx[due]] = 0
+        self.G_R_I[idx] = R
+
+    def _correct_rotation_with_gravity(self, idx, acc_unbias, gain):
+        acc_norm = np.linalg.norm(acc_unbias, axis=-1)
+        gravity_norm = np.linalg.norm(self.gravity[idx], axis=-1)
+        acc_diff = np.abs(acc_norm - gravity_norm)
+
+        # Skip while accelerating or under dynamic motion
+        keep = (acc_diff <= 2.0) & (self.buffer_acc_variance[idx] <= 0.5)
+        if not keep.any():
+            return
+        idx, acc_unbias, gain = idx[keep], acc_unbias[keep], gain[keep]
+
+        # Lower velocity = higher confidence in the gravity measurement
+        velocity = np.linalg.norm(self.G_v_I[idx], axis=-1)
+        velocity_factor = np.select([velocity < 1.0, velocity < 5.0, velocity < 15.0],
+                                    [F32(2.0), F32(1.0), F32(0.5)], F32(0.2)).astype(F32)
+        gain = gain * velocity_factor
+
+        # Measured vs expected specific force direction in the IMU frame
+        measured_gravity = _normalize(acc_unbias)
+        expected_gravity = _normalize(_rotate_inverse(self.G_R_I[idx], -self.gravity[idx]))
+        rotation_error = np.cross(measured_gravity, expected_gravity) * gain[:, None]
+
+        self._apply_delta(idx, rotation_error, small_angle=True)
+
+    def _apply_gravity_correction(self, idx, acc_unbias):
+        self.gravity_correction_counter[idx] += 1
+        counter = self.gravity_correction_counter[idx]
+        due = counter >= self.gravity_correction_interval
+        if due.any():
+            # Gain scaled by the interval to keep the same bandwidth
+            gain = F32(0.001) * counter[due].astype(F32)
+            self.gravity_correction_counter[idx[due]] = 0
+            self._correct_rotation_with_gravity(idx[due], acc_unbias[due], gain)
+
+    # Filter steps
+    def _propagate_covariance(self, idx, dt):
+        # State order: [dp(0-2), dv(3-5), dtheta(6-8), dba(9-11), dbg(12-14)]
+        cov = self.cov[idx]
+        diag = np.einsum('nii->ni', cov)
+        vel_norm = np.linalg.norm(self.G_v_I[idx], axis=-1)
+        acc_noise = self.acc_noise[idx]
+
+        pos_noise = acc_noise * dt * dt * F32(0.5) + vel_norm * dt * F32(0.01)
+        diag[:, 0:3] += (pos_noise * pos_noise)[:, None]
+        vel_noise = acc_noise * dt
+        diag[:, 3:6] += (vel_noise * vel_noise)[:, None]
+        rot_noise = self.gyro_noise[idx] * dt
+        diag[:, 6:9] += (rot_noise * rot_noise)[:, None]
+        diag[:, 9:12] += (self.acc_bias_noise[idx] * self.acc_bias_noise[idx] * dt)[:, None]
+        diag[:, 12:15] += (self.gyro_bias_noise[idx] * self.gyro_bias_noise[idx] * dt)[:, None]
+        self.cov[idx] = cov
+
+    def _predict(self, idx, timestamp, acc, gyro):
+        dt = F32(timestamp - self.last_imu_time)
+        dt2 = dt * dt
+
+        acc_unbias = (self.last_acc[idx] + acc[idx]) * F32(0.5) - self.acc_bias[idx]
+        gyro_unbias = (self.last_gyro[idx] + gyro[idx]) * F32(0.5) - self.gyro_bias[idx]
+
+        # Position and velocity
+        acc_global = _rotate(self.G_R_I[idx], acc_unbias) + self.gravity[idx]
+        v = self.G_v_I[idx]
+        self.G_p_I[idx] = self.G_p_I[idx] + v * dt + acc_global * (F32(0.5) * dt2)
+        self.G_v_I[idx] = v + acc_global * dt
+
+        # Rotation
+        delta_angle = gyro_unbias * dt
+        rotating = np.linalg.norm(delta_angle, axis=-1) > 1e-12
+        if rotating.any():
+            self._apply_delta(idx[rotating], delta_angle[rotating], small_angle=False)
+
+        self._apply_gravity_correction(idx, acc_unbias)
+        self._propagate_covariance(idx, dt)
+        self.timestamp[idx] = timestamp
+
+    def _map_match_due(self, idx):
+        due = self.rail_segment[idx] < 0
+        if self.map_match_period <= 0.0 and self.map_match_distance <= 0.0:
+            return np.ones(len(idx), dtype=bool)
+        due |= self.in_tunnel[idx] & ~self.map_match_in_tunnel[idx]
+        if self.map_match_period > 0.0:
+            due |= self.timestamp[idx] - self.last_map_match_time[idx] >= self.map_match_period
+        if self.map_match_distance > 0.0:
+            moved = self.G_p_I[idx] - self.last_map_match_pos[idx]
+            due |= np.sum(moved * moved, axis=-1) >= self.map_match_distance ** 2
+        return due
+
+    def _closest_rail_point(self, idx, segments):
+        # segments: (K, S) candidate segment indices per filter, -1 = none
+        last = len(self.rail_lat) - 2
+        if last < 0 or segments.shape[1] == 0:
+            return (np.full(len(idx), F32(1e6)), self.G_p_I[idx, :2].copy(),
+                    np.full(len(idx), -1, dtype=np.int64))
+        valid = (segments >= 0) & (segments <= last)
+        seg = np.clip(segments, 0, max(last, 0))
+
+        rows = idx[:, None]
+        p1 = self.rail_enu[rows, seg]
+        d = self.rail_enu[rows, seg + 1] - p1
+        len2 = np.sum(d * d, axis=-1)
+        valid &= len2 >= 1e-6
+
+        pos = self.G_p_I[idx, None, :2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.sum((pos - p1) * d, axis=-1) / len2
+        t = np.clip(np.nan_to_num(t), F32(0.0), F32(1.0)).astype(F32)
+        closest = p1 + t[..., None] * d
+        diff = pos - closest
+        dist2 = np.where(valid, np.sum(diff * diff, axis=-1), np.inf)
+
+        best = np.argmin(dist2, axis=1)
+        k = np.arange(len(idx))
+        found = np.isfinite(dist2[k, best])
+        dist = np.where(found, np.sqrt(dist2[k, best]), F32(1e6))
+        point = np.where(found[:, None], closest[k, best], self.G_p_I[idx, :2])
+        segment = np.where(found, seg[k, best], -1)
+        return dist, point, segment
+
+    def _map_match(self, idx):
+        due = self._map_match_due(idx)
+        segment_count = len(self.rail_lat) - 1
+
+        dist = np.empty(len(idx), dtype=F32)
+        point = np.empty((len(idx), 2), dtype=F32)
+        segment = np.empty(len(idx), dtype=np.int64)
+
+        if due.any():
+            # Full search over the whole map
+            full = idx[due]
+            candidates = np.broadcast_to(np.arange(segment_count), (len(full), segment_count))
+            dist[due], point[due], segment[due] = self._closest_rail_point(full, candidates)
+            self.last_map_match_time[full] = self.timestamp[full]
+            self.last_map_match_pos[full] = self.G_p_I[full]
+        if not due.all():
+            # Only the segments around the cursor
+            near = idx[~due]
+            candidates = self.rail_segment[near, None] + np.arange(-1, 2)
+            dist[~due], point[~due], segment[~due] = self._closest_rail_point(near, candidates)
+
+        self.map_match_in_tunnel[idx] = self.in_tunnel[idx]
+        found = segment >= 0
+        self.rail_segment[idx[found]] = segment[found]
+
+        # Snap to the railway within the matching distance
+        snap = dist < MAP_MATCH_MAX_DIST
+        snapped = idx[snap]
+        self.G_p_I[snapped, :2] = point[snap]
+
+        # Gradually align the IMU yaw with the rail direction in tunnels
+        align = snap & self.in_tunnel[idx] & found
+        if align.any():
+            rows = idx[align]
+            seg = segment[align]
+            d = self.rail_enu[rows, seg + 1] - self.rail_enu[rows, seg]
+            rail_yaw = np.arctan2(d[:, 0], d[:, 1])  # North = 0, East = pi/2
+
+            roll, pitch, yaw = _euler_from_matrix(self.G_R_I[rows])
+            yaw_error = rail_yaw - yaw
+            yaw_error = (yaw_error + np.pi) % (2.0 * np.pi) - np.pi
+            corrected_yaw = yaw + yaw_error * self.heading_smoothing_factor[rows]
+            self.G_R_I[rows] = _orthonormalize(_matrix_from_euler(roll, pitch, corrected_yaw.astype(F32)))
+
+        self._enu_to_lla(idx)
+
+    # Public API
+    def process_imu(self, timestamp, acc, gyro):
+        """Process one IMU sample for all filters.
+
+        Returns a bool array marking the filters that ran a prediction
+        (eskf_process_imu returning 1).
+        """
+        acc = np.broadcast_to(np.asarray(acc, dtype=F32), (self.n, 3))
+        gyro = np.broadcast_to(np.asarray(gyro, dtype=F32), (self.n, 3))
+
+        # Tunnel status
+        has_gps = self.last_gps_time > 0
+        self.in_tunnel = has_gps & (timestamp - self.last_gps_time > self.tunnel_threshold)
+
+        # Buffer samples of the filters waiting for their first GPS fix
+        waiting = np.flatnonzero(~self.initialized)
+        if len(waiting):
+            count = self.imu_buffer_count[waiting]
+            full = count >= IMU_BUFFER_SIZE
+            slot = np.where(full, self.imu_buffer_index[waiting], count)
+            self.imu_buffer_acc[waiting, slot] = acc[waiting]
+            self.imu_buffer_gyro[waiting, slot] = gyro[waiting]
+            self.imu_buffer_count[waiting] = np.where(full, count, count + 1)
+            self.imu_buffer_index[waiting] = np.where(
+                full, (self.imu_buffer_index[waiting] + 1) % IMU_BUFFER_SIZE, self.imu_buffer_index[waiting])
+
+        processed = self.initialized.copy()
+        active = np.flatnonzero(processed & (self.timestamp > 0))
+        if len(active):
+            self._predict(active, timestamp, acc, gyro)
+
+        # Route projection when GPS quality is low (< 8 satellites)
+        if len(self.rail_lat) > 0 and self.rail_enu is not None:
+            matching = np.flatnonzero(processed & (self.current_satellites < 8))
+            if len(matching):
+                self._map_match(matching)
+
+        self.last_imu_time = timestamp
+        self.last_acc = np.array(acc, dtype=F32)
+        self.last_gyro = np.array(gyro, dtype=F32)
+        return processed
+
+    def process_imu_array(self, timestamps, acc, gyro):
+        """Process a sequence of IMU samples ((T,) timestamps, (T, 3) or (T, N, 3) data).
+
+        Returns the number of predictions run per filter.
+        """
+        processed = np.zeros(self.n, dtype=np.int64)
+        for i in range(len(timestamps)):
+            processed += self.process_imu(timestamps[i], acc[i], gyro[i])
+        return processed
+
+    def process_gps(self, timestamp, lat, lon, alt=0.0, satellites=0, mask=None):
+        """Process one GPS fix (per-filter values broadcast to N).
+
+        mask selects the filters that receive the fix. Returns a bool array
+        of the filters that accepted it (eskf_process_gps returning 1).
+        """
+        lat = np.broadcast_to(np.asarray(lat, dtype=np.float64), (self.n,))
+        lon = np.broadcast_to(np.asarray(lon, dtype=np.float64), (self.n,))
+        alt = np.broadcast_to(np.asarray(alt, dtype=np.float64), (self.n,))
+        satellites = np.broadcast_to(np.asarray(satellites, dtype=np.int64), (self.n,))
+        receiving = np.ones(self.n, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+
+        self.last_gps_time[receiving] = timestamp
+        self.in_tunnel[receiving] = False
+        self.current_satellites[receiving] = satellites[receiving]
+
+        updating = np.flatnonzero(receiving & self.initialized)
+        starting = np.flatnonzero(receiving & ~self.initialized & (self.imu_buffer_count >= 10))
+
+        if len(updating):
+            self._gps_update(updating, lat, lon, alt, satellites)
+        if len(starting):
+            self._initialize(starting, timestamp, lat, lon, alt)
+
+        accepted = np.zeros(self.n, dtype=bool)
+        accepted[updating] = True
+        accepted[starting] = True
+        return accepted
+
+    def _initialize(self, idx, timestamp, lat, lon, alt):
+        # Reference frame at the first GPS fix
+        self.init_lla[idx, 0] = lat[idx]
+        self.init_lla[idx, 1] = lon[idx]
+        self.init_lla[idx, 2] = alt[idx]
+        self.m_per_deg_lon[idx] = EARTH_RADIUS_M * DEG_TO_RAD * np.cos(lat[idx] * DEG_TO_RAD)
+
+        self.G_p_I[idx] = 0.0
+        self.G_v_I[idx] = 0.0
+
+        # Attitude from the mean gravity, gyro bias from the mean rate
+        count = np.minimum(self.imu_buffer_count[idx], IMU_BUFFER_SIZE)
+        filled = np.arange(IMU_BUFFER_SIZE)[None, :] < count[:, None]
+        acc_sum = np.sum(np.where(filled[..., None], self.imu_buffer_acc[idx], F32(0.0)), axis=1)
+        gyro_sum = np.sum(np.where(filled[..., None], self.imu_buffer_gyro[idx], F32(0.0)), axis=1)
+        inv_count = (F32(1.0) / count.astype(F32))[:, None]
+        self.G_R_I[idx] = _initial_rotation(_normalize(acc_sum * inv_count))
+        self.acc_bias[idx] = 0.0
+        self.gyro_bias[idx] = gyro_sum * inv_count
+
+        self.cov[idx] = np.diag(np.array([1.0] * 3 + [0.1] * 6 + [0.01] * 6, dtype=F32))
+
+        self.timestamp[idx] = timestamp
+        self.lat[idx] = lat[idx]
+        self.lon[idx] = lon[idx]
+        self.alt[idx] = alt[idx]
+
+        # Frozen buffer statistics: variance of the last 20 slots before the
+        # write index, and the latest sample used by the GPS update
+        window = np.minimum(self.imu_buffer_count[idx], 20)
+        offsets = np.arange(20)[None, :]
+        slots = (self.imu_buffer_index[idx, None] - window[:, None] + offsets + IMU_BUFFER_SIZE) % IMU_BUFFER_SIZE
+        in_window = offsets < window[:, None]
+        samples = self.imu_buffer_acc[idx[:, None], slots]
+        inv_window = (F32(1.0) / window.astype(F32))[:, None]
+        mean = np.sum(np.where(in_window[..., None], samples, F32(0.0)), axis=1) * inv_window
+        spread = np.linalg.norm(samples - mean[:, None, :], axis=-1)
+        self.buffer_acc_variance[idx] = np.sum(np.where(in_window, spread, F32(0.0)), axis=1) * inv_window[:, 0]
+
+        latest = np.where(self.imu_buffer_index[idx] > 0,
+                          self.imu_buffer_index[idx] - 1, self.imu_buffer_count[idx] - 1)
+        self.buffer_latest_acc[idx] = self.imu_buffer_acc[idx, latest]
+
+        self.initialized[idx] = True
+        if len(self.rail_lat) > 0:
+            self._project_rail_nodes()
+
+    def _gps_update(self, idx, lat, lon, alt, satellites):
+        G_p_Gps = self._lla_to_enu(idx, lat[idx], lon[idx], alt[idx])
+        predicted = self.G_p_I[idx] + _rotate(self.G_R_I[idx], self.I_p_Gps[idx])
+        residual = G_p_Gps - predicted
+
+        # Measurement noise: better accuracy with more satellites
+        with np.errstate(divide='ignore'):
+            gps_noise = F32(5.0) / np.sqrt(satellites[idx].astype(F32))
+        R = gps_noise * gps_noise
+
+        cov = self.cov[idx]
+        diag = np.einsum('nii->ni', cov)
+        with np.errstate(invalid='ignore'):
+            gain = diag[:, 0:3] / (diag[:, 0:3] + R[:, None])
+        K_pos = np.nan_to_num(np.sum(gain, axis=1)) / F32(3.0)
+        K_vel = K_pos * F32(0.1)
+
+        self.G_p_I[idx] = self.G_p_I[idx] + residual * K_pos[:, None]
+        self.G_v_I[idx] = self.G_v_I[idx] + residual * K_vel[:, None]
+
+        diag[:, 0:3] *= (F32(1.0) - K_pos)[:, None]
+        diag[:, 3:6] *= (F32(1.0) - K_vel)[:, None]
+        diag[:, 6:9] *= F32(0.98)
+        self.cov[idx] = cov
+
+        # Gravity alignment with the latest buffered sample
+        acc_unbias = self.buffer_latest_acc[idx] - self.acc_bias[idx]
+        self._correct_rotation_with_gravity(idx, acc_unbias, np.full(len(idx), F32(0.02)))
+
+    # State output
+    def euler_angles(self):
+        """Roll, pitch, yaw arrays (N,) from the current attitude."""
+        return _euler_from_matrix(self.G_R_I)
+
+    def get_state(self):
+        """Copy of the filter states as a dict of (N, ...) arrays (eskf_state_t fields)."""
+        roll, pitch, yaw = self.euler_angles()
+        return {
+            'timestamp': self.timestamp.copy(),
+            'lat': self.lat.copy(),
+            'lon': self.lon.copy(),
+            'alt': self.alt.copy(),
+            'G_p_I': self.G_p_I.copy(),
+            'G_v_I': self.G_v_I.copy(),
+            'G_R_I': self.G_R_I.copy(),
+            'acc_bias': self.acc_bias.copy(),
+            'gyro_bias': self.gyro_bias.copy(),
+            'cov': self.cov.copy(),
+            'roll': roll,
+            'pitch': pitch,
+            'yaw': yaw,
+        }
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+import os
+import argparse
+import time
+
+from eskf_batch import BatchESKF
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='ESKF Python (NumPy) Test with Railway Direction')
+parser.add_argument('--direction', choices=['up', 'down'], default='up',
+                   help='Railway direction: up (상행) or down (하행)')
+args = parser.parse_args()
+
+print(f"Python ESKF Test")
+print(f"================")
+print(f"Railway Direction: {args.direction} ({'상행' if args.direction == 'up' else '하행'})")
+
+# Create ESKF instance (single filter of the batched engine)
+eskf = BatchESKF(1)
+
+print("\nESKF instance created")
+
+# Load railway nodes based on direction
+try:
+    railway_file = f'data/railway_nodes_{args.direction}.csv'
+    if not os.path.exists(railway_file):
+        # Fallback to default railway_nodes.csv
+        railway_file = 'data/railway_nodes.csv'
+        print(f"Warning: {railway_file} not found, using default railway_nodes.csv")
+
+    rail_df = pd.read_csv(railway_file)
+    # Handle both 'lng' and 'lon' column names
+    if 'lng' in rail_df.columns:
+        rail_lon = rail_df['lng'].values
+    elif 'lon' in rail_df.columns:
+        rail_lon = rail_df['lon'].values
+    else:
+        raise ValueError("No longitude column found (expected 'lng' or 'lon')")
+
+    loaded = eskf.load_rail_nodes(rail_df['lat'].values, rail_lon)
+    print(f"Loaded {loaded} railway nodes from {railway_file}")
+except Exception as e:
+    print(f"Railway nodes not loaded: {e}")
+
+# Load and process data
+print("\nLoading sensor data...")
+# Use corrected data if available, otherwise use original
+try:
+    df = pd.read_csv('data/data_corrected.csv')
+    print("Using corrected IMU data (data_corrected.csv)")
+except FileNotFoundError:
+    df = pd.read_csv('data/data.csv')
+    print("Using original IMU data (data.csv)")
+
+df['timestamp'] = pd.to_datetime(df['timestamp']).astype('datetime64[ns]').astype(np.int64) / 1e9  # Convert to seconds
+
+print(f"Processing {len(df)} data points...")
+
+results = []
+gps_count = 0
+imu_count = 0
+current_gps_lat = 0
+current_gps_lon = 0
+initialization_points = []  # Store all initialization points
+# Find gps_available True -> False transitions
+print("Finding gps_available True->False transitions...")
+temp_df = pd.read_csv('data/data.csv')
+temp_df['prev_gps_available'] = temp_df['gps_available'].shift(1)
+temp_df['gps_available_loss'] = (temp_df['prev_gps_available'] == True) & (temp_df['gps_available'] == False)
+gps_loss_indices = set(temp_df[temp_df['gps_available_loss'] == True].index.tolist())
+print(f"Found {len(gps_loss_indices)} gps_available True->False transitions at indices: {list(gps_loss_indices)}")
+initialization_marked = False
+
+# IMU samples as arrays
+timestamps = df['timestamp'].values
+acc = df[['accel_x', 'accel_y', 'accel_z']].values * 9.81
+gyro = df[['gyro_x', 'gyro_y', 'gyro_z']].values
+
+# Rows where GPS is processed or the state is sampled
+gps_valid = (df['gps_lat'].notna() & df['gps_lng'].notna() & (df['gps_lat'] != 0)).values
+sample_rows = np.arange(len(df)) % 100 == 0
+sample_rows[list(gps_loss_indices)] = True
+
+filter_time = 0.0  # Time spent in the filter calls only (reported for the server's throughput metric)
+for idx in range(len(df)):
+    t_start = time.perf_counter()
+    imu_count += int(eskf.process_imu(timestamps[idx], acc[idx], gyro[idx])[0])
+    filter_time += time.perf_counter() - t_start
+
+    if not (gps_valid[idx] or sample_rows[idx]):
+        continue
+    row = df.iloc[idx]
+
+    # Process GPS if available
+    if gps_valid[idx]:
+        satellites = int(row['satellites']) if not pd.isna(row['satellites']) else 0
+        t_start = time.perf_counter()
+        success = eskf.process_gps(row['timestamp'], row['gps_lat'], row['gps_lng'],
+                                   alt=0, satellites=satellites)[0]
+        filter_time += time.perf_counter() - t_start
+
+        if success:
+            gps_count += 1
+            current_gps_lat = row['gps_lat']
+            current_gps_lon = row['gps_lng']
+
+            # Track GPS success - only record first successful GPS (real initialization)
+            if len(initialization_points) == 0:
+                init_point = {
+                    'lat': row['gps_lat'],
+                    'lon': row['gps_lng'],
+                    'timestamp': row['timestamp'],
+                    'type': 'first'
+                }
+                initialization_points.append(init_point)
+                print(f"ESKF Initialized at: {init_point['lat']:.6f}, {init_point['lon']:.6f}")
+
+    # Get state periodically or at GPS loss points
+    if sample_rows[idx] and eskf.timestamp[0] > 0:
+        # Mark initialization only for the very first time
+        is_init = 0
+        if (len(initialization_points) > 0 and not initialization_marked and
+            abs(eskf.lat[0] - initialization_points[0]['lat']) < 0.0001 and
+            abs(eskf.lon[0] - initialization_points[0]['lon']) < 0.0001):
+            is_init = 1
+            initialization_marked = True
+
+        # Check if this data point corresponds to a gps_available True->False transition
+        is_loss = 1 if idx in gps_loss_indices else 0
+
+        results.append({
+            'timestamp': eskf.timestamp[0],
+            'eskf_lat': eskf.lat[0],
+            'eskf_lon': eskf.lon[0],
+            'eskf_alt': eskf.alt[0],
+            'pos_x': eskf.G_p_I[0, 0],
+            'pos_y': eskf.G_p_I[0, 1],
+            'pos_z': eskf.G_p_I[0, 2],
+            'gps_raw_lat': current_gps_lat,
+            'gps_raw_lon': current_gps_lon,
+            'imu_acc_x': row.get('accel_x', 0),
+            'imu_acc_y': row.get('accel_y', 0),
+            'imu_acc_z': row.get('accel_z', 0),
+            'imu_gyro_x': row.get('gyro_x', 0),
+            'imu_gyro_y': row.get('gyro_y', 0),
+            'imu_gyro_z': row.get('gyro_z', 0),
+            'is_initialization': is_init,
+            'is_gps_loss': is_loss
+        })
+
+print(f"\nProcessing complete:")
+print(f"  GPS updates: {gps_count}")
+print(f"  IMU updates: {imu_count}")
+print(f"  Filter time: {filter_time:.6f} s")
+print(f"  GPS available transitions (True->False): {len(gps_loss_indices)}")
+print(f"  Output points: {len(results)}")
+
+# Save results
+if results:
+    result_df = pd.DataFrame(results)
+    result_df.to_csv('eskf_python_output.csv', index=False)
+    print(f"\nResults saved to eskf_python_output.csv")
+
+    # Show sample
+    print("\nSample results:")
+    print(f"  First ESKF: lat={results[0]['eskf_lat']:.6f}, lon={results[0]['eskf_lon']:.6f}")
+    print(f"  First GPS:  lat={results[0]['gps_raw_lat']:.6f}, lon={results[0]['gps_raw_lon']:.6f}")
+    print(f"  Last ESKF:  lat={results[-1]['eskf_lat']:.6f}, lon={results[-1]['eskf_lon']:.6f}")
+    print(f"  Last GPS:   lat={results[-1]['gps_raw_lat']:.6f}, lon={results[-1]['gps_raw_lon']:.6f}")
+
+print("\nTest completed!")
\ No newline at end of file
@@ -0,0 +1,298 @@
+"""Rate-accurate log replay: can this build keep up in real time?
+
+Feeds a data.csv log into the filter one IMU sample at a time, released at
+the log's own timestamps (or N times faster), the way the sensor driver on
+the train would deliver them. GPS fixes are applied before the first IMU
+sample after them, as in eskf_process_many, or --gps-latency seconds later
+to mimic the receiver (--gps-delay then fuses them at their own timestamp,
+and the re-propagation shows up in the service time). For every sample it
+records
+
+  - release lateness: wall time the sample started after its due time
+    (timer/scheduler jitter, or backlog when the filter falls behind),
+  - service time: wall time spent in the filter calls for the sample,
+  - response time: finish minus due time, checked against the deadline
+    (the IMU period divided by the speed-up).
+
+and prints percentiles, deadline misses and log-scale histograms. Samples
+are released with a coarse sleep and a short busy-wait (--spin) so timer
+resolution does not show up as jitter.
+
+Usage:
+    python realtime_replay.py --direction up --speed 10 --duration 120 --output rt_report.json
+    python realtime_replay.py --speed 0   # no pacing: maximum sustainable rate
+    python realtime_replay.py --speed 0 --gps-latency 0.2 --gps-delay 0.5
+"""
+import argparse
+import gc
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import eskf_ext
+from eskf_ext import Eskf, gps_delay_buffer_size
+from replay import load_sensor_log, load_rail_file
+
+HISTOGRAM_EDGES_US = [0] + [2 ** k for k in range(15)]  # 1 us .. 16 ms, last bucket open-ended
+
+
+def paced_replay(eskf, imu, gps, speed=1.0, spin=0.002, gps_latency=0.0):
+    """Replay the log in wall-clock time; per-sample timing arrays (seconds).
+
+    gps_latency delays each fix by that much log time: it is handed to the
+    filter before the first IMU sample at or after timestamp + gps_latency.
+
+    speed <= 0 releases every sample immediately (no pacing); each sample is
+    then due when it is released, so a miss means the service time alone
+    exceeded the IMU period. Returns a dict with 'due', 'release', 'finish'
+    (relative to the replay start) and the per-sample 'deadline'. Raises
+    ValueError for fewer than two IMU samples (no period to pace by).
+    """
+    t = imu['timestamp']
+    count = len(t)
+    if count < 2:
+        raise ValueError("Paced replay needs at least two IMU samples to derive the sample period")
+    # The last sample gets the median period as its deadline
+    period = np.diff(t, append=t[-1] + np.median(np.diff(t)))
+    paced = speed > 0
+    due = (t - t[0]) / speed if paced else np.zeros(count)
+    deadline = period / speed if paced else period
+
+    # First GPS fix to apply before each IMU sample (strictly older fixes)
+    gps_stop = np.searchsorted(gps['timestamp'] + gps_latency, t, side='left')
+    release = np.empty(count)
+    finish = np.empty(count)
+    clock = time.perf_counter
+    sleep = time.sleep
+    process_imu = eskf.process_imu_array
+    process_gps = eskf.process_gps_array
+    next_gps = 0
+
+    start = clock()
+    for i in range(count):
+        if paced:
+            target = start + due[i]
+            remaining = target - clock()
+            if remaining > spin:
+                sleep(remaining - spin)
+            while clock() < target:
+                pass
+        begin = clock()
+        if gps_stop[i] > next_gps:
+            process_gps(gps[next_gps:gps_stop[i]])
+            next_gps = gps_stop[i]
+        process_imu(imu[i:i + 1])
+        end = clock()
+        release[i] = begin - start
+        finish[i] = end - start
+    if next_gps < len(gps):
+        process_gps(gps[next_gps:])
+    if not paced:
+        due = release.copy()
+    return {'due': due, 'release': release, 'finish': finish, 'deadline': deadline}
+
+
+def percentiles(values_s):
+    us = np.asarray(values_s) * 1e6
+    return {
+        'mean_us': float(us.mean()),
+        'p50_us': float(np.percentile(us, 50)),
+        'p90_us': float(np.percentile(us, 90)),
+        'p99_us': float(np.percentile(us, 99)),
+        'p999_us': float(np.percentile(us, 99.9)),
+        'max_us': float(us.max()),
+    }
+
+
+def histogram(values_s):
+    """Counts per HISTOGRAM_EDGES_US bucket: [edge_k, edge_k+1) us, last one open-ended."""
+    us = np.asarray(values_s) * 1e6
+    edges = np.array(HISTOGRAM_EDGES_US[1:], dtype=float)
+    counts = np.bincount(np.searchsorted(edges, us, side='right'), minlength=len(HISTOGRAM_EDGES_US))
+    return counts.tolist()
+
+
+def longest_run(mask):
+    """Length of the longest run of True values."""
+    if not mask.any():
+        return 0
+    padded = np.concatenate(([0], mask.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    return int((edges[1::2] - edges[0::2]).max())
+
+
+def timing_report(timing, speed):
+    due, release, finish, deadline = timing['due'], timing['release'], timing['finish'], timing['deadline']
+    service = finish - release
+    response = finish - due
+    lateness = release - due
+    missed = response > deadline
+    # Release-to-release spacing error: jitter independent of a constant offset
+    interval_jitter = np.abs(np.diff(release) - np.diff(due)) if len(due) > 1 else np.zeros(1)
+    elapsed = finish[-1]
+
+    report = {
+        'samples': len(due),
+        'speed': speed,
+        'log_seconds': float(due[-1] * speed) if speed > 0 else None,
+        'wall_seconds': float(elapsed),
+        'achieved_rate_hz': float(len(due) / elapsed) if elapsed > 0 else None,
+        'nominal_period_us': float(np.median(deadline) * 1e6),
+        'utilization': float(service.sum() / elapsed) if elapsed > 0 else None,
+        'deadline_misses': int(missed.sum()),
+        'deadline_miss_rate': float(missed.mean()),
+        'longest_miss_streak': longest_run(missed),
+        'service': percentiles(service),
+        'response': percentiles(response),
+        'release_lateness': percentiles(lateness),
+        'interval_jitter': percentiles(interval_jitter),
+        'histogram_edges_us': HISTOGRAM_EDGES_US,
+        'service_histogram': histogram(service),
+        'jitter_histogram': histogram(interval_jitter),
+    }
+    report['headroom'] = report['nominal_period_us'] / report['service']['p99_us'] \
+        if report['service']['p99_us'] > 0 else None
+    return report
+
+
+def print_histogram(title, counts):
+    total = max(sum(counts), 1)
+    print(f"\n{title}")
+    for k, count in enumerate(counts):
+        if count == 0:
+            continue
+        low = HISTOGRAM_EDGES_US[k]
+        high = f"{HISTOGRAM_EDGES_US[k + 1]:>6d}" if k + 1 < len(HISTOGRAM_EDGES_US) else '   inf'
+        bar = '#' * max(1, int(50 * count / total))
+        print(f"  [{low:>6d}, {high}) us {count:>8d} {bar}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rate-accurate ESKF replay with deadline/jitter measurement')
+    parser.add_argument('--direction', choices=['up', 'down'], default='up',
+                        help='Railway direction: up (상행) or down (하행)')
+    parser.add_argument('--log', default='data/data.csv', help='Sensor log (data.csv format)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed-up (1: real time, 0: as fast as possible)')
+    parser.add_argument('--start', type=float, default=0.0, help='Skip this much log time first (s)')
+    parser.add_argument('--duration', type=float, default=None, help='Replay at most this much log time (s)')
+    parser.add_argument('--spin', type=float, default=0.002,
+                        help='Busy-wait this long before each release instead of sleeping (s)')
+    parser.add_argument('--attitude', choices=['matrix', 'quaternion'], default='matrix',
+                        help='Filter attitude representation')
+    parser.add_argument('--preintegration', type=float, default=0.0,
+                        help='Filter output rate with IMU preintegration (Hz, 0: off)')
+    parser.add_argument('--gps-latency', type=float, default=0.0,
+                        help='Deliver GPS fixes this much later than their timestamp (s)')
+    parser.add_argument('--gps-delay', type=float, default=0.0,
+                        help='Fuse late fixes up to this old at their own timestamp (s, 0: apply on arrival)')
+    parser.add_argument('--zupt', type=int, default=0,
+                        help='Zero-velocity fast path at stops with this detection window (IMU samples, 0: off)')
+    parser.add_argument('--zupt-acc-var', type=float, default=0.0035,
+                        help='Stationary below this accel window variance (sum over axes, (m/s^2)^2)')
+    parser.add_argument('--zupt-gyro-power', type=float, default=1e-4,
+                        help='... and this gyro window mean square (sum over axes, (rad/s)^2)')
+    parser.add_argument('--zupt-max-tilt', type=float, default=0.04,
+                        help='... with the mean specific force within this angle of gravity (rad)')
+    parser.add_argument('--along-track', action='store_true',
+                        help='Run the reduced along-track filter in tunnels instead of the full filter')
+    parser.add_argument('--gc', action='store_true', help='Leave the garbage collector on during the replay')
+    parser.add_argument('--output', default=None, help='Write the JSON report here')
+    parser.add_argument('--samples', default=None, help='Write per-sample timings to this CSV')
+    args = parser.parse_args()
+
+    if eskf_ext.lib is None:
+        print("ESKF extension module not found. Build it first: python eskf_cffi_build.py")
+        exit(1)
+
+    imu, gps = load_sensor_log(args.log)
+    t0 = imu['timestamp'][0] + args.start
+    t1 = t0 + args.duration if args.duration else np.inf
+    imu = imu[(imu['timestamp'] >= t0) & (imu['timestamp'] < t1)]
+    gps = gps[(gps['timestamp'] >= t0) & (gps['timestamp'] < t1)]
+
+    imu_rate = 1.0 / np.median(np.diff(imu['timestamp']))
+    # Room for --gps-delay seconds of IMU samples, so late fixes can always be rewound to
+    eskf = Eskf(delay_buffer_size=gps_delay_buffer_size(args.gps_delay, imu_rate)) if args.gps_delay > 0 else Eskf()
+    eskf.set_attitude_mode(eskf_ext.ATTITUDE_QUATERNION if args.attitude == 'quaternion'
+                           else eskf_ext.ATTITUDE_MATRIX)
+    if args.preintegration > 0:
+        eskf.set_preintegration(args.preintegration)
+    eskf.load_rail_nodes(*load_rail_file(args.direction))
+    if args.gps_delay > 0:
+        eskf.set_gps_delay(args.gps_delay, imu_rate)
+    if args.zupt > 0:
+        eskf.set_zupt(args.zupt, args.zupt_acc_var, args.zupt_gyro_power, args.zupt_max_tilt)
+    if args.along_track:
+        eskf.set_along_track(True)
+
+    span = imu['timestamp'][-1] - imu['timestamp'][0]
+    pace = f"{args.speed:g}x" if args.speed > 0 else 'unpaced'
+    print(f"Replaying {len(imu)} IMU samples, {len(gps)} GPS fixes ({span:.0f} s of log) at {pace}")
+
+    if not args.gc:
+        gc.collect()
+        gc.disable()
+    try:
+        timing = paced_replay(eskf, imu, gps, args.speed, args.spin, args.gps_latency)
+    finally:
+        gc.enable()
+    report = timing_report(timing, args.speed)
+    report['configuration'] = vars(args)
+    stats = eskf.get_stats()
+    if stats is not None:
+        report['filter_stages'] = {name: {k: v for k, v in stage.items() if k != 'bucket_edges_ns'}
+                                   for name, stage in stats.items()}
+    if args.gps_delay > 0:
+        report['gps_delay'] = eskf.get_gps_delay_stats()
+    if args.zupt > 0:
+        report['zupt'] = eskf.get_zupt_stats()
+    if args.along_track:
+        report['along_track'] = eskf.get_along_track_stats()
+    eskf.close()
+
+    print(f"\nWall time {report['wall_seconds']:.2f} s, {report['achieved_rate_hz']:.0f} samples/s, "
+          f"utilization {report['utilization'] * 100:.1f}%")
+    print(f"Deadline {report['nominal_period_us']:.0f} us: {report['deadline_misses']} misses "
+          f"({report['deadline_miss_rate'] * 100:.3f}%), longest streak {report['longest_miss_streak']}")
+    print(f"{'':18s} {'mean':>9s} {'p50':>9s} {'p90':>9s} {'p99':>9s} {'p99.9':>9s} {'max':>9s}  (us)")
+    for name in ('service', 'response', 'release_lateness', 'interval_jitter'):
+        s = report[name]
+        print(f"{name:18s} {s['mean_us']:9.1f} {s['p50_us']:9.1f} {s['p90_us']:9.1f} "
+              f"{s['p99_us']:9.1f} {s['p999_us']:9.1f} {s['max_us']:9.1f}")
+    print(f"Headroom (deadline / p99 service): {report['headroom']:.1f}x")
+    if 'gps_delay' in report:
+        d = report['gps_delay']
+        print(f"Delayed GPS: {d['fixes_in_past']} fixes fused in the past, {d['fixes_on_arrival']} on arrival "
+              f"(older than the buffer), {d['fixes_rejected']} rejected, "
+              f"{d['replayed_samples']} samples re-propagated (longest {d['max_replay']})")
+    if 'zupt' in report:
+        z = report['zupt']
+        saved = f", ~{z['compute_saved_fraction'] * 100:.1f}% of IMU-path compute saved" \
+            if 'compute_saved_fraction' in z else ''
+        print(f"Zero-velocity fast path: {z['stops']} stops, {z['skipped_fraction'] * 100:.1f}% of samples{saved}")
+    if 'along_track' in report:
+        a = report['along_track']
+        cost = f", {a['along_track_ns']:.0f} ns/sample vs {a['full_ns']:.0f} ns in the full filter" \
+            if 'along_track_ns' in a else ''
+        print(f"Along-track mode: {a['entries']} tunnel entries ({a['misses']} attempts off the map), "
+              f"{a['samples'] / len(imu) * 100:.1f}% of samples{cost}")
+    print_histogram('Service time', report['service_histogram'])
+    print_histogram('Release interval jitter', report['jitter_histogram'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to {args.output}")
+
+    if args.samples:
+        pd.DataFrame({
+            'timestamp': imu['timestamp'],
+            'due_s': timing['due'],
+            'release_s': timing['release'],
+            'finish_s': timing['finish'],
+            'deadline_s': timing['deadline'],
+        }).to_csv(args.samples, index=False)
+        print(f"Per-sample timings saved to {args.samples}")
@@ -0,0 +1,172 @@
+"""Checkpointed log replay for fast seek.
+
+One pass over the log saves a filter snapshot (eskf_save_state) every
+``interval`` seconds of log time. Seeking restores the nearest checkpoint at
+or before the target time and replays only the remainder, so the cost of a
+seek is bounded by the checkpoint interval instead of the log length.
+
+Usage:
+    python replay.py --direction up --interval 60 --seek 3300
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import eskf_ext
+from eskf_ext import Eskf, IMU_DTYPE, GPS_DTYPE, process_many
+
+
+def load_sensor_log(path='data/data.csv'):
+    """IMU_DTYPE and GPS_DTYPE arrays from a data.csv style log."""
+    df = pd.read_csv(path)
+    timestamps = pd.to_datetime(df['timestamp']).astype('datetime64[ns]').astype(np.int64).values / 1e9
+
+    imu = np.zeros(len(df), dtype=IMU_DTYPE)
+    imu['timestamp'] = timestamps
+    imu['acc'] = df[['accel_x', 'accel_y', 'accel_z']].values * 9.81
+    imu['gyro'] = df[['gyro_x', 'gyro_y', 'gyro_z']].values
+
+    valid = (df['gps_lat'].notna() & df['gps_lng'].notna() & (df['gps_lat'] != 0)).values
+    gps = np.zeros(valid.sum(), dtype=GPS_DTYPE)
+    gps['timestamp'] = timestamps[valid]
+    gps['lat'] = df['gps_lat'].values[valid]
+    gps['lon'] = df['gps_lng'].values[valid]
+    gps['satellites'] = df['satellites'].fillna(0).values[valid].astype(np.int32)
+    gps['cov'] = np.eye(3) * 25.0
+    return imu, gps
+
+
+def load_rail_file(direction):
+    """Railway node lat/lon arrays for a direction (falls back to railway_nodes.csv)."""
+    railway_file = f'data/railway_nodes_{direction}.csv'
+    if not os.path.exists(railway_file):
+        railway_file = 'data/railway_nodes.csv'
+    rail_df = pd.read_csv(railway_file)
+    lon_column = 'lng' if 'lng' in rail_df.columns else 'lon'
+    return rail_df['lat'].values, rail_df[lon_column].values
+
+
+class CheckpointReplay:
+    """Replay a sensor log with periodic filter checkpoints.
+
+    make_filter() must return a freshly configured Eskf (same configuration
+    and railway map every time); snapshots carry the running state only.
+    The state "at time t" is the filter after every IMU sample and GPS fix
+    with timestamp <= t, exactly as in one uninterrupted pass.
+    """
+
+    def __init__(self, imu, gps, make_filter, interval=60.0):
+        self.imu = imu
+        self.gps = gps
+        self.make_filter = make_filter
+        self.interval = interval
+        self.checkpoint_times = []
+        self.checkpoints = []  # (time, imu index, gps index, snapshot bytes)
+
+    def _bounds(self, t):
+        # Samples with timestamp <= t
+        return (np.searchsorted(self.imu['timestamp'], t, side='right'),
+                np.searchsorted(self.gps['timestamp'], t, side='right'))
+
+    def build(self):
+        """Run the whole log once, saving a snapshot every interval seconds."""
+        eskf = self.make_filter()
+        start_time = self.imu['timestamp'][0]
+        end_time = self.imu['timestamp'][-1]
+        imu_start, gps_start = 0, 0
+
+        # start + k * interval (not a running sum) so a seek to an exact
+        # multiple of the interval lands on its checkpoint
+        k = 0
+        checkpoint_time = start_time
+        while True:
+            imu_end, gps_end = self._bounds(checkpoint_time)
+            process_many([eskf], [self.imu[imu_start:imu_end]], [self.gps[gps_start:gps_end]])
+            self.checkpoints.append((checkpoint_time, imu_end, gps_end, eskf.save_state()))
+            self.checkpoint_times.append(checkpoint_time)
+            imu_start, gps_start = imu_end, gps_end
+            if checkpoint_time >= end_time:
+                break
+            k += 1
+            checkpoint_time = min(start_time + k * self.interval, end_time)
+
+        eskf.close()
+        return len(self.checkpoints)
+
+    def seek(self, t, eskf=None):
+        """Filter positioned at time t (restored from the nearest checkpoint).
+
+        Returns (eskf, replayed IMU samples).
+        """
+        k = max(np.searchsorted(self.checkpoint_times, t, side='right') - 1, 0)
+        _, imu_start, gps_start, snapshot = self.checkpoints[k]
+
+        if eskf is None:
+            eskf = self.make_filter()
+        if not eskf.restore_state(snapshot):
+            raise RuntimeError("Checkpoint rejected by the filter")
+
+        imu_end, gps_end = self._bounds(t)
+        imu_end, gps_end = max(imu_end, imu_start), max(gps_end, gps_start)
+        process_many([eskf], [self.imu[imu_start:imu_end]], [self.gps[gps_start:gps_end]])
+        return eskf, imu_end - imu_start
+
+    def snapshot_bytes(self):
+        return sum(len(c[3]) for c in self.checkpoints)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checkpointed ESKF log replay')
+    parser.add_argument('--direction', choices=['up', 'down'], default='up',
+                        help='Railway direction: up (상행) or down (하행)')
+    parser.add_argument('--log', default='data/data.csv', help='Sensor log (data.csv format)')
+    parser.add_argument('--interval', type=float, default=60.0, help='Checkpoint interval (s)')
+    parser.add_argument('--seek', type=float, default=None,
+                        help='Seek target in seconds from the log start (default: 90%% of the log)')
+    args = parser.parse_args()
+
+    if eskf_ext.lib is None:
+        print("ESKF extension module not found. Build it first: python eskf_cffi_build.py")
+        exit(1)
+
+    imu, gps = load_sensor_log(args.log)
+    rail_lat, rail_lon = load_rail_file(args.direction)
+
+    def make_filter():
+        eskf = Eskf()
+        eskf.load_rail_nodes(rail_lat, rail_lon)
+        return eskf
+
+    duration = imu['timestamp'][-1] - imu['timestamp'][0]
+    seek_offset = args.seek if args.seek is not None else 0.9 * duration
+    target = imu['timestamp'][0] + seek_offset
+    print(f"Log: {len(imu)} IMU samples, {len(gps)} GPS fixes, {duration:.0f} s")
+
+    replay = CheckpointReplay(imu, gps, make_filter, args.interval)
+    start = time.perf_counter()
+    count = replay.build()
+    build_time = time.perf_counter() - start
+    print(f"Checkpoints: {count} every {args.interval:.0f} s, "
+          f"{replay.snapshot_bytes() / 1024:.1f} KB total, built in {build_time * 1000:.1f} ms")
+
+    # Seek vs. replaying from the start
+    start = time.perf_counter()
+    eskf, replayed = replay.seek(target)
+    seek_time = time.perf_counter() - start
+    state = eskf.get_state_array()
+
+    full = make_filter()
+    start = time.perf_counter()
+    end_imu, end_gps = replay._bounds(target)
+    process_many([full], [imu[:end_imu]], [gps[:end_gps]])
+    full_time = time.perf_counter() - start
+    reference = full.get_state_array()
+
+    identical = all(np.array_equal(state[name], reference[name]) for name in state.dtype.names)
+    print(f"Seek to {seek_offset:.0f} s: replayed {replayed} samples in {seek_time * 1000:.2f} ms "
+          f"(full replay {end_imu} samples in {full_time * 1000:.2f} ms)")
+    print(f"  ESKF: lat={float(state['lat']):.6f}, lon={float(state['lon']):.6f}")
+    print(f"  Matches full replay: {identical}")
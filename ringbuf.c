@@ -0,0 +1,272 @@
+#if !defined(_WIN32) && !defined(_POSIX_C_SOURCE)
+#define _POSIX_C_SOURCE 200809L  // nanosleep, sched_yield
+#endif
+
+#include "ringbuf.h"
+#include <stdlib.h>
+#include <string.h>
+
+#if defined(_WIN32)
+#include <windows.h>
+#elif defined(__unix__) || defined(__APPLE__)
+#include <time.h>
+#include <sched.h>
+#define RING_POSIX_IDLE
+#endif
+
+// Index hand-over between the two threads: the producer publishes a slot
+// with a release store of head, the consumer frees it with a release store
+// of tail; each side reads the other's index with an acquire load.
+#if defined(__GNUC__) || defined(__clang__)
+#define RING_LOAD_ACQUIRE(p) __atomic_load_n(p, __ATOMIC_ACQUIRE)
+#define RING_STORE_RELEASE(p, v) __atomic_store_n(p, v, __ATOMIC_RELEASE)
+#define RING_LOAD_RELAXED(p) __atomic_load_n(p, __ATOMIC_RELAXED)
+#define RING_ACQUIRE_FENCE() __atomic_thread_fence(__ATOMIC_ACQUIRE)
+#elif defined(_MSC_VER)
+#define RING_LOAD_ACQUIRE(p) ring_load_acquire(p)
+#define RING_STORE_RELEASE(p, v) do { MemoryBarrier(); *(volatile unsigned int*)(p) = (v); } while (0)
+#define RING_LOAD_RELAXED(p) (*(volatile const unsigned long long*)(p))
+#define RING_ACQUIRE_FENCE() MemoryBarrier()
+static unsigned int ring_load_acquire(const unsigned int* p) {
+    unsigned int v = *(volatile const unsigned int*)p;
+    MemoryBarrier();
+    return v;
+}
+#else
+// Single-core targets (RTOS, ISR producer): volatile keeps the compiler ordering
+#define RING_LOAD_ACQUIRE(p) (*(volatile const unsigned int*)(p))
+#define RING_STORE_RELEASE(p, v) (*(volatile unsigned int*)(p) = (v))
+#define RING_LOAD_RELAXED(p) (*(volatile const unsigned long long*)(p))
+#define RING_ACQUIRE_FENCE()
+#endif
+
+#define RING_CACHE_LINE 64
+
+// Indices run freely (unsigned wrap-around); count = head - tail
+struct sensor_ring {
+    // Producer cache line
+    unsigned int head;           // Next slot to write
+    unsigned int cached_tail;    // Producer's last view of tail (refreshed when the ring looks full)
+    unsigned long long dropped;  // Messages rejected because the ring was full
+    char producer_pad[RING_CACHE_LINE - 2 * sizeof(unsigned int) - sizeof(unsigned long long)];
+
+    // Consumer cache line
+    unsigned int tail;           // Next slot to read
+    unsigned int cached_head;    // Consumer's last view of head (refreshed when the ring looks empty)
+    char consumer_pad[RING_CACHE_LINE - 2 * sizeof(unsigned int)];
+
+    // Read-only after init
+    unsigned int mask;           // capacity - 1
+    int owns_memory;             // Allocated by sensor_ring_create
+    sensor_msg_t* slots;
+};
+
+static size_t ring_align_up(size_t size) {
+    return (size + ESKF_MEMORY_ALIGNMENT - 1) & ~(size_t)(ESKF_MEMORY_ALIGNMENT - 1);
+}
+
+size_t sensor_ring_required_size(int capacity) {
+    if (capacity < 2 || (capacity & (capacity - 1)) != 0) {
+        return 0;
+    }
+    return ring_align_up(sizeof(sensor_ring_t)) + (size_t)capacity * sizeof(sensor_msg_t);
+}
+
+sensor_ring_t* sensor_ring_init(void* memory, size_t size, int capacity) {
+    size_t required = sensor_ring_required_size(capacity);
+    if (!memory || required == 0 || size < required ||
+        ((size_t)memory & (ESKF_MEMORY_ALIGNMENT - 1)) != 0) {
+        return NULL;
+    }
+    sensor_ring_t* ring = (sensor_ring_t*)memory;
+    memset(ring, 0, sizeof(*ring));
+    ring->mask = (unsigned int)capacity - 1;
+    ring->slots = (sensor_msg_t*)((char*)memory + ring_align_up(sizeof(sensor_ring_t)));
+    return ring;
+}
+
+sensor_ring_t* sensor_ring_create(int capacity) {
+    size_t size = sensor_ring_required_size(capacity);
+    if (size == 0) return NULL;
+    void* memory = malloc(size);
+    if (!memory) return NULL;
+
+    sensor_ring_t* ring = sensor_ring_init(memory, size, capacity);
+    if (!ring) {
+        free(memory);
+        return NULL;
+    }
+    ring->owns_memory = 1;
+    return ring;
+}
+
+void sensor_ring_destroy(sensor_ring_t* ring) {
+    if (ring && ring->owns_memory) {
+        free(ring);
+    }
+}
+
+// ===== Producer =====
+
+// Free slots, looking at the consumer's tail only when the cached view is not enough
+static unsigned int ring_free(sensor_ring_t* ring, unsigned int wanted) {
+    unsigned int capacity = ring->mask + 1;
+    unsigned int free_slots = capacity - (ring->head - ring->cached_tail);
+    if (free_slots < wanted) {
+        ring->cached_tail = RING_LOAD_ACQUIRE(&ring->tail);
+        free_slots = capacity - (ring->head - ring->cached_tail);
+    }
+    return free_slots;
+}
+
+int sensor_ring_push_imu(sensor_ring_t* ring, const imu_data_t* imu) {
+    if (ring_free(ring, 1) == 0) {
+        ring->dropped++;
+        return 0;
+    }
+    sensor_msg_t* slot = &ring->slots[ring->head & ring->mask];
+    slot->type = SENSOR_MSG_IMU;
+    slot->data.imu = *imu;
+    RING_STORE_RELEASE(&ring->head, ring->head + 1);
+    return 1;
+}
+
+int sensor_ring_push_gps(sensor_ring_t* ring, const gps_data_t* gps) {
+    if (ring_free(ring, 1) == 0) {
+        ring->dropped++;
+        return 0;
+    }
+    sensor_msg_t* slot = &ring->slots[ring->head & ring->mask];
+    slot->type = SENSOR_MSG_GPS;
+    slot->data.gps = *gps;
+    RING_STORE_RELEASE(&ring->head, ring->head + 1);
+    return 1;
+}
+
+// Batches publish all their slots with one release store
+int sensor_ring_push_imu_batch(sensor_ring_t* ring, const imu_data_t* imu, int count) {
+    if (count <= 0) return 0;
+    unsigned int n = ring_free(ring, (unsigned int)count);
+    if (n > (unsigned int)count) n = (unsigned int)count;
+
+    unsigned int head = ring->head;
+    for (unsigned int i = 0; i < n; i++) {
+        sensor_msg_t* slot = &ring->slots[(head + i) & ring->mask];
+        slot->type = SENSOR_MSG_IMU;
+        slot->data.imu = imu[i];
+    }
+    ring->dropped += (unsigned int)count - n;
+    RING_STORE_RELEASE(&ring->head, head + n);
+    return (int)n;
+}
+
+int sensor_ring_push_gps_batch(sensor_ring_t* ring, const gps_data_t* gps, int count) {
+    if (count <= 0) return 0;
+    unsigned int n = ring_free(ring, (unsigned int)count);
+    if (n > (unsigned int)count) n = (unsigned int)count;
+
+    unsigned int head = ring->head;
+    for (unsigned int i = 0; i < n; i++) {
+        sensor_msg_t* slot = &ring->slots[(head + i) & ring->mask];
+        slot->type = SENSOR_MSG_GPS;
+        slot->data.gps = gps[i];
+    }
+    ring->dropped += (unsigned int)count - n;
+    RING_STORE_RELEASE(&ring->head, head + n);
+    return (int)n;
+}
+
+unsigned long long sensor_ring_dropped(const sensor_ring_t* ring) {
+    return RING_LOAD_RELAXED(&ring->dropped);
+}
+
+// ===== Consumer =====
+
+// Queued messages, looking at the producer's head only when the cached view is empty
+static unsigned int ring_available(sensor_ring_t* ring) {
+    unsigned int available = ring->cached_head - ring->tail;
+    if (available == 0) {
+        ring->cached_head = RING_LOAD_ACQUIRE(&ring->head);
+        available = ring->cached_head - ring->tail;
+    }
+    return available;
+}
+
+int sensor_ring_pop(sensor_ring_t* ring, sensor_msg_t* out, int max_count) {
+    if (max_count <= 0) return 0;
+    unsigned int n = ring_available(ring);
+    if (n > (unsigned int)max_count) n = (unsigned int)max_count;
+
+    unsigned int tail = ring->tail;
+    for (unsigned int i = 0; i < n; i++) {
+        out[i] = ring->slots[(tail + i) & ring->mask];
+    }
+    RING_STORE_RELEASE(&ring->tail, tail + n);
+    return (int)n;
+}
+
+int sensor_ring_count(const sensor_ring_t* ring) {
+    unsigned int tail = RING_LOAD_ACQUIRE(&ring->tail);
+    unsigned int head = RING_LOAD_ACQUIRE(&ring->head);
+    return (int)(head - tail);
+}
+
+int sensor_ring_capacity(const sensor_ring_t* ring) {
+    return (int)(ring->mask + 1);
+}
+
+// Fuse in place: slots go back to the producer only after processing
+int eskf_drain_ring(eskf_t* eskf, sensor_ring_t* ring, int max_count) {
+    if (max_count <= 0) return 0;
+    unsigned int n = ring_available(ring);
+    if (n > (unsigned int)max_count) n = (unsigned int)max_count;
+
+    unsigned int tail = ring->tail;
+    for (unsigned int i = 0; i < n; i++) {
+        const sensor_msg_t* msg = &ring->slots[(tail + i) & ring->mask];
+        if (msg->type == SENSOR_MSG_IMU) {
+            eskf_process_imu(eskf, &msg->data.imu);
+        } else if (msg->type == SENSOR_MSG_GPS) {
+            eskf_process_gps(eskf, &msg->data.gps);
+        }
+    }
+    RING_STORE_RELEASE(&ring->tail, tail + n);
+    return (int)n;
+}
+
+static void ring_idle(int sleep_us) {
+#if defined(_WIN32)
+    Sleep(sleep_us >= 1000 ? (DWORD)(sleep_us / 1000) : 0);
+#elif defined(RING_POSIX_IDLE)
+    if (sleep_us > 0) {
+        struct timespec ts;
+        ts.tv_sec = sleep_us / 1000000;
+        ts.tv_nsec = (long)(sleep_us % 1000000) * 1000L;
+        nanosleep(&ts, NULL);
+    } else {
+        sched_yield();
+    }
+#else
+    (void)sleep_us;  // Bare metal: keep polling
+#endif
+}
+
+long long eskf_ring_consume(eskf_t* eskf, sensor_ring_t* ring, const volatile int* stop, int idle_sleep_us) {
+    long long processed = 0;
+    for (;;) {
+        int n = eskf_drain_ring(eskf, ring, SENSOR_RING_DRAIN_BATCH);
+        processed += n;
+        if (n > 0) continue;
+
+        // Stop only once everything pushed before the stop request is fused
+        if (*stop) {
+            RING_ACQUIRE_FENCE();
+            while ((n = eskf_drain_ring(eskf, ring, SENSOR_RING_DRAIN_BATCH)) > 0) {
+                processed += n;
+            }
+            break;
+        }
+        ring_idle(idle_sleep_us);
+    }
+    return processed;
+}
@@ -0,0 +1,70 @@
+#ifndef RINGBUF_H
+#define RINGBUF_H
+
+#include "eskf.h"
+#include <stddef.h>
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+// Lock-free single-producer / single-consumer queue of sensor messages.
+// One thread (sensor I/O, or an interrupt handler) pushes, one thread (the
+// filter loop) drains; neither ever blocks or takes a lock. Indices are
+// handed over with acquire/release ordering, and the producer and consumer
+// indices live on separate cache lines.
+
+// Message types
+#define SENSOR_MSG_IMU 1
+#define SENSOR_MSG_GPS 2
+
+#define SENSOR_RING_DRAIN_BATCH 64  // Messages fused per slot release in eskf_ring_consume
+
+typedef struct {
+    int type;  // SENSOR_MSG_IMU or SENSOR_MSG_GPS
+    union {
+        imu_data_t imu;
+        gps_data_t gps;
+    } data;
+} sensor_msg_t;
+
+typedef struct sensor_ring sensor_ring_t;
+
+// Place a ring into caller-provided memory (ESKF_MEMORY_ALIGNMENT aligned,
+// sensor_ring_required_size(capacity) bytes). capacity must be a power of
+// two >= 2; otherwise the size is 0 and init returns NULL.
+size_t sensor_ring_required_size(int capacity);
+sensor_ring_t* sensor_ring_init(void* memory, size_t size, int capacity);
+sensor_ring_t* sensor_ring_create(int capacity);
+void sensor_ring_destroy(sensor_ring_t* ring);  // No-op on rings placed with sensor_ring_init
+
+// Producer side. Returns 1 / the number of messages queued; messages that
+// do not fit are rejected (counted in sensor_ring_dropped), never overwritten.
+int sensor_ring_push_imu(sensor_ring_t* ring, const imu_data_t* imu);
+int sensor_ring_push_gps(sensor_ring_t* ring, const gps_data_t* gps);
+int sensor_ring_push_imu_batch(sensor_ring_t* ring, const imu_data_t* imu, int count);
+int sensor_ring_push_gps_batch(sensor_ring_t* ring, const gps_data_t* gps, int count);
+unsigned long long sensor_ring_dropped(const sensor_ring_t* ring);
+
+// Consumer side
+int sensor_ring_pop(sensor_ring_t* ring, sensor_msg_t* out, int max_count);
+
+// Either side (a snapshot: the other side may move on concurrently)
+int sensor_ring_count(const sensor_ring_t* ring);
+int sensor_ring_capacity(const sensor_ring_t* ring);
+
+// Filter thread: fuse up to max_count queued messages in order (IMU
+// prediction / GPS update) straight from the ring slots. Returns the
+// number processed; call it from an RTOS main loop or timer task.
+int eskf_drain_ring(eskf_t* eskf, sensor_ring_t* ring, int max_count);
+
+// Hosted systems: drain until *stop becomes non-zero and the ring is
+// empty, sleeping idle_sleep_us (0: yield) whenever it runs dry. Returns
+// the number of messages processed.
+long long eskf_ring_consume(eskf_t* eskf, sensor_ring_t* ring, const volatile int* stop, int idle_sleep_us);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif // RINGBUF_H
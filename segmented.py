@@ -0,0 +1,288 @@
+"""Parallel segmented processing of long sensor logs.
+
+The log is cut into segments at high-quality GPS epochs (>= 8 satellites,
+the threshold eskf.c uses for trusting GPS over the railway map). Every
+segment gets its own filter, warm-started on a short overlap window before
+its first sample, and all segments run at once with eskf_process_many
+(one OpenMP thread per segment, GIL released). The per-segment states are
+stitched into one trajectory, and each join is reported with the jump
+between the previous segment's and the new segment's estimate there.
+
+A fresh filter does not necessarily converge to the sequential estimate
+within the overlap (on data.csv the joins are 100 m to 1.6 km apart after
+30 s). By default the raw join jumps are reported and the joins outside
+--max-join-jump / --max-velocity-jump are counted. With --refine, those
+joins are re-run from the previous segment's end snapshot until every join
+is within tolerance. That always terminates, at worst after one pass per
+segment with the sequential result exactly, but then the segments run one
+after another: on data.csv, --segments 4 --refine is slower than a single
+sequential pass.
+
+Usage:
+    python segmented.py --direction up --segments 8 --overlap 30 --verify
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import eskf_ext
+from eskf_ext import Eskf, process_many
+from replay import load_sensor_log, load_rail_file
+
+GOOD_SATELLITES = 8
+EARTH_RADIUS = 6378137.0
+
+
+def plan_segments(imu, gps, segments, overlap, stride):
+    """Split points as (warm_start, start, end) IMU index triples.
+
+    Joins are placed at the first good GPS epoch after each 1/segments of
+    the log, on the first IMU sample after that fix has been applied, and
+    rounded up to the state stride so every segment records on one grid.
+    """
+    t = imu['timestamp']
+    good = gps['timestamp'][gps['satellites'] >= GOOD_SATELLITES]
+
+    joins = [0]
+    for k in range(1, segments):
+        target = t[0] + k * (t[-1] - t[0]) / segments
+        after = good[good >= target]
+        if len(after) == 0:
+            break
+        j = np.searchsorted(t, after[0], side='right')
+        j = -(-j // stride) * stride
+        if joins[-1] < j < len(t):
+            joins.append(int(j))
+
+    plan = []
+    for k, start in enumerate(joins):
+        end = joins[k + 1] if k + 1 < len(joins) else len(t)
+        warm = 0
+        if start > 0:
+            warm = np.searchsorted(t, t[start] - overlap, side='left') // stride * stride
+        plan.append((int(warm), start, end))
+    return plan
+
+
+def run_segments(imu, gps, plan, make_filter, stride=100, num_threads=0, snapshots=None):
+    """Process all segments in parallel.
+
+    snapshots: optional per-segment filter snapshot (None entries allowed).
+    A segment with a snapshot is restored from it and starts at its first
+    sample instead of warming up on the overlap window.
+
+    Returns (states, end_snapshots). states holds the STATE_DTYPE array
+    recorded by each segment's filter, one entry per stride samples from
+    where it started, plus the state after one sample past its end so the
+    join with the next segment can be compared. end_snapshots holds each
+    filter's snapshot at its end sample, i.e. exactly what the next
+    segment needs to continue the sequential pass.
+    """
+    if snapshots is None:
+        snapshots = [None] * len(plan)
+    filters, imu_arrays, gps_arrays = [], [], []
+    gps_t = gps['timestamp']
+    imu_t = imu['timestamp']
+    for (warm, start, end), snapshot in zip(plan, snapshots):
+        eskf = make_filter()
+        first = warm
+        if snapshot is not None:
+            if not eskf.restore_state(snapshot):
+                raise RuntimeError("Checkpoint rejected by the filter")
+            first = start
+        # Fixes older than imu[end] belong to this segment (eskf_process_many order)
+        g0 = 0 if first == 0 else np.searchsorted(gps_t, imu_t[first], side='left')
+        g1 = np.searchsorted(gps_t, imu_t[end], side='left') if end < len(imu) else len(gps)
+        filters.append(eskf)
+        imu_arrays.append(imu[first:end])
+        gps_arrays.append(gps[g0:g1])
+
+    _, states = process_many(filters, imu_arrays, gps_arrays, num_threads,
+                             record_states=True, state_stride=stride)
+
+    end_snapshots = []
+    for k, ((_, _, end), eskf) in enumerate(zip(plan, filters)):
+        end_snapshots.append(eskf.save_state())
+        # One sample past the end for the join report
+        eskf.process_imu_array(imu[end:end + 1])
+        states[k] = np.append(states[k], eskf.get_state_array()[np.newaxis])
+        eskf.close()
+    return states, end_snapshots
+
+
+def refine_joins(imu, gps, plan, make_filter, stride, states, end_snapshots, max_position_jump=1.0,
+                 max_velocity_jump=0.1, num_threads=0):
+    """Re-run segments whose join is out of tolerance from their predecessor's end state.
+
+    Every pass restores each offending segment from the previous segment's
+    end snapshot (as of the last pass) and runs all of them in parallel.
+    Segment k is exact after at most k passes, so this stops after
+    len(plan) - 1 passes even if the filter never forgets its start.
+
+    Returns (plan, states, end_snapshots, joins, passes); re-run segments
+    appear in the returned plan with no warm-up window.
+    """
+    timestamps = imu['timestamp']
+    plan = list(plan)
+    states = list(states)
+    end_snapshots = list(end_snapshots)
+    passes = 0
+    while True:
+        _, _, joins = stitch(plan, states, stride, timestamps)
+        if not len(joins):
+            return plan, states, end_snapshots, joins, passes
+        bad = joins.index[~join_acceptable(joins, max_position_jump, max_velocity_jump)]
+        if not len(bad):
+            return plan, states, end_snapshots, joins, passes
+        rerun = [int(joins.at[i, 'segment']) for i in bad]
+        sub_states, sub_snapshots = run_segments(imu, gps, [plan[k] for k in rerun], make_filter, stride,
+                                                 num_threads, [end_snapshots[k - 1] for k in rerun])
+        for k, recorded, snapshot in zip(rerun, sub_states, sub_snapshots):
+            start = plan[k][1]
+            plan[k] = (start, start, plan[k][2])
+            states[k] = recorded
+            end_snapshots[k] = snapshot
+        passes += 1
+
+
+def join_acceptable(joins, max_position_jump, max_velocity_jump):
+    """Boolean Series: join within tolerance (or neither side initialized yet)."""
+    position_ok = joins['position_jump_m'] <= max_position_jump
+    not_started = ~joins['initialized'] & ~joins['previous_initialized']
+    return (position_ok & (joins['velocity_jump_mps'] <= max_velocity_jump)) | not_started
+
+
+def ground_distance(lat1, lon1, lat2, lon2):
+    """Equirectangular distance in metres (short baselines)."""
+    dn = np.radians(lat2 - lat1) * EARTH_RADIUS
+    de = np.radians(lon2 - lon1) * EARTH_RADIUS * np.cos(np.radians(lat1))
+    return np.hypot(dn, de)
+
+
+def stitch(plan, states, stride, timestamps):
+    """One trajectory on the stride grid plus a report row per join."""
+    grid_count = -(-plan[-1][2] // stride)
+    trajectory = np.zeros(grid_count, dtype=states[0].dtype)
+    segment_ids = np.zeros(grid_count, dtype=np.int32)
+
+    joins = []
+    for k, ((warm, start, end), recorded) in enumerate(zip(plan, states)):
+        first, last = start // stride, -(-end // stride)
+        offset = warm // stride
+        trajectory[first:last] = recorded[first - offset:last - offset]
+        segment_ids[first:last] = k
+
+        if k == 0:
+            continue
+        # Previous segment ran one sample past its end: compare at the join
+        prev_warm = plan[k - 1][0] // stride
+        before = states[k - 1][first - prev_warm]
+        after = recorded[first - offset]
+        initialized = after['lat'] != 0.0
+        previous_initialized = before['lat'] != 0.0
+        yaw_jump = (np.degrees(after['yaw'] - before['yaw']) + 180.0) % 360.0 - 180.0
+        joins.append({
+            'segment': k,
+            'timestamp': after['timestamp'],
+            'warm_up_s': timestamps[start] - timestamps[warm],
+            'initialized': bool(initialized),
+            'previous_initialized': bool(previous_initialized),
+            'position_jump_m': ground_distance(before['lat'], before['lon'],
+                                               after['lat'], after['lon']) if initialized else np.nan,
+            'velocity_jump_mps': float(np.linalg.norm(after['G_v_I'] - before['G_v_I'])),
+            'yaw_jump_deg': float(yaw_jump),
+        })
+    return trajectory, segment_ids, pd.DataFrame(joins)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel segmented ESKF processing')
+    parser.add_argument('--direction', choices=['up', 'down'], default='up',
+                        help='Railway direction: up (상행) or down (하행)')
+    parser.add_argument('--log', default='data/data.csv', help='Sensor log (data.csv format)')
+    parser.add_argument('--segments', type=int, default=os.cpu_count() or 1, help='Number of segments')
+    parser.add_argument('--overlap', type=float, default=30.0, help='Warm-start window before each join (s)')
+    parser.add_argument('--max-join-jump', type=float, default=1.0,
+                        help='Largest accepted position jump at a join (m)')
+    parser.add_argument('--max-velocity-jump', type=float, default=0.1,
+                        help='Largest accepted velocity jump at a join (m/s)')
+    parser.add_argument('--refine', action='store_true',
+                        help="Re-run joins outside the tolerance from the previous segment's end state "
+                             "(exact, but may chain the segments)")
+    parser.add_argument('--stride', type=int, default=100, help='Output every n-th IMU sample')
+    parser.add_argument('--threads', type=int, default=0, help='OpenMP threads (0: all cores)')
+    parser.add_argument('--output', default=None, help='Write the stitched trajectory to this CSV')
+    parser.add_argument('--verify', action='store_true',
+                        help='Also run one sequential pass and compare')
+    args = parser.parse_args()
+
+    if eskf_ext.lib is None:
+        print("ESKF extension module not found. Build it first: python eskf_cffi_build.py")
+        exit(1)
+
+    imu, gps = load_sensor_log(args.log)
+    rail_lat, rail_lon = load_rail_file(args.direction)
+    rail_nodes = eskf_ext.rail_node_array(rail_lat, rail_lon)
+
+    def make_filter():
+        eskf = Eskf()
+        eskf.share_rail_nodes(rail_nodes)
+        return eskf
+
+    plan = plan_segments(imu, gps, args.segments, args.overlap, args.stride)
+    print(f"Log: {len(imu)} IMU samples, {len(gps)} GPS fixes, "
+          f"{imu['timestamp'][-1] - imu['timestamp'][0]:.0f} s -> {len(plan)} segments")
+
+    start = time.perf_counter()
+    states, end_snapshots = run_segments(imu, gps, plan, make_filter, args.stride, args.threads)
+    parallel_time = time.perf_counter() - start
+    trajectory, segment_ids, joins = stitch(plan, states, args.stride, imu['timestamp'])
+    print(f"Segmented pass: {parallel_time * 1000:.1f} ms")
+    if len(joins):
+        print("\nJoins after warm-up:")
+        print(joins.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+        outside = int((~join_acceptable(joins, args.max_join_jump, args.max_velocity_jump)).sum())
+        print(f"  {outside} of {len(joins)} joins outside the tolerance "
+              f"({args.max_join_jump:g} m, {args.max_velocity_jump:g} m/s)")
+
+    if args.refine:
+        start = time.perf_counter()
+        plan, states, end_snapshots, joins, passes = refine_joins(
+            imu, gps, plan, make_filter, args.stride, states, end_snapshots,
+            args.max_join_jump, args.max_velocity_jump, args.threads)
+        refine_time = time.perf_counter() - start
+        parallel_time += refine_time
+        trajectory, segment_ids, joins = stitch(plan, states, args.stride, imu['timestamp'])
+        print(f"\nRefinement: {passes} pass(es) from the previous segment's end state, {refine_time * 1000:.1f} ms")
+        if len(joins):
+            print(joins.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+        if passes and passes >= len(plan) - 1:
+            print("  Warm-up did not converge: the segments were chained like a sequential pass")
+
+    if args.verify:
+        start = time.perf_counter()
+        reference = run_segments(imu, gps, [(0, 0, len(imu))], make_filter, args.stride, 1)[0][0]
+        sequential_time = time.perf_counter() - start
+        reference = reference[:len(trajectory)]
+        valid = (trajectory['lat'] != 0.0) & (reference['lat'] != 0.0)
+        error = ground_distance(reference['lat'][valid], reference['lon'][valid],
+                                trajectory['lat'][valid], trajectory['lon'][valid])
+        print(f"\nSequential pass: {sequential_time * 1000:.1f} ms "
+              f"(speedup {sequential_time / parallel_time:.2f}x)")
+        for k in range(len(plan)):
+            in_segment = segment_ids[valid] == k
+            if in_segment.any():
+                print(f"  Segment {k}: max deviation from sequential {error[in_segment].max():.3f} m")
+
+    if args.output:
+        pd.DataFrame({
+            'timestamp': trajectory['timestamp'],
+            'eskf_lat': trajectory['lat'],
+            'eskf_lon': trajectory['lon'],
+            'eskf_alt': trajectory['alt'],
+            'segment': segment_ids,
+        }).to_csv(args.output, index=False)
+        print(f"\nStitched trajectory saved to {args.output}")
@@ -0,0 +1,164 @@
+"""Sensor stand-in for ingest_server.py: replays a log over TCP or UDP.
+
+Sends the IMU samples and GPS fixes of a data.csv log as binary frames,
+paced to the log timestamps (or N times faster, or as fast as the server
+accepts them), and optionally subscribes for the fused poses to measure
+end-to-end latency (sensor send -> pose received) on the same host.
+
+Usage:
+    python sensor_client.py --port 5600 --speed 1 --subscribe
+    python sensor_client.py --transport udp --speed 10 --duration 60 --subscribe --output e2e.json
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from ingest_server import (HEADER, PAYLOADS, MSG_IMU, MSG_GPS, MSG_SUBSCRIBE, MSG_SEQ, MSG_POSE, FORMAT_BINARY,
+                           SEQ_MODULUS, encode_frame)
+from replay import load_sensor_log
+
+
+def log_messages(imu, gps):
+    """(timestamp, type, values without send_ns) in the order the filter expects.
+
+    GPS fixes go before the first IMU sample that is newer than them, as in
+    eskf_process_many.
+    """
+    variance = gps['cov'][:, 0, 0]
+    gps_before = np.searchsorted(gps['timestamp'], imu['timestamp'], side='left')
+    messages = []
+    next_gps = 0
+    for i in range(len(imu)):
+        while next_gps < gps_before[i]:
+            g = gps[next_gps]
+            messages.append((g['timestamp'], MSG_GPS, (float(g['timestamp']), float(g['lat']), float(g['lon']),
+                                                        float(g['alt']), int(g['satellites']),
+                                                        float(variance[next_gps]))))
+            next_gps += 1
+        messages.append((imu['timestamp'][i], MSG_IMU, (float(imu['timestamp'][i]), *imu['acc'][i].tolist(),
+                                                        *imu['gyro'][i].tolist())))
+    for g in gps[next_gps:]:
+        messages.append((g['timestamp'], MSG_GPS, (float(g['timestamp']), float(g['lat']), float(g['lon']),
+                                                    float(g['alt']), int(g['satellites']), float(g['cov'][0, 0]))))
+    return messages
+
+
+class UdpSender(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+
+async def send_log(messages, host, port, transport_name, speed):
+    """Send every message; returns (sent count, seconds)."""
+    loop = asyncio.get_running_loop()
+    if transport_name == 'tcp':
+        _, writer = await asyncio.open_connection(host, port)
+        send = writer.write
+    else:
+        udp, _ = await loop.create_datagram_endpoint(UdpSender, remote_addr=(host, port))
+        send = udp.sendto
+
+    t0 = messages[0][0]
+    start = time.monotonic()
+    for k, (timestamp, message_type, values) in enumerate(messages):
+        if speed > 0:
+            delay = start + (timestamp - t0) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        frame = encode_frame(message_type, time.monotonic_ns(), *values)
+        if transport_name == 'tcp':
+            send(frame)
+            await writer.drain()  # Server backpressure throttles the replay here
+        else:
+            # Numbered datagrams let the server count the ones the kernel dropped
+            send(encode_frame(MSG_SEQ, k % SEQ_MODULUS) + frame)
+            if speed <= 0 and k % 64 == 0:
+                await asyncio.sleep(0)
+    elapsed = time.monotonic() - start
+
+    if transport_name == 'tcp':
+        writer.close()
+        await writer.wait_closed()
+    else:
+        udp.close()
+    return len(messages), elapsed
+
+
+async def receive_poses(host, port, every, latencies, ready):
+    """Subscribe and record send -> receive latency (s) of every pose."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_frame(MSG_SUBSCRIBE, every, FORMAT_BINARY))
+    await writer.drain()
+    ready.set()
+    pose = PAYLOADS[MSG_POSE]
+    try:
+        while True:
+            _, message_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+            values = pose.unpack(await reader.readexactly(length))
+            if message_type == MSG_POSE:
+                latencies.append((time.monotonic_ns() - values[0]) * 1e-9)
+    except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main(args):
+    imu, gps = load_sensor_log(args.log)
+    if args.duration:
+        imu = imu[imu['timestamp'] < imu['timestamp'][0] + args.duration]
+        gps = gps[gps['timestamp'] < imu['timestamp'][-1]]
+    messages = log_messages(imu, gps)
+
+    latencies = []
+    receiver = None
+    if args.subscribe:
+        ready = asyncio.Event()
+        receiver = asyncio.create_task(receive_poses(args.host, args.port, args.every, latencies, ready))
+        await ready.wait()
+
+    pace = f"{args.speed:g}x" if args.speed > 0 else 'unpaced'
+    print(f"Sending {len(imu)} IMU + {len(gps)} GPS messages over {args.transport.upper()} at {pace}")
+    sent, elapsed = await send_log(messages, args.host, args.port, args.transport, args.speed)
+    print(f"Sent {sent} messages in {elapsed:.2f} s ({sent / elapsed:.0f} msg/s)")
+
+    report = {'sent': sent, 'seconds': elapsed, 'transport': args.transport, 'speed': args.speed}
+    if receiver is not None:
+        await asyncio.sleep(args.linger)  # Poses still in flight
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+        report['poses_received'] = len(latencies)
+        if latencies:
+            ms = np.asarray(latencies) * 1e3
+            report['e2e_latency_ms'] = {q: float(np.percentile(ms, float(q[1:]))) for q in ('p50', 'p90', 'p99')}
+            report['e2e_latency_ms']['max'] = float(ms.max())
+            print(f"Received {len(latencies)} poses, end-to-end latency "
+                  f"p50 {report['e2e_latency_ms']['p50']:.2f} ms, p90 {report['e2e_latency_ms']['p90']:.2f} ms, "
+                  f"p99 {report['e2e_latency_ms']['p99']:.2f} ms, max {report['e2e_latency_ms']['max']:.2f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a sensor log into ingest_server.py')
+    parser.add_argument('--log', default='data/data.csv', help='Sensor log (data.csv format)')
+    parser.add_argument('--host', default='127.0.0.1', help='Ingest server address')
+    parser.add_argument('--port', type=int, default=5600, help='Ingest server port')
+    parser.add_argument('--transport', choices=['tcp', 'udp'], default='tcp', help='Sensor transport')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed-up (1: real time, 0: as fast as the server accepts)')
+    parser.add_argument('--duration', type=float, default=None, help='Send at most this much log time (s)')
+    parser.add_argument('--subscribe', action='store_true', help='Receive poses and measure end-to-end latency')
+    parser.add_argument('--every', type=int, default=1, help='Subscribe to every n-th pose')
+    parser.add_argument('--linger', type=float, default=0.5, help='Wait for late poses after sending (s)')
+    parser.add_argument('--output', default=None, help='Write the JSON report here')
+    asyncio.run(main(parser.parse_args()))
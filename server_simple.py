@@ -1,11 +1,15 @@
-from flask import Flask, render_template_string, jsonify, request
+from flask import Flask, render_template_string, jsonify, request, g, Response
 import subprocess
 import os
 import json
+import time
+import threading
 import pandas as pd
 import numpy as np
 import math
 
+from metrics import Registry, CONTENT_TYPE, SIZE_BUCKETS
+
 def safe_float(value, default=0.0):
     """Convert value to float, handling NaN values"""
     try:
@@ -46,6 +50,123 @@ def clean_path_data(path_list):
 
 app = Flask(__name__)
 
+# Metrics (GET /metrics, Prometheus text format)
+metrics = Registry()
+http_requests = metrics.counter('eskf_http_requests_total', 'HTTP requests by route, method and status',
+                                ['route', 'method', 'status'])
+http_latency = metrics.histogram('eskf_http_request_duration_seconds', 'Request handling time',
+                                 ['route'])
+http_response_bytes = metrics.histogram('eskf_http_response_bytes', 'Response body size',
+                                        ['route'], buckets=SIZE_BUCKETS)
+http_in_flight = metrics.gauge('eskf_http_requests_in_flight', 'Requests being handled')
+filter_runs = metrics.counter('eskf_filter_runs_total', 'Filter runs by engine and outcome',
+                              ['engine', 'outcome'])
+filter_subprocess = metrics.histogram('eskf_filter_subprocess_seconds', 'Filter script wall time',
+                                      ['engine'])
+filter_samples = metrics.counter('eskf_filter_samples_total', 'IMU samples processed', ['engine'])
+filter_throughput = metrics.gauge('eskf_filter_samples_per_second',
+                                  'IMU samples/s of the last run, over the time spent in the filter calls',
+                                  ['engine'])
+realtime_active = metrics.gauge('eskf_realtime_sessions_active', 'Active real-time debug sessions')
+realtime_frames = metrics.gauge('eskf_realtime_frames', 'Frames of the real-time session', ['state'])
+cache_requests = metrics.counter('eskf_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+cache_hit_ratio = metrics.gauge('eskf_cache_hit_ratio', 'Cache hits / lookups since start', ['cache'])
+
+
+def collect_live_metrics():
+    """Refresh gauges that mirror server state (run on every scrape)."""
+    realtime_active.set(1 if realtime_session['active'] else 0)
+    realtime_frames.set(realtime_session['total_frames'], state='total')
+    realtime_frames.set(realtime_session['current_frame'], state='played')
+    for cache in ('railway',):
+        hits = cache_requests.value(cache=cache, result='hit')
+        lookups = hits + cache_requests.value(cache=cache, result='miss')
+        cache_hit_ratio.set(hits / lookups if lookups else 0.0, cache=cache)
+
+
+metrics.add_collector(collect_live_metrics)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    http_in_flight.inc()
+
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_latency.observe(time.perf_counter() - g.request_start, route=route)
+    http_requests.inc(route=route, method=request.method, status=str(response.status_code))
+    if not response.is_streamed:
+        http_response_bytes.observe(response.calculate_content_length() or 0, route=route)
+    return response
+
+
+@app.teardown_request
+def finish_request(exc):
+    http_in_flight.dec()  # Also runs when a handler raised
+
+
+def run_filter_script(engine, command):
+    """Run a filter script, recording its wall time and IMU throughput.
+
+    Throughput is taken from the "Filter time" the script reports, so
+    interpreter start-up, imports and CSV parsing are not counted.
+    """
+    with filter_subprocess.time(engine=engine):
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=60)
+        except subprocess.TimeoutExpired:
+            filter_runs.inc(engine=engine, outcome='timeout')
+            raise
+    imu_count, filter_time = None, None
+    for line in result.stdout.split('\n'):
+        if 'IMU updates:' in line:
+            imu_count = safe_int(line.split(':')[1].strip())
+            filter_samples.inc(imu_count, engine=engine)
+        elif 'Filter time:' in line:
+            filter_time = safe_float(line.split(':')[1].strip().split()[0])
+    if imu_count is not None and filter_time:
+        filter_throughput.set(imu_count / filter_time, engine=engine)
+    filter_runs.inc(engine=engine, outcome='ok' if result.returncode == 0 else 'error')
+    return result
+
+
+# Railway nodes per file, reloaded only when the file changes
+_railway_cache = {}
+_railway_cache_lock = threading.Lock()
+
+
+def load_railway_path(direction):
+    """((lat, lon), ...) of the railway for a direction (cached) and the file used.
+
+    The cached tuple is shared between requests, so it is immutable.
+    """
+    railway_file = f'data/railway_nodes_{direction}.csv'
+    if not os.path.exists(railway_file):
+        railway_file = 'data/railway_nodes.csv'  # fallback
+    if not os.path.exists(railway_file):
+        return (), None
+
+    stat = os.stat(railway_file)
+    key = (railway_file, stat.st_mtime_ns, stat.st_size)
+    with _railway_cache_lock:
+        nodes = _railway_cache.get(railway_file)
+        if nodes is not None and nodes[0] == key:
+            cache_requests.inc(cache='railway', result='hit')
+            return nodes[1], railway_file
+
+    cache_requests.inc(cache='railway', result='miss')
+    rail_df = pd.read_csv(railway_file)
+    lon_column = 'lng' if 'lng' in rail_df.columns else 'lon'
+    path = ()
+    if lon_column in rail_df.columns:
+        path = tuple(map(tuple, rail_df[['lat', lon_column]].values.tolist()))
+    with _railway_cache_lock:
+        _railway_cache[railway_file] = (key, path)
+    return path, railway_file
+
 # Real-time Debug Session Management
 realtime_session = {
     'active': False,
@@ -1489,13 +1610,14 @@ def run_python():
         import time
         start_time = time.time()
 
-        # Run Python script
-        result = subprocess.run(
-            ['python', 'python_version/map2.py'],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        # Get direction from request
+        direction = 'up'  # default
+        if request.is_json:
+            data = request.get_json()
+            direction = data.get('direction', 'up')
+
+        # Run the NumPy ESKF (python_version/eskf_batch.py) with direction parameter
+        result = run_filter_script('python', ['python', 'python_version/map2.py', '--direction', direction])
 
         process_time = time.time() - start_time
 
@@ -1510,11 +1632,15 @@ def run_python():
             elif 'IMU updates:' in line:
                 imu_count = int(line.split(':')[1].strip())
 
-        # Read output path if created
-        path = []
-        if os.path.exists('eskf_rail_matched.html'):
-            # Extract path data from HTML if needed
-            pass
+        # Read output CSV (same columns as the C version)
+        paths = {}
+        if os.path.exists('eskf_python_output.csv'):
+            df = pd.read_csv('eskf_python_output.csv')
+            paths['eskf'] = [[row['eskf_lat'], row['eskf_lon']] for _, row in df.iterrows()
+                            if row['eskf_lat'] != 0 and row['eskf_lon'] != 0]
+            paths['gps_raw'] = [[row['gps_raw_lat'], row['gps_raw_lon']] for _, row in df.iterrows()
+                              if row['gps_raw_lat'] != 0 and row['gps_raw_lon'] != 0]
+        path = paths.get('eskf', [])
 
         return jsonify({
             'success': True,
@@ -1523,7 +1649,8 @@ def run_python():
             'imu_count': safe_int(imu_count),
             'rail_count': 0,
             'process_time': safe_float(process_time),
-            'path': clean_path_data(path)
+            'path': clean_path_data(path),
+            'paths': {k: clean_path_data(v) for k, v in paths.items()}
         })
 
     except Exception as e:
@@ -1543,12 +1670,7 @@ def run_c():
             direction = data.get('direction', 'up')
 
         # Run the Python test that calls C library with direction parameter
-        result = subprocess.run(
-            ['python', 'test_c_python.py', '--direction', direction],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        result = run_filter_script('c', ['python', 'test_c_python.py', '--direction', direction])
 
         process_time = time.time() - start_time
 
@@ -1597,25 +1719,14 @@ def run_c():
                 if len(loss_rows) > 0:
                     paths['gps_loss'] = [[row['eskf_lat'], row['eskf_lon']] for _, row in loss_rows.iterrows()]
 
-        # Railway Path - direction에 따라 읽기
-        rail_nodes = []
-        railway_file = f'data/railway_nodes_{direction}.csv'
-        if not os.path.exists(railway_file):
-            railway_file = 'data/railway_nodes.csv'  # fallback
-
-        if os.path.exists(railway_file):
-            try:
-                rail_df = pd.read_csv(railway_file)
-                if 'lat' in rail_df.columns and 'lng' in rail_df.columns:
-                    rail_nodes = [[row['lat'], row['lng']] for _, row in rail_df.iterrows()]
-                    paths['rail'] = rail_nodes
-                elif 'lat' in rail_df.columns and 'lon' in rail_df.columns:
-                    rail_nodes = [[row['lat'], row['lon']] for _, row in rail_df.iterrows()]
-                    paths['rail'] = rail_nodes
+        # Railway Path - direction에 따라 읽기 (파일이 바뀔 때만 다시 읽음)
+        try:
+            rail_nodes, railway_file = load_railway_path(direction)
+            if rail_nodes:
+                paths['rail'] = rail_nodes
                 print(f"Loaded railway visualization from {railway_file}")
-            except Exception as e:
-                print(f"Warning: Could not load railway data: {e}")
-
+        except Exception as e:
+            print(f"Warning: Could not load railway data: {e}")
 
         # 호환성을 위한 기본 path (ESKF)
         path = paths.get('eskf', [])
@@ -1658,12 +1769,7 @@ def start_realtime():
         }
 
         # Run C version first to get processed data with direction
-        result = subprocess.run(
-            ['python', 'test_c_python.py', '--direction', direction],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        result = run_filter_script('c', ['python', 'test_c_python.py', '--direction', direction])
 
         if result.returncode != 0:
             return jsonify({'success': False, 'error': 'C version failed to run'})
@@ -1782,6 +1888,11 @@ def realtime_reset():
 
     return jsonify({'success': True, 'message': 'Session reset'})
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("ESKF Test Server (Simple Version)")
@@ -1792,6 +1903,7 @@ if __name__ == '__main__':
     print("   - Run C version")
     print("   - Multi-path visualization")
     print("   - Interactive legend")
+    print("   - Prometheus metrics: http://localhost:5000/metrics")
     print("\nCtrl+C to stop")
     print("="*60 + "\n")
 
@@ -0,0 +1,328 @@
+"""Synthetic IMU/GPS logs along the railway maps.
+
+Generates a ground-truth train trajectory along data/railway_nodes_*.csv
+(trapezoidal speed profile with station stops, any number of one-way
+trips) and synthesizes from it, fully vectorized with NumPy:
+  - IMU specific force and angular rate at any rate, with constant
+    turn-on bias, bias random walk, white noise and optional ride
+    vibration growing with speed. Body frame: x forward, y left, z up,
+    level track (accel_z = +1 g at rest).
+  - GPS fixes at a lower rate with a per-fix satellite count, noise
+    growing with fewer satellites, and tunnel dropouts.
+The log uses the data.csv schema that test_c_python.py reads (accel in g,
+gyro in rad/s, gps_lat/gps_lng/satellites only on fix rows); the ground
+truth can be written alongside it.
+
+Usage:
+    python simulate.py --direction up --imu-rate 400 --laps 10 --output data/sim.csv --truth data/sim_truth.csv
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from replay import load_rail_file
+
+GRAVITY = 9.81
+EARTH_RADIUS = 6378137.0
+
+
+def route_geometry(rail_lat, rail_lon, smoothing=20.0, step=1.0):
+    """Smoothed route on a regular arc-length grid (local ENU, metres).
+
+    The polyline is resampled every ``step`` metres and smoothed with a
+    Gaussian of ``smoothing`` metres so heading and curvature are
+    continuous through the nodes.
+    """
+    rail_lat = np.asarray(rail_lat, dtype=np.float64)
+    rail_lon = np.asarray(rail_lon, dtype=np.float64)
+    origin = (rail_lat[0], rail_lon[0])
+    cos_lat = np.cos(np.radians(origin[0]))
+    east = np.radians(rail_lon - origin[1]) * EARTH_RADIUS * cos_lat
+    north = np.radians(rail_lat - origin[0]) * EARTH_RADIUS
+
+    # Drop repeated nodes, resample by arc length
+    keep = np.concatenate([[True], np.hypot(np.diff(east), np.diff(north)) > 1e-3])
+    east, north = east[keep], north[keep]
+    s = np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(east), np.diff(north)))])
+    grid = np.arange(0.0, s[-1], step)
+    east, north = np.interp(grid, s, east), np.interp(grid, s, north)
+
+    if smoothing > 0:
+        half = int(3 * smoothing / step)
+        kernel = np.exp(-0.5 * (np.arange(-half, half + 1) * step / smoothing) ** 2)
+        kernel /= kernel.sum()
+        east = np.convolve(np.pad(east, half, mode='edge'), kernel, mode='valid')
+        north = np.convolve(np.pad(north, half, mode='edge'), kernel, mode='valid')
+
+    # Arc length of the smoothed curve; heading counter-clockwise from east
+    s = np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(east), np.diff(north)))])
+    heading = np.unwrap(np.arctan2(np.gradient(north), np.gradient(east)))
+    curvature = np.gradient(heading, s)
+    return {
+        'origin': origin, 's': s, 'east': east, 'north': north,
+        'heading': heading, 'curvature': curvature, 'length': s[-1],
+    }
+
+
+def trip_profile(length, max_speed, accel, decel, stations, dwell):
+    """Legs of one trip: equal spacing between ``stations`` intermediate stops.
+
+    Returns per-leg arrays (start distance, leg length, peak speed, phase
+    times) and the trip duration, ending with a dwell at the terminal.
+    """
+    legs = stations + 1
+    leg_length = np.full(legs, length / legs)
+    leg_start = np.arange(legs) * length / legs
+
+    # Trapezoid, or triangle when the leg is too short to reach max_speed
+    peak = np.minimum(max_speed, np.sqrt(2 * leg_length * accel * decel / (accel + decel)))
+    t_accel = peak / accel
+    t_decel = peak / decel
+    t_cruise = (leg_length - peak ** 2 / (2 * accel) - peak ** 2 / (2 * decel)) / peak
+    leg_duration = t_accel + t_cruise + t_decel + dwell
+    leg_time = np.concatenate([[0.0], np.cumsum(leg_duration)])
+    return {
+        'start': leg_start, 'length': leg_length, 'peak': peak,
+        't_accel': t_accel, 't_cruise': t_cruise, 't_decel': t_decel,
+        'time': leg_time, 'accel': accel, 'decel': decel, 'duration': leg_time[-1],
+    }
+
+
+def trip_motion(profile, tau):
+    """Distance, speed and acceleration along the trip at trip times tau."""
+    leg = np.clip(np.searchsorted(profile['time'], tau, side='right') - 1, 0, len(profile['peak']) - 1)
+    u = tau - profile['time'][leg]
+    peak, ta, tc, td = (profile[k][leg] for k in ('peak', 't_accel', 't_cruise', 't_decel'))
+    a, d = profile['accel'], profile['decel']
+    d_accel = 0.5 * a * ta ** 2
+    d_cruise = peak * tc
+
+    phase = np.select([u < ta, u < ta + tc, u < ta + tc + td], [0, 1, 2], 3)
+    u_decel = u - ta - tc
+    distance = np.choose(phase, [0.5 * a * u ** 2,
+                                 d_accel + peak * (u - ta),
+                                 d_accel + d_cruise + peak * u_decel - 0.5 * d * u_decel ** 2,
+                                 profile['length'][leg]])
+    speed = np.choose(phase, [a * u, peak, peak - d * u_decel, 0.0])
+    acceleration = np.choose(phase, [a, 0.0, -d, 0.0])
+    return profile['start'][leg] + distance, np.maximum(speed, 0.0), acceleration
+
+
+def simulate_truth(geometry, imu_rate=100.0, laps=1, max_speed=80 / 3.6, accel=0.8, decel=1.0,
+                   stations=10, dwell=30.0, start_dwell=10.0, start_time=0.0):
+    """Ground truth at the IMU rate for ``laps`` one-way trips.
+
+    Odd trips run the route backwards; between trips the train turns on
+    the spot (yaw +180 deg spread over the terminal dwell).
+    """
+    profile = trip_profile(geometry['length'], max_speed, accel, decel, stations, dwell)
+    trip = profile['duration']
+    count = int(round((start_dwell + laps * trip) * imu_rate)) + 1
+    t = np.arange(count) / imu_rate
+
+    moving_time = np.maximum(t - start_dwell, 0.0)
+    lap = np.minimum((moving_time // trip).astype(np.int64), laps - 1)
+    tau = moving_time - lap * trip
+    along, speed, acceleration = trip_motion(profile, tau)
+    acceleration = np.where(t < start_dwell, 0.0, acceleration)  # Standing before the first trip
+    reverse = lap % 2 == 1
+
+    # Position on the route and heading of the direction of travel
+    s_route = np.where(reverse, geometry['length'] - along, along)
+    east = np.interp(s_route, geometry['s'], geometry['east'])
+    north = np.interp(s_route, geometry['s'], geometry['north'])
+    heading = np.interp(s_route, geometry['s'], geometry['heading']) + np.pi * lap
+    curvature = np.interp(s_route, geometry['s'], geometry['curvature']) * np.where(reverse, -1.0, 1.0)
+
+    # Turning on the spot during the terminal dwell before the next trip
+    turn_start = trip - dwell
+    turning = (tau > turn_start) & (lap < laps - 1) & (moving_time > 0)
+    turn = np.where(turning, np.pi * (tau - turn_start) / dwell, 0.0)
+    heading = heading + turn
+    yaw_rate = curvature * speed + np.where(turning, np.pi / dwell, 0.0)
+
+    origin_lat, origin_lon = geometry['origin']
+    return {
+        'timestamp': start_time + t,
+        'lat': origin_lat + np.degrees(north / EARTH_RADIUS),
+        'lon': origin_lon + np.degrees(east / (EARTH_RADIUS * np.cos(np.radians(origin_lat)))),
+        'east': east, 'north': north,
+        'along_track': s_route,
+        'lap': lap,
+        'speed': speed,
+        'yaw': np.angle(np.exp(1j * heading)),
+        'yaw_rate': yaw_rate,
+        'accel_forward': acceleration,
+        'accel_lateral': curvature * speed ** 2,
+    }
+
+
+def synthesize_imu(truth, imu_rate, rng, acc_noise_density=0.003, gyro_noise_density=0.0003,
+                   acc_bias=0.05, gyro_bias=0.001, acc_random_walk=1e-4, gyro_random_walk=1e-5,
+                   vibration=0.0):
+    """Specific force (m/s^2) and angular rate (rad/s) in the body frame.
+
+    Noise densities are per sqrt(Hz), random walks per sqrt(s); the
+    turn-on biases are drawn once per axis with the given sigma.
+    vibration is the accelerometer ride vibration sigma per axis per m/s
+    of speed (0.006 matches the variance of data.csv at ~15 m/s); none at
+    standstill.
+    """
+    count = len(truth['timestamp'])
+    dt = 1.0 / imu_rate
+    acc = np.column_stack([truth['accel_forward'], truth['accel_lateral'], np.full(count, GRAVITY)])
+    gyro = np.column_stack([np.zeros(count), np.zeros(count), truth['yaw_rate']])
+
+    def gaussian(sigma):
+        # float32 draws are about twice as fast and ample for sensor noise
+        return rng.standard_normal((count, 3), dtype=np.float32) * np.float32(sigma)
+
+    acc += rng.normal(0.0, acc_bias, 3) + np.cumsum(gaussian(acc_random_walk * np.sqrt(dt)), axis=0, dtype=np.float64)
+    gyro += rng.normal(0.0, gyro_bias, 3) + np.cumsum(gaussian(gyro_random_walk * np.sqrt(dt)), axis=0, dtype=np.float64)
+    acc += gaussian(acc_noise_density * np.sqrt(imu_rate))
+    gyro += gaussian(gyro_noise_density * np.sqrt(imu_rate))
+    if vibration > 0:
+        acc += gaussian(vibration) * truth['speed'][:, np.newaxis].astype(np.float32)
+    return acc, gyro
+
+
+def tunnel_mask(truth, tunnels):
+    """True where the along-track position lies inside one of the (start, end) tunnels (m)."""
+    inside = np.zeros(len(truth['timestamp']), dtype=bool)
+    for start, end in tunnels:
+        inside |= (truth['along_track'] >= start) & (truth['along_track'] <= end)
+    return inside
+
+
+def random_tunnels(length, count, rng, min_length=300.0, max_length=2000.0):
+    """``count`` non-overlapping tunnels placed at random along the route."""
+    tunnels = []
+    for _ in range(100 * count):
+        if len(tunnels) == count:
+            break
+        tunnel_length = rng.uniform(min_length, max_length)
+        start = rng.uniform(0.05 * length, 0.95 * length - tunnel_length)
+        if all(start > end + 500.0 or start + tunnel_length < begin - 500.0 for begin, end in tunnels):
+            tunnels.append((start, start + tunnel_length))
+    return sorted(tunnels)
+
+
+def synthesize_gps(truth, imu_rate, rng, in_tunnel, gps_rate=1.0, satellites=10, satellite_std=1.5,
+                   gps_noise=2.5):
+    """GPS fixes every imu_rate / gps_rate samples outside tunnels.
+
+    Returns (fix rows, lat, lon, satellites). The horizontal noise sigma is
+    gps_noise at 10 satellites and scales with sqrt(10 / satellites).
+    """
+    step = max(int(round(imu_rate / gps_rate)), 1)
+    rows = np.arange(0, len(truth['timestamp']), step)
+    rows = rows[~in_tunnel[rows]]
+
+    sats = np.clip(np.round(rng.normal(satellites, satellite_std, len(rows))), 4, 24).astype(np.int32)
+    sigma = gps_noise * np.sqrt(10.0 / sats)
+    east = truth['east'][rows] + rng.normal(0.0, 1.0, len(rows)) * sigma
+    north = truth['north'][rows] + rng.normal(0.0, 1.0, len(rows)) * sigma
+
+    origin_lat = truth['lat'][0] - np.degrees(truth['north'][0] / EARTH_RADIUS)
+    origin_lon = truth['lon'][0] - np.degrees(truth['east'][0] / (EARTH_RADIUS * np.cos(np.radians(origin_lat))))
+    lat = origin_lat + np.degrees(north / EARTH_RADIUS)
+    lon = origin_lon + np.degrees(east / (EARTH_RADIUS * np.cos(np.radians(origin_lat))))
+    return rows, lat, lon, sats
+
+
+def generate(rail_lat, rail_lon, imu_rate=100.0, gps_rate=1.0, laps=1, seed=0, tunnels=None,
+             tunnel_count=2, start_time=1700000000.0, smoothing=20.0, **options):
+    """Sensor log DataFrame (data.csv schema) and ground-truth dict.
+
+    ``options`` go to simulate_truth (speed profile), synthesize_imu (noise
+    model) or synthesize_gps (satellites, GPS noise) by name.
+    """
+    rng = np.random.default_rng(seed)
+    truth_keys = ('max_speed', 'accel', 'decel', 'stations', 'dwell', 'start_dwell')
+    gps_keys = ('satellites', 'satellite_std', 'gps_noise')
+    truth_options = {k: v for k, v in options.items() if k in truth_keys}
+    gps_options = {k: v for k, v in options.items() if k in gps_keys}
+    imu_options = {k: v for k, v in options.items() if k not in truth_keys + gps_keys}
+
+    geometry = route_geometry(rail_lat, rail_lon, smoothing)
+    truth = simulate_truth(geometry, imu_rate, laps, start_time=start_time, **truth_options)
+    if tunnels is None:
+        tunnels = random_tunnels(geometry['length'], tunnel_count, rng)
+    in_tunnel = tunnel_mask(truth, tunnels)
+    truth['in_tunnel'] = in_tunnel
+
+    acc, gyro = synthesize_imu(truth, imu_rate, rng, **imu_options)
+    rows, lat, lon, sats = synthesize_gps(truth, imu_rate, rng, in_tunnel, gps_rate, **gps_options)
+
+    count = len(truth['timestamp'])
+    gps_lat = np.full(count, np.nan)
+    gps_lng = np.full(count, np.nan)
+    satellites = np.full(count, np.nan)
+    gps_lat[rows], gps_lng[rows], satellites[rows] = lat, lon, sats
+
+    log = pd.DataFrame({
+        'timestamp': (np.int64(round(start_time * 1e9))
+                      + np.round(np.arange(count) * (1e9 / imu_rate)).astype(np.int64)).astype('datetime64[ns]'),
+        'accel_x': acc[:, 0] / GRAVITY,
+        'accel_y': acc[:, 1] / GRAVITY,
+        'accel_z': acc[:, 2] / GRAVITY,
+        'gyro_x': gyro[:, 0],
+        'gyro_y': gyro[:, 1],
+        'gyro_z': gyro[:, 2],
+        'gps_lat': gps_lat,
+        'gps_lng': gps_lng,
+        'satellites': satellites,
+        'gps_available': ~in_tunnel,
+    })
+    truth['tunnels'] = tunnels
+    return log, truth
+
+
+def parse_tunnel(text):
+    start, end = text.split(':')
+    return float(start), float(end)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic IMU/GPS log along the railway')
+    parser.add_argument('--direction', choices=['up', 'down'], default='up',
+                        help='Railway direction: up (상행) or down (하행)')
+    parser.add_argument('--output', default='data/data_sim.csv', help='Sensor log to write (data.csv schema)')
+    parser.add_argument('--truth', default=None, help='Also write the ground truth to this CSV')
+    parser.add_argument('--imu-rate', type=float, default=100.0, help='IMU rate (Hz)')
+    parser.add_argument('--gps-rate', type=float, default=1.0, help='GPS rate (Hz)')
+    parser.add_argument('--laps', type=int, default=1, help='One-way trips (alternating direction)')
+    parser.add_argument('--max-speed', type=float, default=80.0, help='Maximum speed (km/h)')
+    parser.add_argument('--stations', type=int, default=10, help='Intermediate station stops per trip')
+    parser.add_argument('--dwell', type=float, default=30.0, help='Station dwell time (s)')
+    parser.add_argument('--satellites', type=float, default=10.0, help='Mean satellite count')
+    parser.add_argument('--gps-noise', type=float, default=2.5, help='GPS sigma at 10 satellites (m)')
+    parser.add_argument('--vibration', type=float, default=0.0,
+                        help='Accelerometer ride vibration sigma per m/s of speed (m/s^2 per m/s, 0.006: like data.csv)')
+    parser.add_argument('--tunnel', type=parse_tunnel, action='append', default=None,
+                        help='Tunnel as START:END along-track metres (repeatable)')
+    parser.add_argument('--tunnels', type=int, default=2, help='Random tunnels when --tunnel is not given')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    rail_lat, rail_lon = load_rail_file(args.direction)
+
+    start = time.perf_counter()
+    log, truth = generate(rail_lat, rail_lon, args.imu_rate, args.gps_rate, args.laps, args.seed,
+                          tunnels=args.tunnel, tunnel_count=args.tunnels,
+                          max_speed=args.max_speed / 3.6, stations=args.stations, dwell=args.dwell,
+                          satellites=args.satellites, gps_noise=args.gps_noise, vibration=args.vibration)
+    elapsed = time.perf_counter() - start
+    fixes = int(log['gps_lat'].notna().sum())
+    print(f"Generated {len(log)} IMU samples ({len(log) / elapsed / 1e6:.1f} M samples/s), {fixes} GPS fixes, "
+          f"{truth['timestamp'][-1] - truth['timestamp'][0]:.0f} s, tunnels at "
+          + ', '.join(f"{a:.0f}-{b:.0f} m" for a, b in truth['tunnels']))
+
+    log.to_csv(args.output, index=False)
+    print(f"Sensor log saved to {args.output}")
+    if args.truth:
+        pd.DataFrame({k: truth[k] for k in ('timestamp', 'lat', 'lon', 'east', 'north', 'along_track',
+                                            'speed', 'yaw', 'in_tunnel')}).to_csv(args.truth, index=False)
+        print(f"Ground truth saved to {args.truth}")
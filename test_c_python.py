@@ -1,19 +1,14 @@
-import ctypes
 import numpy as np
 import pandas as pd
 import platform
 import os
 import argparse
-from pathlib import Path
+import time
+
+import eskf_ext
+from eskf_ext import Eskf, IMU_DTYPE
 
-# Determine library extension based on platform
 system = platform.system()
-if system == 'Windows':
-    lib_ext = '.dll'
-elif system == 'Darwin':
-    lib_ext = '.dylib'
-else:
-    lib_ext = '.so'
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='ESKF C Test with Railway Direction')
@@ -21,99 +16,23 @@ parser.add_argument('--direction', choices=['up', 'down'], default='up',
                    help='Railway direction: up (상행) or down (하행)')
 args = parser.parse_args()
 
-lib_path = Path(__file__).parent / f'eskf{lib_ext}'
-
 print(f"Python-C ESKF Test")
 print(f"==================")
 print(f"Platform: {system}")
-print(f"Library path: {lib_path}")
 print(f"Railway Direction: {args.direction} ({'상행' if args.direction == 'up' else '하행'})")
 
-# Check if library exists
-if not lib_path.exists():
-    print(f"\nError: Library not found at {lib_path}")
-    print("Please compile the C library first:")
-    print("  Windows: cl /O2 /LD matrix.c eskf.c /Fe:eskf.dll")
-    print("  Linux/Mac: gcc -O2 -shared -fPIC matrix.c eskf.c -o eskf.so -lm")
+# Check if the extension is built
+if eskf_ext.lib is None:
+    print(f"\nError: ESKF extension module not found")
+    print("Please build it first:")
+    print("  python eskf_cffi_build.py")
     exit(1)
-
-# Load the library
-try:
-    eskf_lib = ctypes.CDLL(str(lib_path))
-    print(f"Library loaded successfully!")
-except Exception as e:
-    print(f"Failed to load library: {e}")
-    exit(1)
-
-# Define structures
-class Vec3(ctypes.Structure):
-    _fields_ = [("data", ctypes.c_float * 3)]
-
-class Mat3(ctypes.Structure):
-    _fields_ = [("data", (ctypes.c_float * 3) * 3)]
-
-class Mat15(ctypes.Structure):
-    _fields_ = [("data", (ctypes.c_float * 15) * 15)]
-
-class ImuData(ctypes.Structure):
-    _fields_ = [
-        ("timestamp", ctypes.c_double),
-        ("acc", Vec3),
-        ("gyro", Vec3)
-    ]
-
-class GpsData(ctypes.Structure):
-    _fields_ = [
-        ("timestamp", ctypes.c_double),
-        ("lat", ctypes.c_double),
-        ("lon", ctypes.c_double),
-        ("alt", ctypes.c_double),
-        ("cov", Mat3),
-        ("satellites", ctypes.c_int)
-    ]
-
-class EskfState(ctypes.Structure):
-    _fields_ = [
-        ("timestamp", ctypes.c_double),
-        ("lat", ctypes.c_double),
-        ("lon", ctypes.c_double),
-        ("alt", ctypes.c_double),
-        ("G_p_I", Vec3),
-        ("G_v_I", Vec3),
-        ("G_R_I", Mat3),
-        ("acc_bias", Vec3),
-        ("gyro_bias", Vec3),
-        ("cov", Mat15)
-    ]
-
-class RailNode(ctypes.Structure):
-    _fields_ = [
-        ("lat", ctypes.c_float),
-        ("lon", ctypes.c_float)
-    ]
-
-# Define function signatures
-eskf_lib.eskf_create.restype = ctypes.c_void_p
-eskf_lib.eskf_create.argtypes = []
-
-eskf_lib.eskf_destroy.restype = None
-eskf_lib.eskf_destroy.argtypes = [ctypes.c_void_p]
-
-eskf_lib.eskf_process_imu.restype = ctypes.c_int
-eskf_lib.eskf_process_imu.argtypes = [ctypes.c_void_p, ctypes.POINTER(ImuData)]
-
-eskf_lib.eskf_process_gps.restype = ctypes.c_int
-eskf_lib.eskf_process_gps.argtypes = [ctypes.c_void_p, ctypes.POINTER(GpsData)]
-
-eskf_lib.eskf_get_state.restype = None
-eskf_lib.eskf_get_state.argtypes = [ctypes.c_void_p, ctypes.POINTER(EskfState)]
-
-eskf_lib.eskf_load_rail_nodes.restype = ctypes.c_int
-eskf_lib.eskf_load_rail_nodes.argtypes = [ctypes.c_void_p, ctypes.POINTER(RailNode), ctypes.c_int]
+print(f"Extension loaded successfully!")
 
 # Create ESKF instance
-eskf = eskf_lib.eskf_create()
-if not eskf:
+try:
+    eskf = Eskf()
+except MemoryError:
     print("Failed to create ESKF instance")
     exit(1)
 
@@ -128,18 +47,15 @@ try:
         print(f"Warning: {railway_file} not found, using default railway_nodes.csv")
 
     rail_df = pd.read_csv(railway_file)
-    rail_nodes = (RailNode * len(rail_df))()
-    for i, row in rail_df.iterrows():
-        rail_nodes[i].lat = row['lat']
-        # Handle both 'lng' and 'lon' column names
-        if 'lng' in row:
-            rail_nodes[i].lon = row['lng']
-        elif 'lon' in row:
-            rail_nodes[i].lon = row['lon']
-        else:
-            raise ValueError("No longitude column found (expected 'lng' or 'lon')")
+    # Handle both 'lng' and 'lon' column names
+    if 'lng' in rail_df.columns:
+        rail_lon = rail_df['lng'].values
+    elif 'lon' in rail_df.columns:
+        rail_lon = rail_df['lon'].values
+    else:
+        raise ValueError("No longitude column found (expected 'lng' or 'lon')")
 
-    loaded = eskf_lib.eskf_load_rail_nodes(eskf, rail_nodes, len(rail_df))
+    loaded = eskf.load_rail_nodes(rail_df['lat'].values, rail_lon)
     print(f"Loaded {loaded} railway nodes from {railway_file}")
 except Exception as e:
     print(f"Railway nodes not loaded: {e}")
@@ -154,7 +70,7 @@ except FileNotFoundError:
     df = pd.read_csv('data/data.csv')
     print("Using original IMU data (data.csv)")
 
-df['timestamp'] = pd.to_datetime(df['timestamp']).astype(np.int64) / 1e9  # Convert to seconds
+df['timestamp'] = pd.to_datetime(df['timestamp']).astype('datetime64[ns]').astype(np.int64) / 1e9  # Convert to seconds
 
 print(f"Processing {len(df)} data points...")
 
@@ -173,36 +89,39 @@ gps_loss_indices = set(temp_df[temp_df['gps_available_loss'] == True].index.toli
 print(f"Found {len(gps_loss_indices)} gps_available True->False transitions at indices: {list(gps_loss_indices)}")
 initialization_marked = False
 
-for idx, row in df.iterrows():
-    # Process IMU
-    imu = ImuData()
-    imu.timestamp = row['timestamp']
-    imu.acc.data[0] = row['accel_x'] * 9.81
-    imu.acc.data[1] = row['accel_y'] * 9.81
-    imu.acc.data[2] = row['accel_z'] * 9.81
-    imu.gyro.data[0] = row['gyro_x']
-    imu.gyro.data[1] = row['gyro_y']
-    imu.gyro.data[2] = row['gyro_z']
-
-    success = eskf_lib.eskf_process_imu(eskf, ctypes.byref(imu))
-    if success:
-        imu_count += 1
+# IMU samples as one C-compatible array
+imu_data = np.zeros(len(df), dtype=IMU_DTYPE)
+imu_data['timestamp'] = df['timestamp'].values
+imu_data['acc'] = df[['accel_x', 'accel_y', 'accel_z']].values * 9.81
+imu_data['gyro'] = df[['gyro_x', 'gyro_y', 'gyro_z']].values
+
+# Rows where GPS is processed or the state is sampled
+gps_valid = (df['gps_lat'].notna() & df['gps_lng'].notna() & (df['gps_lat'] != 0)).values
+sample_rows = np.arange(len(df)) % 100 == 0
+sample_rows[list(gps_loss_indices)] = True
+stop_rows = np.flatnonzero(gps_valid | sample_rows)
+
+# GPS covariance (diagonal 25 m^2)
+gps_cov = np.eye(3) * 25.0
+
+state = None
+next_row = 0
+filter_time = 0.0  # Time spent in the filter calls only (reported for the server's throughput metric)
+for idx in stop_rows:
+    # Process IMU up to and including this row in one call
+    t_start = time.perf_counter()
+    imu_count += eskf.process_imu_array(imu_data[next_row:idx + 1])
+    filter_time += time.perf_counter() - t_start
+    next_row = idx + 1
+    row = df.iloc[idx]
 
     # Process GPS if available
-    if pd.notna(row['gps_lat']) and pd.notna(row['gps_lng']) and row['gps_lat'] != 0:
-        gps = GpsData()
-        gps.timestamp = row['timestamp']
-        gps.lat = row['gps_lat']
-        gps.lon = row['gps_lng']
-        gps.alt = 0
-        gps.satellites = int(row['satellites']) if not pd.isna(row['satellites']) else 0  # Add satellite count
-
-        # Set identity covariance
-        for i in range(3):
-            for j in range(3):
-                gps.cov.data[i][j] = 25.0 if i == j else 0.0
-
-        success = eskf_lib.eskf_process_gps(eskf, ctypes.byref(gps))
+    if gps_valid[idx]:
+        satellites = int(row['satellites']) if not pd.isna(row['satellites']) else 0  # Add satellite count
+        t_start = time.perf_counter()
+        success = eskf.process_gps(row['timestamp'], row['gps_lat'], row['gps_lng'],
+                                   alt=0, satellites=satellites, cov=gps_cov)
+        filter_time += time.perf_counter() - t_start
 
         if success:
             gps_count += 1
@@ -221,23 +140,13 @@ for idx, row in df.iterrows():
                 initialization_points.append(init_point)
                 print(f"ESKF Initialized at: {init_point['lat']:.6f}, {init_point['lon']:.6f}")
 
-            # GPS data processed successfully
-            pass
-        else:
-            # GPS processing failed but data was available
-            pass
-    else:
-        # No GPS data available
-        pass
-
     # Get state periodically or at GPS loss points
-    if idx % 100 == 0 or idx in gps_loss_indices:
-        state = EskfState()
-        eskf_lib.eskf_get_state(eskf, ctypes.byref(state))
+    if sample_rows[idx]:
+        state = eskf.get_state(state)
 
         if state.timestamp > 0:
             # Get current row for raw sensor data
-            current_row = df.iloc[min(idx, len(df)-1)]
+            current_row = row
 
             # Mark initialization only for the very first time
             is_init = 0
@@ -270,9 +179,14 @@ for idx, row in df.iterrows():
                 'is_gps_loss': is_loss
             })
 
+t_start = time.perf_counter()
+imu_count += eskf.process_imu_array(imu_data[next_row:])
+filter_time += time.perf_counter() - t_start
+
 print(f"\nProcessing complete:")
 print(f"  GPS updates: {gps_count}")
 print(f"  IMU updates: {imu_count}")
+print(f"  Filter time: {filter_time:.6f} s")
 print(f"  GPS available transitions (True->False): {len(gps_loss_indices)}")
 print(f"  Output points: {len(results)}")
 
@@ -290,5 +204,5 @@ if results:
     print(f"  Last GPS:   lat={results[-1]['gps_raw_lat']:.6f}, lon={results[-1]['gps_raw_lon']:.6f}")
 
 # Cleanup
-eskf_lib.eskf_destroy(eskf)
+eskf.close()
 print("\nTest completed!")
\ No newline at end of file